@@ -0,0 +1,216 @@
+import sqlite3
+import time
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import count, profile_from_env, traced
+from rollups import max_reading_id
+
+WINDOW_DAYS = 14
+BUCKET_MINUTES = 5
+BUCKETS = 24 * 60 // BUCKET_MINUTES  # 288 time-of-day buckets
+PERCENTILES = {'p05': 5, 'p25': 25, 'p50': 50, 'p75': 75, 'p95': 95}
+
+def create_agp_tables(conn):
+    """Create the agp_cache table and the agp_state watermark if they do not exist."""
+    columns = ",\n        ".join(f"{name} REAL" for name in PERCENTILES)
+    conn.execute(f'''
+    CREATE TABLE IF NOT EXISTS agp_cache (
+        series_id INTEGER,
+        window_end TEXT,
+        bucket INTEGER,
+        n INTEGER,
+        {columns},
+        FOREIGN KEY (series_id) REFERENCES series (series_id),
+        PRIMARY KEY (series_id, window_end, bucket)
+    )
+    ''')
+    conn.execute("CREATE TABLE IF NOT EXISTS agp_state (id INTEGER PRIMARY KEY CHECK (id = 0), through_id INTEGER)")
+    conn.commit()
+
+def _day_number(day):
+    return (np.asarray(day, dtype='datetime64[D]') - np.datetime64('1970-01-01', 'D')).astype(np.int64)
+
+def grouped_percentiles(group, values, percentiles):
+    """Linear-interpolated percentiles of values within each group, from one sort.
+
+    group must be non-negative integers. Returns the group ids, their sizes
+    and a (groups, len(percentiles)) array matching np.percentile.
+    """
+    order = np.lexsort((values, group))
+    group, values = group[order], values[order]
+    starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+    sizes = np.diff(np.r_[starts, len(group)])
+    result = np.empty((len(starts), len(percentiles)))
+    for j, q in enumerate(percentiles):
+        position = (sizes - 1) * (q / 100)
+        lo = np.floor(position).astype(np.int64)
+        hi = np.minimum(lo + 1, sizes - 1)
+        frac = position - lo
+        result[:, j] = values[starts + lo] * (1 - frac) + values[starts + hi] * frac
+    return group[starts], sizes, result
+
+@traced('agp.compute')
+def compute_agp(readings, window_ends):
+    """AGP percentile bands for every requested (series, window end day) in one pass.
+
+    readings has series_id, datetime and blood_glucose; window_ends maps
+    series_id to the last days (datetime64[D]) of the windows to compute.
+    Each reading is replicated into the (up to WINDOW_DAYS) windows that
+    contain its day and binned by time of day, then a single sort yields
+    every (window, bucket) group's percentiles.
+    """
+    series_ids = np.array(sorted(window_ends), dtype=np.int64)
+    if len(series_ids) == 0 or readings.empty:
+        return pd.DataFrame(columns=['series_id', 'window_end', 'bucket', 'n', *PERCENTILES])
+    base = min(_day_number(min(ends)) for ends in window_ends.values()) - WINDOW_DAYS
+    span = max(_day_number(max(ends)) for ends in window_ends.values()) - base + 1
+
+    # Window keys: series position * span + (end day - base)
+    wanted = np.unique(np.concatenate([
+        i * span + (_day_number(window_ends[sid]) - base)
+        for i, sid in enumerate(series_ids)
+    ]))
+
+    times = readings['datetime'].values.astype('datetime64[m]')
+    days = times.astype('datetime64[D]')
+    day_number = (days - np.datetime64('1970-01-01', 'D')).astype(np.int64)
+    bucket = ((times - days).astype(np.int64) // BUCKET_MINUTES).astype(np.int64)
+    series_pos = np.searchsorted(series_ids, readings['series_id'].values)
+    bg = readings['blood_glucose'].values.astype(np.float64)
+
+    keys, buckets, values = [], [], []
+    for offset in range(WINDOW_DAYS):
+        # A reading on day d belongs to the windows ending on d .. d + WINDOW_DAYS - 1
+        key = series_pos * span + (day_number + offset - base)
+        keep = np.isin(key, wanted)
+        keys.append(key[keep])
+        buckets.append(bucket[keep])
+        values.append(bg[keep])
+    key = np.concatenate(keys)
+    group = key * BUCKETS + np.concatenate(buckets)
+    group_ids, sizes, bands = grouped_percentiles(group, np.concatenate(values), list(PERCENTILES.values()))
+    count('agp.readings_binned', len(key))
+
+    window_key, bucket_ids = np.divmod(group_ids, BUCKETS)
+    series_idx, end_offset = np.divmod(window_key, span)
+    result = pd.DataFrame({
+        'series_id': series_ids[series_idx],
+        'window_end': (end_offset + base).astype('datetime64[D]'),
+        'bucket': bucket_ids,
+        'n': sizes,
+    })
+    for j, name in enumerate(PERCENTILES):
+        result[name] = bands[:, j]
+    return result
+
+def series_windows(first_day, last_day):
+    """Window end days for a series: every day from its first full window (or last day) onward."""
+    first_end = min(first_day + timedelta(days=WINDOW_DAYS - 1), last_day)
+    return np.arange(np.datetime64(first_end, 'D'), np.datetime64(last_day, 'D') + 1)
+
+@traced('agp.refresh')
+def refresh_agp(conn, rebuild=False):
+    """Recompute only the AGP windows touched by readings added since the last refresh.
+
+    A new reading on day d affects the windows ending on d .. d + 13; those
+    (and any windows a series has newly grown into) are recomputed, every
+    other cached window is left as it is. Cached windows a touched series no
+    longer has (such as the partial window of a series that was shorter than
+    WINDOW_DAYS) are deleted; rebuild clears the whole cache first.
+    """
+    create_agp_tables(conn)
+    row = conn.execute("SELECT through_id FROM agp_state WHERE id = 0").fetchone()
+    since_id = 0 if rebuild or row is None else row[0]
+    through_id = max_reading_id(conn)
+    spans = conn.execute(
+        "SELECT series_id, MIN(datetime), MAX(datetime) FROM cgm_data WHERE id > ? AND id <= ? GROUP BY series_id",
+        (since_id, through_id)
+    ).fetchall()
+
+    if since_id == 0:
+        conn.execute("DELETE FROM agp_cache")
+
+    window_ends, ranges = {}, {}
+    for series_id, first_new, last_new in spans:
+        first_day, last_day = (date.fromisoformat(d[:10]) for d in conn.execute(
+            "SELECT MIN(datetime), MAX(datetime) FROM cgm_data WHERE series_id = ?", (series_id,)).fetchone())
+        ends = series_windows(first_day, last_day)
+        # A series' window ends are consecutive days, so anything cached outside them is stale
+        conn.execute("DELETE FROM agp_cache WHERE series_id = ? AND (window_end < ? OR window_end > ?)",
+                     (series_id, str(ends[0]), str(ends[-1])))
+        touched_from = np.datetime64(first_new[:10], 'D')
+        touched_to = np.datetime64(last_new[:10], 'D') + WINDOW_DAYS - 1
+        ends = ends[(ends >= touched_from) & (ends <= touched_to)]
+        if len(ends):
+            window_ends[series_id] = ends
+            ranges[series_id] = (str(ends[0] - (WINDOW_DAYS - 1)), str(ends[-1] + 1))
+
+    frames = [pd.read_sql("SELECT series_id, datetime, blood_glucose FROM cgm_data "
+                          "WHERE series_id = ? AND datetime >= ? AND datetime < ? AND blood_glucose IS NOT NULL",
+                          conn, params=(series_id, start, end))
+              for series_id, (start, end) in ranges.items()]
+    readings = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(
+        columns=['series_id', 'datetime', 'blood_glucose'])
+    readings['datetime'] = pd.to_datetime(readings['datetime'], format='ISO8601')
+    result = compute_agp(readings, window_ends)
+
+    for series_id, ends in window_ends.items():
+        conn.executemany("DELETE FROM agp_cache WHERE series_id = ? AND window_end = ?",
+                         [(series_id, str(e)) for e in ends])
+    conn.executemany(
+        f"INSERT INTO agp_cache (series_id, window_end, bucket, n, {', '.join(PERCENTILES)}) "
+        f"VALUES ({', '.join('?' * (4 + len(PERCENTILES)))})",
+        zip(result['series_id'].astype(int), result['window_end'].astype(str), result['bucket'].astype(int),
+            result['n'].astype(int), *(result[name].astype(float) for name in PERCENTILES))
+    )
+    conn.execute("INSERT OR REPLACE INTO agp_state (id, through_id) VALUES (0, ?)", (through_id,))
+    conn.commit()
+    n_windows = sum(len(ends) for ends in window_ends.values())
+    count('agp.windows_computed', n_windows)
+    return n_windows
+
+def agp_report(conn, series_id, window_end=None):
+    """Cached percentile bands of one window (the latest by default), indexed by time of day."""
+    if window_end is None:
+        window_end = conn.execute("SELECT MAX(window_end) FROM agp_cache WHERE series_id = ?",
+                                  (series_id,)).fetchone()[0]
+    df = pd.read_sql(f"SELECT bucket, n, {', '.join(PERCENTILES)} FROM agp_cache "
+                     "WHERE series_id = ? AND window_end = ? ORDER BY bucket", conn, params=(series_id, str(window_end)))
+    minutes = df.pop('bucket') * BUCKET_MINUTES
+    df.index = [f"{m // 60:02d}:{m % 60:02d}" for m in minutes]
+    df.index.name = 'time_of_day'
+    return df
+
+def pandas_agp(readings, series_id, window_end):
+    """Per-patient groupby-quantile reference for one window."""
+    end = pd.Timestamp(window_end) + pd.Timedelta(days=1)
+    s = readings[(readings['series_id'] == series_id) & (readings['datetime'] >= end - pd.Timedelta(days=WINDOW_DAYS))
+                 & (readings['datetime'] < end)]
+    minutes = s['datetime'].dt.hour * 60 + s['datetime'].dt.minute
+    q = s.groupby(minutes // BUCKET_MINUTES)['blood_glucose'].quantile([p / 100 for p in PERCENTILES.values()])
+    return q.unstack()
+
+def main():
+    profile_from_env()
+    # Configuration
+    db_name = "cgm_light.db"
+
+    conn = sqlite3.connect(db_name)
+    start = time.perf_counter()
+    n_windows = refresh_agp(conn)
+    print(f"Computed {n_windows} new 14-day AGP windows in {time.perf_counter() - start:.2f}s")
+    total = conn.execute("SELECT COUNT(*) FROM (SELECT DISTINCT series_id, window_end FROM agp_cache)").fetchone()[0]
+    print(f"{total} windows cached")
+
+    series_id = conn.execute("SELECT MIN(series_id) FROM agp_cache").fetchone()[0]
+    if series_id is not None:
+        report = agp_report(conn, series_id)
+        print(f"\nLatest AGP for series {series_id} (hourly rows):")
+        print(report.iloc[::12].round(1).to_string())
+    conn.close()
+
+if __name__ == "__main__":
+    main()
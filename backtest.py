@@ -0,0 +1,180 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+
+from forecast import FEATURES, HORIZON_STEPS, TARGET, cached_features, encode_features
+
+# Features are loaded once per worker process and shared by all of its folds
+_worker_features = None
+
+def add_horizon_targets(df_ml, horizons):
+    """Add one target column per forecast horizon (in 5-minute steps)."""
+    df_ml = df_ml.copy()
+    grouped = df_ml.groupby('series_id')['blood_glucose']
+    for h in horizons:
+        df_ml[f'target_{h}'] = grouped.shift(-h)
+    return df_ml.dropna().reset_index(drop=True)
+
+def assign_positions(df_ml):
+    """Relative position (0-1) of every row within its own series.
+
+    Series cover different calendar periods, so folds are cut at the same
+    relative point in each series rather than at one global timestamp.
+    """
+    grouped = df_ml.groupby('series_id')
+    return grouped.cumcount() / grouped['series_id'].transform('size')
+
+def make_folds(n_folds=5, initial_train=0.5):
+    """Rolling-origin (origin, end) pairs covering the tail of every series."""
+    step = (1 - initial_train) / n_folds
+    return [(initial_train + i * step, initial_train + (i + 1) * step) for i in range(n_folds)]
+
+def _init_worker(features_path):
+    global _worker_features
+    _worker_features = pd.read_pickle(features_path)
+
+def fit_fold(df_ml, origin, end, target_cols, max_horizon, model_params, features=FEATURES):
+    """Train on everything before the origin and predict the slice [origin, end) of each series.
+
+    Returns the test rows and a (rows, targets) prediction array.
+    """
+    position = df_ml['position']
+
+    # Purge the rows just before the origin whose targets fall inside the test slice
+    purge = max_horizon / df_ml.groupby('series_id')['series_id'].transform('size')
+    train = df_ml[position < origin - purge]
+    test = df_ml[(position >= origin) & (position < end)]
+
+    X_train = encode_features(train[features])
+    X_test = encode_features(test[features], list(X_train.columns))
+
+    # A multi-output forest predicts every horizon from one fit
+    model = RandomForestRegressor(random_state=42, n_jobs=1, **model_params)
+    y_train = train[target_cols].values
+    model.fit(X_train, y_train[:, 0] if len(target_cols) == 1 else y_train)
+    return test, model.predict(X_test).reshape(len(test), len(target_cols))
+
+def run_fold(fold_id, origin, end, horizons, model_params, features=FEATURES):
+    """Errors of one fold's forecasts at every horizon."""
+    target_cols = [f'target_{h}' for h in horizons]
+    test, preds = fit_fold(_worker_features, origin, end, target_cols, max(horizons), model_params, features)
+
+    # Long format: one row per (test row, horizon)
+    return pd.DataFrame({
+        'fold': fold_id,
+        'series_id': np.repeat(test['series_id'].values, len(horizons)),
+        'horizon_min': np.tile(np.array(horizons) * 5, len(test)),
+        'error': (preds - test[target_cols].values).ravel(),
+    })
+
+def summarize_errors(errors):
+    """Per-series and per-horizon MAE/RMSE computed with groupby."""
+    errors = errors.assign(abs_error=errors['error'].abs(), sq_error=errors['error'] ** 2)
+    summary = errors.groupby(['series_id', 'horizon_min']).agg(
+        n=('error', 'size'),
+        bias=('error', 'mean'),
+        mae=('abs_error', 'mean'),
+        mse=('sq_error', 'mean'),
+    )
+    summary['rmse'] = np.sqrt(summary.pop('mse'))
+
+    overall = errors.groupby('horizon_min').agg(mae=('abs_error', 'mean'), mse=('sq_error', 'mean'))
+    overall['rmse'] = np.sqrt(overall.pop('mse'))
+    return summary.reset_index(), overall.reset_index()
+
+def backtest(df_ml, model_params, horizons=(1, 3, HORIZON_STEPS), n_folds=5, max_workers=None,
+             cache_dir="cache", features=FEATURES):
+    """Walk-forward backtest with one fold per worker process."""
+    df_ml = add_horizon_targets(df_ml, horizons)
+    df_ml['position'] = assign_positions(df_ml)
+
+    folds = [(i, origin, end, list(horizons), model_params, list(features))
+             for i, (origin, end) in enumerate(make_folds(n_folds))]
+    errors = pd.concat(map_folds(df_ml, run_fold, folds, max_workers, cache_dir), ignore_index=True)
+    return summarize_errors(errors)
+
+def run_fold_predictions(fold_id, origin, end, model_params, features=FEATURES):
+    """One fold's out-of-sample TARGET predictions, indexed by feature row."""
+    test, preds = fit_fold(_worker_features, origin, end, [TARGET], HORIZON_STEPS, model_params, features)
+    return pd.Series(preds[:, 0], index=test.index)
+
+def out_of_sample_predictions(df_ml, model_params, n_folds=5, max_workers=None, cache_dir="cache",
+                              features=FEATURES):
+    """Walk-forward TARGET predictions aligned with df_ml's rows.
+
+    Each row in a fold's test slice is predicted by a model trained only on
+    earlier rows; rows before the first origin are NaN.
+    """
+    prepared = df_ml.reset_index(drop=True)
+    prepared['position'] = assign_positions(prepared)
+    folds = [(i, origin, end, model_params, list(features)) for i, (origin, end) in enumerate(make_folds(n_folds))]
+    preds = pd.concat(map_folds(prepared, run_fold_predictions, folds, max_workers, cache_dir))
+    return preds.reindex(prepared.index).values
+
+def series_out_of_sample_predictions(df_series, model_params, n_folds=5, features=FEATURES):
+    """Walk-forward TARGET predictions for one series from models trained on that series alone.
+
+    Unlike out_of_sample_predictions, the result depends only on this
+    series' rows, so it can be cached per series. Folds without training
+    rows (very short series) stay NaN.
+    """
+    prepared = df_series.reset_index(drop=True)
+    prepared['position'] = assign_positions(prepared)
+    preds = np.full(len(prepared), np.nan)
+    for origin, end in make_folds(n_folds):
+        if not (prepared['position'] < origin - HORIZON_STEPS / len(prepared)).any():
+            continue
+        test, fold_preds = fit_fold(prepared, origin, end, [TARGET], HORIZON_STEPS, model_params, features)
+        preds[test.index] = fold_preds[:, 0]
+    return preds
+
+def map_folds(df_ml, fn, folds, max_workers=None, cache_dir="cache"):
+    """Run fn(*fold) for every fold in worker processes that share df_ml; returns the results in order."""
+    # Workers read the prepared frame from disk instead of receiving a pickled copy per fold
+    os.makedirs(cache_dir, exist_ok=True)
+    features_path = os.path.join(cache_dir, f"backtest_features_{os.getpid()}.pkl")
+    df_ml.to_pickle(features_path)
+
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                 initargs=(features_path,)) as executor:
+            futures = [executor.submit(fn, *fold) for fold in folds]
+            return [f.result() for f in futures]
+    finally:
+        os.remove(features_path)
+
+def main():
+    # Configuration
+    db_name = "cgm_light.db"
+    output_dir = "backtest_results"
+    n_folds = 5
+    candidates = {
+        'rf_100_depth10': {'n_estimators': 100, 'max_depth': 10, 'max_features': 'sqrt'},
+        'rf_100_depth20': {'n_estimators': 100, 'max_depth': 20, 'min_samples_split': 5, 'max_features': 'sqrt'},
+    }
+
+    df_ml = cached_features(db_name)
+    os.makedirs(output_dir, exist_ok=True)
+
+    comparison = []
+    for name, params in candidates.items():
+        start = time.perf_counter()
+        per_series, overall = backtest(df_ml, params, n_folds=n_folds)
+        elapsed = time.perf_counter() - start
+
+        per_series.to_csv(f'{output_dir}/{name}_per_series.csv', index=False)
+        print(f"\n{name}: {n_folds} folds in {elapsed:.1f}s")
+        print(overall.to_string(index=False))
+        comparison.append(overall.assign(model=name))
+
+    comparison_df = pd.concat(comparison).pivot(index='horizon_min', columns='model', values='rmse')
+    print("\nRMSE by horizon (minutes):")
+    print(comparison_df)
+    comparison_df.to_csv(f'{output_dir}/comparison.csv')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import json
+import os
+import sqlite3
+import subprocess
+import time
+from datetime import datetime
+from glob import glob
+
+import ingest_dataset_1
+import ingest_kaggle_dataset
+import ingest_libre
+import ingest_tandem
+from find_anomalies import (dbscan_anomalies, isolation_forest_anomalies, kmeans_anomalies,
+                            load_cgm_data, prepare_series, z_score_anomalies)
+from forecast import build_features, resample_series, train_forecaster
+from forecast import load_cgm_data as load_forecast_data
+from generate_synthetic import FORMATS, generate_cohort
+from matrix_profile import matrix_profile_anomalies
+
+# Loader module for each synthetic input format
+LOADERS = {
+    'kaggle': ingest_kaggle_dataset,
+    'libre': ingest_libre,
+    'tandem': ingest_tandem,
+    'dataset_1': ingest_dataset_1,
+}
+DETECTORS = {
+    'z_score': z_score_anomalies,
+    'isolation_forest': isolation_forest_anomalies,
+    'dbscan': lambda df: dbscan_anomalies(df, eps=1.0, min_samples=5),
+    'kmeans': lambda df: kmeans_anomalies(df, plot_path=None),
+    'matrix_profile': matrix_profile_anomalies,
+}
+# A run is flagged when a timing is this much slower than the previous run at the same scale
+# (ignoring differences below MIN_REGRESSION_SECONDS, which are timer noise)
+REGRESSION_TOLERANCE = 0.2
+MIN_REGRESSION_SECONDS = 0.05
+
+def timed(results, scale, name, fn, rows=None):
+    """Run fn, record its wall time under name and return its result."""
+    start = time.perf_counter()
+    value = fn()
+    seconds = time.perf_counter() - start
+    results.append({'scale': scale, 'name': name, 'seconds': seconds, 'rows': rows})
+    print(f"  {name}: {seconds:.3f}s" + (f" ({rows} rows)" if rows is not None else ""))
+    return value
+
+def ingest_cohort(db_name, layout):
+    """Load every synthetic patient through its format's loader, one series per patient."""
+    conn = ingest_tandem.create_database(db_name)
+    cursor = conn.cursor()
+    for fmt, patient_dirs in layout.items():
+        for patient_dir in patient_dirs:
+            cursor.execute("INSERT INTO series DEFAULT VALUES")
+            series_id = cursor.lastrowid
+            conn.commit()
+            for csv_file in sorted(glob(os.path.join(patient_dir, "*.csv"))):
+                LOADERS[fmt].process_csv_file(csv_file, series_id, conn)
+    n_rows = conn.execute("SELECT COUNT(*) FROM cgm_data").fetchone()[0]
+    conn.close()
+    return n_rows
+
+def query_series(db_name):
+    """Read every series back individually, as the per-series tools do."""
+    conn = sqlite3.connect(db_name)
+    series_ids = [row[0] for row in conn.execute("SELECT series_id FROM series")]
+    n_rows = 0
+    for series_id in series_ids:
+        n_rows += len(conn.execute(
+            "SELECT datetime, blood_glucose FROM cgm_data WHERE series_id = ? ORDER BY datetime",
+            (series_id,)).fetchall())
+    conn.close()
+    return n_rows
+
+def run_scale(scale, work_dir, base_patients, n_days, max_detector_series, forecaster_params):
+    """Generate, ingest and exercise one cohort size; returns the timing records."""
+    results = []
+    n_patients = base_patients * scale
+    data_dir = os.path.join(work_dir, f"data_{n_patients}x{n_days}")
+    db_name = os.path.join(work_dir, f"bench_{n_patients}x{n_days}.db")
+    print(f"Scale {scale}x: {n_patients} patients x {n_days} days per format")
+
+    # The generator is deterministic, so existing data for this size is reused
+    if not os.path.isdir(data_dir):
+        timed(results, scale, 'generate', lambda: generate_cohort(data_dir, n_patients, n_days))
+    layout = {fmt: sorted(glob(os.path.join(data_dir, fmt, "patient_*"))) for fmt in FORMATS}
+
+    if os.path.exists(db_name):
+        os.remove(db_name)
+    n_readings = timed(results, scale, 'ingest', lambda: ingest_cohort(db_name, layout))
+    results[-1]['rows'] = n_readings
+    timed(results, scale, 'query_per_series', lambda: query_series(db_name), rows=n_readings)
+
+    df = load_cgm_data(db_name)
+    series_ids = sorted(df['series_id'].unique())[:max_detector_series]
+    frames = timed(results, scale, 'prepare_series',
+                   lambda: [prepare_series(df, sid) for sid in series_ids])
+    n_detector_rows = sum(len(frame) for frame in frames)
+    results[-1]['rows'] = n_detector_rows
+    for name, detector in DETECTORS.items():
+        timed(results, scale, f'detector_{name}',
+              lambda: [detector(frame.copy()) for frame in frames], rows=n_detector_rows)
+
+    df_ml = timed(results, scale, 'build_features',
+                  lambda: build_features(resample_series(load_forecast_data(db_name))))
+    results[-1]['rows'] = len(df_ml)
+    timed(results, scale, 'train_forecaster', lambda: train_forecaster(df_ml, **forecaster_params),
+          rows=len(df_ml))
+    return results
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def load_runs(results_path):
+    """All recorded runs, oldest first."""
+    if not os.path.exists(results_path):
+        return []
+    with open(results_path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def save_run(results_path, run):
+    """Append one run (a JSON line) to the results history."""
+    os.makedirs(os.path.dirname(results_path) or '.', exist_ok=True)
+    with open(results_path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(run) + "\n")
+
+def compare_runs(previous, current, tolerance=REGRESSION_TOLERANCE):
+    """Timings of current relative to previous for the same (scale, name), flagging regressions."""
+    before = {(r['scale'], r['name']): r['seconds'] for r in previous['results']}
+    comparison = []
+    for r in current['results']:
+        key = (r['scale'], r['name'])
+        if key not in before or before[key] == 0:
+            continue
+        ratio = r['seconds'] / before[key]
+        comparison.append({'scale': r['scale'], 'name': r['name'], 'previous': before[key],
+                           'current': r['seconds'], 'ratio': ratio,
+                           'regression': (ratio > 1 + tolerance
+                                          and r['seconds'] - before[key] > MIN_REGRESSION_SECONDS)})
+    return comparison
+
+def main():
+    # Configuration
+    scales = (1, 10, 100)
+    base_patients = 2  # patients per format at 1x
+    n_days = 14
+    max_detector_series = 20  # detectors are per-series, so time them on a bounded sample
+    forecaster_params = {'n_estimators': 50}
+    work_dir = "cache/benchmark"
+    results_path = "benchmarks/results.jsonl"
+
+    os.makedirs(work_dir, exist_ok=True)
+    run = {
+        'timestamp': datetime.now().isoformat(),
+        'revision': git_revision(),
+        'config': {'base_patients': base_patients, 'n_days': n_days,
+                   'max_detector_series': max_detector_series, 'forecaster_params': forecaster_params},
+        'results': [],
+    }
+    for scale in scales:
+        run['results'].extend(run_scale(scale, work_dir, base_patients, n_days,
+                                        max_detector_series, forecaster_params))
+        # The databases are only needed for the current scale
+        for db_file in glob(os.path.join(work_dir, "bench_*.db")):
+            os.remove(db_file)
+
+    runs = [r for r in load_runs(results_path) if r['config'] == run['config']]
+    save_run(results_path, run)
+    print(f"\nResults appended to {results_path}")
+
+    if runs:
+        print(f"\nCompared with run {runs[-1]['timestamp']} ({runs[-1]['revision']}):")
+        for row in compare_runs(runs[-1], run):
+            flag = "  REGRESSION" if row['regression'] else ""
+            print(f"  {row['scale']:>4}x {row['name']:<28} {row['previous']:8.3f}s -> "
+                  f"{row['current']:8.3f}s ({row['ratio']:.2f}x){flag}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import importlib
+import re
+import time
+from pathlib import Path
+
+from episodes import refresh_episodes
+from ingest_daemon import RowCollector
+from ingest_tandem import create_database
+from instrumentation import count, profile_from_env, span, traced
+from rollups import max_reading_id, refresh_rollups
+
+# Reading tables merged through staging; all are UNIQUE(datetime, series_id)
+STAGED_TABLES = ('cgm_data', 'bolus_data', 'basal_data', 'food_data')
+DEDUP_KEY = ('datetime', 'series_id')
+INSERT_PATTERN = re.compile(r'^\s*INSERT OR IGNORE INTO (\w+) \(([^)]*)\)', re.IGNORECASE)
+
+def collect_rows(loader_name, files, series_id):
+    """Parse files with a loader's process_csv_file into one RowCollector, without touching the database."""
+    loader = importlib.import_module(loader_name)
+    collector = RowCollector()
+    for path in files:
+        with span('ingest.file', file=str(path)):
+            loader.process_csv_file(str(path), series_id, collector)
+    return collector
+
+def stage_rows(conn, statements):
+    """Copy parsed reading rows into unindexed temp tables; other statements run directly.
+
+    Returns {table: (stage table, columns)} for the tables that got rows.
+    """
+    staged = {}
+    for sql, rows in statements.items():
+        match = INSERT_PATTERN.match(sql)
+        if match is None or match.group(1) not in STAGED_TABLES:
+            conn.executemany(sql, rows)
+            continue
+        table = match.group(1)
+        columns = tuple(c.strip() for c in match.group(2).split(','))
+        stage = f"stage_{table}"
+        if table not in staged:
+            conn.execute(f"DROP TABLE IF EXISTS temp.{stage}")
+            conn.execute(f"CREATE TEMP TABLE {stage} ({', '.join(columns)})")
+            staged[table] = (stage, columns)
+        elif staged[table][1] != columns:
+            raise ValueError(f"{table} rows staged with different columns: {staged[table][1]} and {columns}")
+        conn.executemany(f"INSERT INTO temp.{stage} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                         rows)
+        count('bulk_load.rows_staged', len(rows))
+    return staged
+
+def deferrable_indexes(conn, table):
+    """(name, sql) of a table's explicit indexes; UNIQUE constraint indexes cannot be dropped."""
+    return conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? "
+                        "AND sql IS NOT NULL", (table,)).fetchall()
+
+def merge_staged(conn, table, stage, columns):
+    """Deduplicate a stage table and merge it into its table with one INSERT ... SELECT.
+
+    The first staged row of each (datetime, series_id) wins, as with
+    row-by-row INSERT OR IGNORE; rows sort in the UNIQUE index's key order so
+    the index is built by appending. When the table is empty, its explicit
+    indexes are dropped first and rebuilt once at the end.
+    Returns (rows staged, rows inserted).
+    """
+    n_staged = conn.execute(f"SELECT COUNT(*) FROM temp.{stage}").fetchone()[0]
+    first_load = conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone() is None
+    indexes = deferrable_indexes(conn, table) if first_load else []
+    for name, _ in indexes:
+        conn.execute(f"DROP INDEX {name}")
+
+    before = conn.total_changes
+    key = ', '.join(DEDUP_KEY)
+    conn.execute(f'''
+    INSERT OR IGNORE INTO {table} ({', '.join(columns)})
+    SELECT {', '.join(columns)} FROM temp.{stage}
+    WHERE rowid IN (SELECT MIN(rowid) FROM temp.{stage} GROUP BY {key})
+    ORDER BY {key}
+    ''')
+    inserted = conn.total_changes - before
+
+    for _, sql in indexes:
+        conn.execute(sql)
+    conn.execute(f"DROP TABLE temp.{stage}")
+    return n_staged, inserted
+
+@traced('bulk_load.load')
+def bulk_load(conn, loader_name, files, series_id):
+    """Load files into one series in staged mode; returns {table: {'staged', 'inserted', 'duplicates'}}.
+
+    Duplicates counts rows dropped either because they repeat within the
+    load (e.g. overlapping exports) or because they are already stored.
+    """
+    collector = collect_rows(loader_name, files, series_id)
+    last_id = max_reading_id(conn)
+    report = {}
+    with span('bulk_load.merge'):
+        staged = stage_rows(conn, collector.statements)
+        for table, (stage, columns) in staged.items():
+            n_staged, inserted = merge_staged(conn, table, stage, columns)
+            report[table] = {'staged': n_staged, 'inserted': inserted, 'duplicates': n_staged - inserted}
+            count('bulk_load.duplicates', n_staged - inserted)
+        conn.commit()
+    refresh_rollups(conn, last_id)
+    refresh_episodes(conn, last_id)
+    return report
+
+def main():
+    profile_from_env()
+    # Configuration
+    db_name = "cgm.db"
+    csv_directory = "./input_data/personal_data"
+    loader_name = "ingest_tandem"
+    pattern = "CSV_*.csv"
+
+    files = sorted(Path(csv_directory).glob(pattern))
+    if not files:
+        print(f"No CSV files found in {csv_directory}")
+        return
+
+    conn = create_database(db_name)
+    series_id = conn.execute("INSERT INTO series DEFAULT VALUES").lastrowid
+    conn.commit()
+
+    start = time.perf_counter()
+    report = bulk_load(conn, loader_name, files, series_id)
+    print(f"Staged load of {len(files)} files from {csv_directory} into {db_name} "
+          f"(series {series_id}) in {time.perf_counter() - start:.2f}s")
+    for table, counts in report.items():
+        print(f"  {table}: {counts['staged']} staged, {counts['inserted']} inserted, "
+              f"{counts['duplicates']} duplicates dropped")
+    conn.close()
+
+if __name__ == "__main__":
+    main()
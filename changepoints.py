@@ -0,0 +1,207 @@
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import count, profile_from_env, traced
+
+RESAMPLE = '1h'          # change points are searched on hourly mean glucose
+MIN_SEGMENT_HOURS = 24   # calibration shifts and sensor swaps last days, not hours
+SENSOR_GAP_HOURS = 2     # a gap this long (sensor warm-up) always starts a new segment
+PENALTY_SCALE = 10.0     # penalty per change point, in multiples of log(n)
+VAR_FLOOR = 1.0          # mg/dL^2, keeps flat stretches from dominating the cost
+
+def create_segments_table(conn):
+    """Create the series_segments table if it does not exist."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS series_segments (
+        series_id INTEGER,
+        segment INTEGER,
+        start TEXT,
+        end TEXT,
+        n_readings INTEGER,
+        mean_bg REAL,
+        std_bg REAL,
+        FOREIGN KEY (series_id) REFERENCES series (series_id),
+        UNIQUE(series_id, segment)
+    )
+    ''')
+    conn.commit()
+
+def pelt(signal, penalty, min_size):
+    """Optimal change points of a Gaussian mean-and-variance model (PELT).
+
+    Segment costs come from cumulative sums in O(1), and candidates that can
+    no longer start the last segment of an optimal split are pruned, so the
+    search is close to linear in len(signal). Returns the start index of
+    every segment after the first.
+    """
+    x = np.asarray(signal, dtype=np.float64)
+    n = len(x)
+    if n < 2 * min_size:
+        return []
+    s1 = np.concatenate(([0.0], np.cumsum(x)))
+    s2 = np.concatenate(([0.0], np.cumsum(x * x)))
+
+    def cost(starts, t):
+        length = t - starts
+        mean = (s1[t] - s1[starts]) / length
+        var = (s2[t] - s2[starts]) / length - mean * mean
+        return length * np.log(np.maximum(var, VAR_FLOOR))
+
+    F = np.full(n + 1, np.inf)
+    F[0] = -penalty
+    last = np.zeros(n + 1, dtype=np.int64)
+    candidates = np.array([0], dtype=np.int64)
+    for t in range(min_size, n + 1):
+        # t - min_size becomes a possible segment start once it has an optimal split itself
+        new = t - min_size
+        if new >= min_size and np.isfinite(F[new]):
+            candidates = np.append(candidates, new)
+        totals = F[candidates] + cost(candidates, t)
+        best = int(np.argmin(totals))
+        F[t] = totals[best] + penalty
+        last[t] = candidates[best]
+        candidates = candidates[totals <= F[t]]
+
+    changes = []
+    t = last[n]
+    while t > 0:
+        changes.append(int(t))
+        t = last[t]
+    return changes[::-1]
+
+def merge_short_segments(times, starts, min_span):
+    """Drop segment starts so every segment's readings span at least min_span.
+
+    Short pieces between sensor gaps join the segment before them (the first
+    piece joins the one after), since they are too small to normalize on.
+    """
+    starts = list(starts)
+    k = 0
+    while len(starts) > 1 and k < len(starts):
+        first = np.searchsorted(times, starts[k], side='left')
+        stop = np.searchsorted(times, starts[k + 1], side='left') if k + 1 < len(starts) else len(times)
+        if times[stop - 1] - times[first] >= min_span:
+            k += 1
+        elif k > 0:
+            del starts[k]
+        else:
+            del starts[1]
+    return np.array(starts, dtype=times.dtype)
+
+def segment_series(df, penalty_scale=PENALTY_SCALE, min_hours=MIN_SEGMENT_HOURS, gap_hours=SENSOR_GAP_HOURS):
+    """Split one series (datetime, blood_glucose; sorted) into stationary segments.
+
+    Gaps of at least gap_hours split the series first; PELT then runs on the
+    hourly means of each gap-free stretch. Returns one row per segment with
+    the first and last reading times and the segment's glucose statistics.
+    """
+    times = df['datetime'].values
+    bg = df['blood_glucose'].values.astype(np.float64)
+    if len(times) == 0:
+        return pd.DataFrame(columns=['segment', 'start', 'end', 'n_readings', 'mean_bg', 'std_bg'])
+
+    gap = np.flatnonzero(np.diff(times) >= np.timedelta64(gap_hours, 'h')) + 1
+    starts = [times[0]]
+    for a, b in zip(np.r_[0, gap], np.r_[gap, len(times)]):
+        stretch = pd.Series(bg[a:b], index=times[a:b]).resample(RESAMPLE).mean().interpolate(limit_area='inside')
+        penalty = penalty_scale * np.log(max(len(stretch), 2))
+        starts += [stretch.index.values[i] for i in pelt(stretch.values, penalty, min_hours)]
+        if b < len(times):
+            starts.append(times[b])
+
+    starts = merge_short_segments(times, np.array(starts, dtype=times.dtype), np.timedelta64(min_hours, 'h'))
+    # Map readings to segments; the change point hour itself opens the new segment
+    labels = np.searchsorted(starts, times, side='right') - 1
+    grouped = pd.DataFrame({'segment': labels, 'datetime': times, 'bg': bg}).groupby('segment')
+    segments = grouped.agg(start=('datetime', 'min'), end=('datetime', 'max'), n_readings=('bg', 'size'),
+                           mean_bg=('bg', 'mean'), std_bg=('bg', 'std')).reset_index()
+    segments['segment'] = np.arange(len(segments))
+    return segments
+
+def write_segments(conn, series_id, segments):
+    """Replace a series' rows in series_segments."""
+    conn.execute("DELETE FROM series_segments WHERE series_id = ?", (series_id,))
+    conn.executemany(
+        "INSERT INTO series_segments (series_id, segment, start, end, n_readings, mean_bg, std_bg) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(series_id, int(row.segment), pd.Timestamp(row.start).isoformat(), pd.Timestamp(row.end).isoformat(),
+          int(row.n_readings), float(row.mean_bg), None if pd.isna(row.std_bg) else float(row.std_bg))
+         for row in segments.itertuples()]
+    )
+
+# Database path shared with pool workers through the initializer; each worker reads its own series
+_worker_db = {}
+
+def _init_worker(db_name):
+    _worker_db['conn'] = sqlite3.connect(db_name)
+
+def _segment_one(series_id):
+    df = pd.read_sql("SELECT datetime, blood_glucose FROM cgm_data WHERE series_id = ? ORDER BY datetime",
+                     _worker_db['conn'], params=(series_id,))
+    df['datetime'] = pd.to_datetime(df['datetime'], format='ISO8601')
+    return series_id, segment_series(df)
+
+@traced('changepoints.detect')
+def detect_all_segments(db_name, series_ids=None, max_workers=None):
+    """Segment every series (or series_ids) in a process pool and store the boundaries."""
+    conn = sqlite3.connect(db_name)
+    create_segments_table(conn)
+    if series_ids is None:
+        series_ids = [row[0] for row in conn.execute("SELECT DISTINCT series_id FROM cgm_data")]
+
+    n_segments = {}
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(db_name,)) as executor:
+        for series_id, segments in executor.map(_segment_one, series_ids):
+            write_segments(conn, series_id, segments)
+            n_segments[series_id] = len(segments)
+    conn.commit()
+    conn.close()
+    count('changepoints.segments', sum(n_segments.values()))
+    return n_segments
+
+def load_segments(db_name, series_id):
+    """Stored segments of one series (empty if it has not been segmented).
+
+    Read-only: a database that changepoints.py never ran on is left untouched.
+    """
+    columns = ['segment', 'start', 'end', 'n_readings', 'mean_bg', 'std_bg']
+    conn = sqlite3.connect(db_name)
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'series_segments'").fetchone()
+    if exists is None:
+        segments = pd.DataFrame(columns=columns)
+    else:
+        segments = pd.read_sql(f"SELECT {', '.join(columns)} FROM series_segments "
+                               "WHERE series_id = ? ORDER BY segment", conn, params=(series_id,))
+    conn.close()
+    segments['start'] = pd.to_datetime(segments['start'], format='ISO8601')
+    segments['end'] = pd.to_datetime(segments['end'], format='ISO8601')
+    return segments
+
+def segment_labels(times, segments):
+    """Segment number of each time, from the stored segment starts."""
+    starts = segments['start'].values.astype('datetime64[ns]')
+    labels = np.searchsorted(starts, np.asarray(times, dtype='datetime64[ns]'), side='right') - 1
+    return np.maximum(labels, 0)
+
+def main():
+    profile_from_env()
+    # Configuration
+    db_name = "cgm_light.db"
+
+    start = time.perf_counter()
+    n_segments = detect_all_segments(db_name)
+    print(f"Segmented {len(n_segments)} series in {time.perf_counter() - start:.2f}s")
+
+    conn = sqlite3.connect(db_name)
+    summary = pd.read_sql("SELECT series_id, COUNT(*) AS segments, SUM(n_readings) AS readings, "
+                          "ROUND(MIN(mean_bg), 1) AS lowest_mean, ROUND(MAX(mean_bg), 1) AS highest_mean "
+                          "FROM series_segments GROUP BY series_id ORDER BY segments DESC", conn)
+    conn.close()
+    print(summary.head(20).to_string(index=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import os
+import sqlite3
+import struct
+import time
+
+import numpy as np
+import pandas as pd
+
+# Per series-day blob layout:
+#   header: reading count (uint16), time unit (0 = seconds, 1 = milliseconds),
+#           delta width in bytes (2 or 4), first offset from midnight (uint32),
+#           first glucose in tenths of mg/dL (int16)
+#   body:   n-1 time deltas (uint16/uint32), then n-1 glucose deltas (int16)
+HEADER = struct.Struct('<HBBIh')
+GLUCOSE_SCALE = 10  # readings are stored as integer tenths of mg/dL
+
+def create_compact_table(conn):
+    """Create the cgm_compact table if it does not exist."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS cgm_compact (
+        series_id INTEGER,
+        day TEXT,
+        n INTEGER,
+        data BLOB,
+        FOREIGN KEY (series_id) REFERENCES series (series_id),
+        PRIMARY KEY (series_id, day)
+    )
+    ''')
+    conn.commit()
+
+def encode_day(offsets_ms, glucose):
+    """Delta-encode one day of readings.
+
+    offsets_ms are sorted milliseconds since midnight (sub-millisecond parts
+    are rounded away); whole-second days are stored at second resolution so a
+    5-minute cadence fits in uint16 deltas.
+    """
+    offsets_ms = np.asarray(offsets_ms, dtype=np.int64)
+    values = np.rint(np.asarray(glucose, dtype=np.float64) * GLUCOSE_SCALE).astype(np.int64)
+    if values.min() < -32768 or values.max() > 32767:
+        raise ValueError("glucose value out of int16 range")
+
+    unit = 0 if not (offsets_ms % 1000).any() else 1
+    offsets = offsets_ms // 1000 if unit == 0 else offsets_ms
+    time_deltas = np.diff(offsets)
+    width = 2 if len(time_deltas) == 0 or time_deltas.max() <= 0xFFFF else 4
+
+    header = HEADER.pack(len(offsets), unit, width, int(offsets[0]), int(values[0]))
+    return (header
+            + time_deltas.astype('<u2' if width == 2 else '<u4').tobytes()
+            + np.diff(values).astype('<i2').tobytes())
+
+def decode_day(blob, day):
+    """Decode a blob into (datetime64[ms] times, float32 glucose) arrays."""
+    n, unit, width, first_offset, first_value = HEADER.unpack_from(blob)
+    body = memoryview(blob)[HEADER.size:]
+    time_bytes = (n - 1) * width
+
+    offsets = np.empty(n, dtype=np.int64)
+    offsets[0] = first_offset
+    np.cumsum(np.frombuffer(body[:time_bytes], dtype='<u2' if width == 2 else '<u4'), out=offsets[1:])
+    offsets[1:] += first_offset
+    if unit == 0:
+        offsets *= 1000
+
+    values = np.empty(n, dtype=np.int32)
+    values[0] = first_value
+    np.cumsum(np.frombuffer(body[time_bytes:], dtype='<i2'), out=values[1:])
+    values[1:] += first_value
+
+    times = np.datetime64(day, 'ms') + offsets.astype('timedelta64[ms]')
+    return times, values.astype(np.float32) / GLUCOSE_SCALE
+
+def pack_readings(conn, df):
+    """Write readings (series_id, datetime, blood_glucose) as one blob per series-day.
+
+    Readings without a glucose value are skipped; the int16 encoding has no NaN.
+    """
+    create_compact_table(conn)
+    df = df.dropna(subset=['blood_glucose']).sort_values(['series_id', 'datetime'], kind='stable')
+    days = df['datetime'].dt.floor('D')
+    offsets_ms = ((df['datetime'] - days).dt.total_seconds() * 1000).round().astype(np.int64).values
+    glucose = df['blood_glucose'].values
+
+    rows = []
+    for (series_id, day), idx in df.groupby([df['series_id'], days]).indices.items():
+        rows.append((int(series_id), day.strftime('%Y-%m-%d'), len(idx), encode_day(offsets_ms[idx], glucose[idx])))
+    conn.executemany("INSERT OR REPLACE INTO cgm_compact (series_id, day, n, data) VALUES (?, ?, ?, ?)", rows)
+    conn.commit()
+    return len(rows)
+
+def read_series(conn, series_id, start_day=None, end_day=None):
+    """Decode a series (optionally limited to [start_day, end_day]) straight into NumPy arrays."""
+    query = "SELECT day, data FROM cgm_compact WHERE series_id = ?"
+    params = [series_id]
+    if start_day is not None:
+        query += " AND day >= ?"
+        params.append(start_day)
+    if end_day is not None:
+        query += " AND day <= ?"
+        params.append(end_day)
+    decoded = [decode_day(blob, day) for day, blob in conn.execute(query + " ORDER BY day", params)]
+    if not decoded:
+        return np.array([], dtype='datetime64[ms]'), np.array([], dtype=np.float32)
+    return np.concatenate([d[0] for d in decoded]), np.concatenate([d[1] for d in decoded])
+
+def pack_database(src_db, dst_db):
+    """Copy a row-layout database into compact layout (cgm_compact instead of cgm_data)."""
+    if os.path.exists(dst_db):
+        os.remove(dst_db)
+    conn = sqlite3.connect(dst_db)
+    conn.execute("ATTACH DATABASE ? AS src", (src_db,))
+    # Every other table keeps its row layout
+    tables = [row[0] for row in conn.execute(
+        "SELECT name FROM src.sqlite_master WHERE type = 'table' AND name != 'cgm_data'")]
+    for table in tables:
+        sql = conn.execute("SELECT sql FROM src.sqlite_master WHERE name = ?", (table,)).fetchone()[0]
+        conn.execute(sql)
+        conn.execute(f"INSERT INTO main.{table} SELECT * FROM src.{table}")
+    conn.commit()
+
+    df = pd.read_sql("SELECT series_id, datetime, blood_glucose FROM src.cgm_data WHERE blood_glucose IS NOT NULL",
+                     conn)
+    df['datetime'] = pd.to_datetime(df['datetime'], format='ISO8601')
+    n_blobs = pack_readings(conn, df)
+    conn.execute("DETACH DATABASE src")
+    conn.execute("VACUUM")
+    conn.close()
+    return n_blobs
+
+def benchmark(src_db, work_dir="cache"):
+    """Compare storage size and full-table decode time of the row and compact layouts."""
+    os.makedirs(work_dir, exist_ok=True)
+    rows_db = os.path.join(work_dir, "bench_rows.db")
+    compact_db = os.path.join(work_dir, "bench_compact.db")
+
+    # Row layout with only cgm_data, vacuumed, for a like-for-like size comparison
+    if os.path.exists(rows_db):
+        os.remove(rows_db)
+    conn = sqlite3.connect(rows_db)
+    conn.execute("ATTACH DATABASE ? AS src", (src_db,))
+    conn.execute(conn.execute("SELECT sql FROM src.sqlite_master WHERE name = 'cgm_data'").fetchone()[0])
+    conn.execute("INSERT INTO main.cgm_data SELECT * FROM src.cgm_data WHERE blood_glucose IS NOT NULL")
+    conn.commit()
+    conn.execute("DETACH DATABASE src")
+    conn.execute("VACUUM")
+    n_readings = conn.execute("SELECT COUNT(*) FROM cgm_data").fetchone()[0]
+    series_ids = [row[0] for row in conn.execute("SELECT DISTINCT series_id FROM cgm_data")]
+
+    start = time.perf_counter()
+    for series_id in series_ids:
+        df = pd.read_sql("SELECT datetime, blood_glucose FROM cgm_data WHERE series_id = ? ORDER BY datetime",
+                         conn, params=(series_id,))
+        times = pd.to_datetime(df['datetime'], format='ISO8601').values
+        values = df['blood_glucose'].values.astype(np.float32)
+    rows_seconds = time.perf_counter() - start
+
+    pack_start = time.perf_counter()
+    df = pd.read_sql("SELECT series_id, datetime, blood_glucose FROM cgm_data", conn)
+    conn.close()
+    df['datetime'] = pd.to_datetime(df['datetime'], format='ISO8601')
+    if os.path.exists(compact_db):
+        os.remove(compact_db)
+    conn = sqlite3.connect(compact_db)
+    pack_readings(conn, df)
+    conn.execute("VACUUM")
+    pack_seconds = time.perf_counter() - pack_start
+
+    start = time.perf_counter()
+    for series_id in series_ids:
+        times, values = read_series(conn, series_id)
+    compact_seconds = time.perf_counter() - start
+    conn.close()
+
+    rows_bytes = os.path.getsize(rows_db)
+    compact_bytes = os.path.getsize(compact_db)
+    return {
+        'readings': n_readings,
+        'row_layout_bytes': rows_bytes,
+        'compact_bytes': compact_bytes,
+        'bytes_per_reading_rows': rows_bytes / n_readings,
+        'bytes_per_reading_compact': compact_bytes / n_readings,
+        'size_ratio': rows_bytes / compact_bytes,
+        'row_read_seconds': rows_seconds,
+        'compact_decode_seconds': compact_seconds,
+        'decode_speedup': rows_seconds / compact_seconds,
+        'pack_seconds': pack_seconds,
+    }
+
+def main():
+    # Configuration
+    db_name = "cgm.db"
+    compact_db_name = "cgm_compact.db"
+
+    n_blobs = pack_database(db_name, compact_db_name)
+    print(f"Packed {n_blobs} series-days into {compact_db_name}")
+    print(f"{db_name}: {os.path.getsize(db_name) / 1e6:.1f} MB, "
+          f"{compact_db_name}: {os.path.getsize(compact_db_name) / 1e6:.1f} MB")
+
+    print("\nBenchmark (cgm_data only):")
+    for key, value in benchmark(db_name).items():
+        print(f"  {key}: {value:.3f}" if isinstance(value, float) else f"  {key}: {value}")
+
+if __name__ == "__main__":
+    main()
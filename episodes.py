@@ -0,0 +1,199 @@
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from glycemic_metrics import EPISODES, MAX_GAP_MINUTES, MIN_EPISODE_MINUTES, episode_run_ids
+from instrumentation import count, profile_from_env, traced
+
+# Low-glucose episodes record their nadir, high-glucose episodes their peak
+NADIR_KINDS = {'hypo', 'severe_hypo'}
+EPISODE_COLUMNS = ['series_id', 'kind', 'start', 'end', 'duration_minutes', 'extreme_bg', 'n_readings']
+
+def create_episodes_table(conn):
+    """Create the glucose_episodes table and its query indexes if they do not exist."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS glucose_episodes (
+        id INTEGER PRIMARY KEY,
+        series_id INTEGER,
+        kind TEXT,
+        start TEXT,
+        end TEXT,
+        duration_minutes REAL,
+        extreme_bg REAL,
+        n_readings INTEGER,
+        FOREIGN KEY (series_id) REFERENCES series (series_id),
+        UNIQUE(series_id, kind, start)
+    )
+    ''')
+    # (series_id, kind, start) is covered by the UNIQUE constraint's index
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_episodes_kind_start ON glucose_episodes (kind, start)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_episodes_kind_duration ON glucose_episodes (kind, duration_minutes)")
+    conn.commit()
+
+def extract_episodes(df):
+    """Turn readings (series_id, datetime, blood_glucose; sorted) into episode intervals.
+
+    Uses glycemic_metrics' episode definition (episode_run_ids): a run of
+    consecutive readings meeting the condition, within one series and with
+    no gap over MAX_GAP_MINUTES, lasting at least MIN_EPISODE_MINUTES.
+    """
+    series_ids = df['series_id'].values
+    times = df['datetime'].values
+    bg = df['blood_glucose'].values
+
+    frames = []
+    for name, condition in EPISODES.items():
+        kind = name[:-len('_episodes')]
+        flag = condition(bg)
+        rows = np.flatnonzero(flag)
+        if len(rows) == 0:
+            continue
+        run_id = episode_run_ids(series_ids, times, flag)[rows]
+        # Runs are contiguous in rows, so reduceat over their first positions aggregates each one
+        first = np.flatnonzero(np.r_[True, run_id[1:] != run_id[:-1]])
+        last = np.r_[first[1:], len(rows)] - 1
+        reduce = np.minimum if kind in NADIR_KINDS else np.maximum
+        episodes = pd.DataFrame({
+            'series_id': series_ids[rows[first]],
+            'kind': kind,
+            'start': times[rows[first]],
+            'end': times[rows[last]],
+            'extreme_bg': reduce.reduceat(bg[rows], first),
+            'n_readings': last - first + 1,
+        })
+        episodes['duration_minutes'] = (episodes['end'] - episodes['start']).dt.total_seconds() / 60
+        frames.append(episodes[episodes['duration_minutes'] >= MIN_EPISODE_MINUTES])
+    if not frames:
+        return pd.DataFrame(columns=EPISODE_COLUMNS)
+    return pd.concat(frames, ignore_index=True)[EPISODE_COLUMNS]
+
+def write_episodes(conn, episodes):
+    """Insert episode rows (ISO datetimes) into glucose_episodes."""
+    if episodes.empty:
+        return 0
+    rows = list(zip(
+        episodes['series_id'].astype(int),
+        episodes['kind'],
+        episodes['start'].dt.strftime('%Y-%m-%dT%H:%M:%S'),
+        episodes['end'].dt.strftime('%Y-%m-%dT%H:%M:%S'),
+        episodes['duration_minutes'].astype(float),
+        episodes['extreme_bg'].astype(float),
+        episodes['n_readings'].astype(int),
+    ))
+    conn.executemany(
+        "INSERT OR REPLACE INTO glucose_episodes "
+        "(series_id, kind, start, end, duration_minutes, extreme_bg, n_readings) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        rows
+    )
+    return len(rows)
+
+@traced('episodes.refresh')
+def refresh_episodes(conn, since_id=0):
+    """Re-extract the episodes affected by cgm_data rows with id > since_id.
+
+    For each touched series, readings are re-scanned from just before the
+    first new reading (or from the start of an episode still open there), and
+    the stored episodes from that point on are replaced. since_id=0 rebuilds
+    the whole table.
+    """
+    create_episodes_table(conn)
+    spans = conn.execute(
+        "SELECT series_id, MIN(datetime) FROM cgm_data WHERE id > ? GROUP BY series_id", (since_id,)
+    ).fetchall()
+    # A run shorter than an episode could still be extended by the new readings
+    lookback = timedelta(minutes=MAX_GAP_MINUTES + MIN_EPISODE_MINUTES)
+
+    n_episodes = 0
+    for series_id, first_new in spans:
+        from_time = (datetime.fromisoformat(first_new) - lookback).isoformat()
+        open_start = conn.execute(
+            "SELECT MIN(start) FROM glucose_episodes WHERE series_id = ? AND end >= ?", (series_id, from_time)
+        ).fetchone()[0]
+        if open_start is not None and open_start < from_time:
+            from_time = open_start
+
+        df = pd.read_sql(
+            "SELECT series_id, datetime, blood_glucose FROM cgm_data WHERE series_id = ? AND datetime >= ?",
+            conn, params=(series_id, from_time)
+        )
+        df['datetime'] = pd.to_datetime(df['datetime'], format='ISO8601')
+        df = df.sort_values('datetime', kind='stable')
+        conn.execute("DELETE FROM glucose_episodes WHERE series_id = ? AND start >= ?", (series_id, from_time))
+        n_episodes += write_episodes(conn, extract_episodes(df))
+    conn.commit()
+    count('episodes.written', n_episodes)
+    return n_episodes
+
+def _query(conn, where, params, order="start"):
+    df = pd.read_sql(f"SELECT {', '.join(EPISODE_COLUMNS)} FROM glucose_episodes WHERE {where} ORDER BY {order}",
+                     conn, params=params)
+    df['start'] = pd.to_datetime(df['start'], format='ISO8601')
+    df['end'] = pd.to_datetime(df['end'], format='ISO8601')
+    return df
+
+def _filters(kind, series_id):
+    where, params = [], []
+    if kind is not None:
+        where.append("kind = ?")
+        params.append(kind)
+    if series_id is not None:
+        where.append("series_id = ?")
+        params.append(series_id)
+    return where, params
+
+@traced('query.episodes')
+def episodes_overlapping(conn, start, end, kind=None, series_id=None):
+    """Episodes that overlap [start, end), answered from the episode table alone.
+
+    The longest stored duration bounds how early an overlapping episode can
+    start, which turns the overlap test into a range scan on start.
+    """
+    start = start.isoformat() if isinstance(start, datetime) else start
+    end = end.isoformat() if isinstance(end, datetime) else end
+    where, params = _filters(kind, series_id)
+    longest = conn.execute(
+        "SELECT MAX(duration_minutes) FROM glucose_episodes" + (" WHERE kind = ?" if kind is not None else ""),
+        [kind] if kind is not None else []
+    ).fetchone()[0]
+    if longest is None:
+        return _query(conn, "0", [])
+    earliest = (datetime.fromisoformat(start) - timedelta(minutes=longest)).isoformat()
+    where += ["start >= ?", "start < ?", "end >= ?"]
+    params += [earliest, end, start]
+    return _query(conn, " AND ".join(where), params)
+
+@traced('query.episodes')
+def episodes_longer_than(conn, minutes, kind=None, series_id=None):
+    """Episodes lasting at least `minutes`, longest first."""
+    where, params = _filters(kind, series_id)
+    where.append("duration_minutes >= ?")
+    params.append(minutes)
+    return _query(conn, " AND ".join(where), params, order="duration_minutes DESC")
+
+def main():
+    profile_from_env()
+    # Configuration
+    db_name = "cgm_light.db"
+
+    conn = sqlite3.connect(db_name)
+    start = time.perf_counter()
+    n_episodes = refresh_episodes(conn)
+    print(f"Extracted {n_episodes} episodes in {time.perf_counter() - start:.2f}s")
+    print(pd.read_sql("SELECT kind, COUNT(*) AS episodes, AVG(duration_minutes) AS mean_minutes "
+                      "FROM glucose_episodes GROUP BY kind", conn).round(1).to_string(index=False))
+
+    print("\nHypoglycemic episodes longer than 60 minutes:")
+    print(episodes_longer_than(conn, 60, kind='hypo').head(10).to_string(index=False))
+
+    first_start = conn.execute("SELECT MIN(start) FROM glucose_episodes").fetchone()[0]
+    if first_start is not None:
+        window_end = (datetime.fromisoformat(first_start) + timedelta(days=7)).isoformat()
+        print(f"\nEpisodes overlapping {first_start} to {window_end}:")
+        print(episodes_overlapping(conn, first_start, window_end).to_string(index=False))
+    conn.close()
+
+if __name__ == "__main__":
+    main()
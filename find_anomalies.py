@@ -1,4 +1,6 @@
+import os
 import sqlite3
+import joblib
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
@@ -7,46 +9,110 @@ from scipy.spatial.distance import cdist
 from sklearn.ensemble import IsolationForest
 from sklearn.cluster import DBSCAN, KMeans
 from sklearn.preprocessing import StandardScaler
-from tensorflow.keras.models import Sequential, Model
-from tensorflow.keras.layers import Dense, Dropout, Input, RepeatVector, TimeDistributed
-import tensorflow as tf
-from sklearn.metrics import confusion_matrix, classification_report
-
-# Create a connection to the SQLite database
-conn = sqlite3.connect('cgm_light.db')
-query = "SELECT * FROM cgm_data"
-df = pd.read_sql(query, conn)
-conn.close()
-
-# Convert datetime and sort
-df['datetime'] = pd.to_datetime(df['datetime'])
-df = df.sort_values(['series_id', 'datetime'])
-
-# Focus on one series for the example
-series_id = 2
-series_df = df[df['series_id'] == series_id].copy()
-series_df.set_index('datetime', inplace=True)
-
-# Calculate glucose rate of change (mg/dL per minute)
-series_df['glucose_diff'] = series_df['blood_glucose'].diff()
-series_df['minutes_diff'] = series_df.index.to_series().diff().dt.total_seconds() / 60
-series_df['rate_of_change'] = series_df['glucose_diff'] / series_df['minutes_diff']
-series_df['roc_diff'] = series_df['rate_of_change'].diff()
-series_df['acceleration'] = series_df['roc_diff'] / series_df['minutes_diff']
-
-# Remove first row with NaN diff
-series_df = series_df.dropna()  # Remove first row with NaN diff
-
-print("Data overview with rate of change:")
-print(series_df.head())
+
+from changepoints import load_segments, segment_labels
+from glucose_series import GlucoseSeries
+from instrumentation import count, profile_from_env, traced
+from matrix_profile import matrix_profile_anomalies
+from smoothing import smoothed_derivatives
+
+@traced('query.cgm_data')
+def load_cgm_data(db_name):
+    """Load all CGM readings sorted by series and time."""
+    # Create a connection to the SQLite database
+    conn = sqlite3.connect(db_name)
+    query = "SELECT * FROM cgm_data"
+    df = pd.read_sql(query, conn)
+    conn.close()
+    count('query.rows', len(df))
+
+    # Convert datetime and sort
+    df['datetime'] = pd.to_datetime(df['datetime'])
+    return df.sort_values(['series_id', 'datetime'])
+
+@traced('features.derivatives')
+def add_derivative_features(series_df, smoothing=None):
+    """Add rate of change and acceleration columns to a datetime-indexed series.
+
+    smoothing ('savgol' or 'kalman', see smoothing.py) denoises the readings
+    first and adds a smoothed_glucose column; None uses raw differences.
+    """
+    if smoothing is not None:
+        glucose, roc, acc = smoothed_derivatives(series_df.index.values, series_df['blood_glucose'].values, smoothing)
+        series_df['smoothed_glucose'] = glucose
+        series_df['rate_of_change'] = roc
+        series_df['acceleration'] = acc
+        return series_df.dropna()
+
+    # Calculate glucose rate of change (mg/dL per minute)
+    series_df['glucose_diff'] = series_df['blood_glucose'].diff()
+    series_df['minutes_diff'] = series_df.index.to_series().diff().dt.total_seconds() / 60
+    series_df['rate_of_change'] = series_df['glucose_diff'] / series_df['minutes_diff']
+    series_df['roc_diff'] = series_df['rate_of_change'].diff()
+    series_df['acceleration'] = series_df['roc_diff'] / series_df['minutes_diff']
+
+    # Remove first rows with NaN diff
+    return series_df.dropna()
+
+def prepare_series(df, series_id, segments=None, smoothing=None):
+    """Select one series from the full table and add its derivative features.
+
+    With stored change-point segments (changepoints.load_segments), a
+    'segment' column is added and the detectors normalize within each segment.
+    smoothing is passed on to add_derivative_features.
+    """
+    series_df = df[df['series_id'] == series_id].copy()
+    series_df.set_index('datetime', inplace=True)
+    if segments is not None and len(segments):
+        series_df['segment'] = segment_labels(series_df.index, segments)
+    return add_derivative_features(series_df, smoothing)
+
+def standardized_features(df, columns=('rate_of_change', 'acceleration')):
+    """Feature columns z-scored within each change-point segment (df['segment'])."""
+    features = df[list(columns)]
+    grouped = features.groupby(df['segment'])
+    std = grouped.transform(lambda x: x.std(ddof=0))
+    # Segments with constant features (or a single reading) standardize to zero
+    return ((features - grouped.transform('mean')) / std.where(std > 0)).fillna(0.0)
+
+def segment_standardized(series):
+    """GlucoseSeries features z-scored within each change-point segment, as standardized_features."""
+    features = series.features.astype(np.float64)
+    result = np.zeros_like(features)
+    for segment in np.unique(series.segments):
+        rows = series.segments == segment
+        block = features[rows]
+        std = block.std(axis=0)
+        result[rows] = (block - block.mean(axis=0)) / np.where(std > 0, std, np.inf)
+    return result
+
+def series_index(df):
+    """Time index of a DataFrame or GlucoseSeries, for aligning detector masks."""
+    return pd.DatetimeIndex(df.datetimes, name='datetime') if isinstance(df, GlucoseSeries) else df.index
+
+# Detectors take either a prepare_series DataFrame or a GlucoseSeries.with_derivatives();
+# either one normalizes per change-point segment when it carries segment labels
 
 # 1. Statistical Approach: Z-Score Method
+@traced('detector.z_score')
 def z_score_anomalies(df, threshold=3.0):
     """Detect anomalies in rate of change and acceleration using Z-scores"""
-    # Z-score for rate of change
-    df['roc_zscore'] = np.abs(stats.zscore(df['rate_of_change']))
-    # Z-score for acceleration
-    df['acc_zscore'] = np.abs(stats.zscore(df['acceleration']))
+    if isinstance(df, GlucoseSeries):
+        if df.segments is not None:
+            zscores = np.abs(segment_standardized(df))
+        else:
+            zscores = np.abs(stats.zscore(df.features, axis=0))
+        return pd.Series((zscores > threshold).all(axis=1), index=series_index(df))
+    if 'segment' in df.columns:
+        # Z-scores within each change-point segment
+        zscores = standardized_features(df).abs()
+        df['roc_zscore'] = zscores['rate_of_change']
+        df['acc_zscore'] = zscores['acceleration']
+    else:
+        # Z-score for rate of change
+        df['roc_zscore'] = np.abs(stats.zscore(df['rate_of_change']))
+        # Z-score for acceleration
+        df['acc_zscore'] = np.abs(stats.zscore(df['acceleration']))
 
     # Mark as anomaly if both Z-scores exceeds threshold
     anomaly_mask = (df['acc_zscore'] > threshold) & (df['roc_zscore'] > threshold)
@@ -54,36 +120,54 @@ def z_score_anomalies(df, threshold=3.0):
     return anomaly_mask
 
 # 2. Isolation Forest
+@traced('detector.isolation_forest')
 def isolation_forest_anomalies(df, contamination=0.05):
     """Detect anomalies using Isolation Forest"""
-    features = df[['rate_of_change', 'acceleration']].values
+    if isinstance(df, GlucoseSeries):
+        features = segment_standardized(df) if df.segments is not None else df.features
+    elif 'segment' in df.columns:
+        features = standardized_features(df).values
+    else:
+        features = df[['rate_of_change', 'acceleration']].values
 
     # Fit Isolation Forest
     model = IsolationForest(random_state=42, contamination=contamination)
     preds = model.fit_predict(features)
 
     # -1 for anomalies, 1 for normal
-    return pd.Series(preds == -1, index=df.index)
+    return pd.Series(preds == -1, index=series_index(df))
 
 # DBSCAN Clustering
+@traced('detector.dbscan')
 def dbscan_anomalies(df, eps=0.5, min_samples=5):
     """Detect anomalies using DBSCAN clustering"""
-    # Standardize features
-    scaler = StandardScaler()
-    features = scaler.fit_transform(df[['rate_of_change', 'acceleration']])
+    # Standardize features (per change-point segment when available)
+    if isinstance(df, GlucoseSeries):
+        features = segment_standardized(df) if df.segments is not None else StandardScaler().fit_transform(df.features)
+    elif 'segment' in df.columns:
+        features = standardized_features(df).values
+    else:
+        scaler = StandardScaler()
+        features = scaler.fit_transform(df[['rate_of_change', 'acceleration']])
 
     # Fit DBSCAN
     dbscan = DBSCAN(eps=eps, min_samples=min_samples)
     clusters = dbscan.fit_predict(features)
 
     # -1 indicates noise points (anomalies)
-    return pd.Series(clusters == -1, index=df.index)
+    return pd.Series(clusters == -1, index=series_index(df))
 
 # k-means clustering
-def kmeans_anomalies(df, n_clusters=3, distance_threshold=3.5):
-    scaler = StandardScaler()
-    features = scaler.fit_transform(df[['rate_of_change', 'acceleration']].values)
-
+@traced('detector.kmeans')
+def kmeans_anomalies(df, n_clusters=3, distance_threshold=3.5,
+                     plot_path='figures/kmeans_clusters_and_distances.png'):
+    if isinstance(df, GlucoseSeries):
+        features = segment_standardized(df) if df.segments is not None else StandardScaler().fit_transform(df.features)
+    elif 'segment' in df.columns:
+        features = standardized_features(df).values
+    else:
+        scaler = StandardScaler()
+        features = scaler.fit_transform(df[['rate_of_change', 'acceleration']].values)
 
     kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
     cluster_labels = kmeans.fit_predict(features)
@@ -98,48 +182,49 @@ def kmeans_anomalies(df, n_clusters=3, distance_threshold=3.5):
     threshold = np.mean(min_distances) + distance_threshold * np.std(min_distances)
     anomaly_mask = min_distances > threshold
 
-    # Plot clusters and distances for visualization
-    # plotting code partially developed with help from Claude
-    plt.figure(figsize=(16, 6))
+    if plot_path is not None:
+        # Plot clusters and distances for visualization
+        # plotting code partially developed with help from Claude
+        plt.figure(figsize=(16, 6))
     
-    # Plot 1: Clusters
-    plt.subplot(1, 2, 1)
-    for i in range(n_clusters):
-        cluster_points = features[cluster_labels == i]
-        plt.scatter(cluster_points[:, 0], cluster_points[:, 1], 
-                   label=f'Cluster {i}', alpha=0.7)
+        # Plot 1: Clusters
+        plt.subplot(1, 2, 1)
+        for i in range(n_clusters):
+            cluster_points = features[cluster_labels == i]
+            plt.scatter(cluster_points[:, 0], cluster_points[:, 1], 
+                       label=f'Cluster {i}', alpha=0.7)
     
-    plt.scatter(centroids[:, 0], centroids[:, 1], 
-               marker='x', s=100, linewidths=3, color='black', 
-               label='Centroids')
+        plt.scatter(centroids[:, 0], centroids[:, 1], 
+                   marker='x', s=100, linewidths=3, color='black', 
+                   label='Centroids')
     
-    plt.scatter(features[anomaly_mask, 0], features[anomaly_mask, 1],
-               s=100, edgecolors='red', facecolors='none', linewidths=2,
-               label='Anomalies')
+        plt.scatter(features[anomaly_mask, 0], features[anomaly_mask, 1],
+                   s=100, edgecolors='red', facecolors='none', linewidths=2,
+                   label='Anomalies')
     
-    plt.title('K-means Clusters with Anomalies')
-    plt.xlabel('Standardized Rate of Change')
-    plt.ylabel('Standardized Acceleration')
-    plt.legend()
-    plt.grid(True)
+        plt.title('K-means Clusters with Anomalies')
+        plt.xlabel('Standardized Rate of Change')
+        plt.ylabel('Standardized Acceleration')
+        plt.legend()
+        plt.grid(True)
     
-    # Plot 2: Distance distribution
-    plt.subplot(1, 2, 2)
-    plt.hist(min_distances, bins=30, alpha=0.7)
-    plt.axvline(x=threshold, color='red', linestyle='--', 
-               label=f'Threshold ({threshold:.2f})')
-    plt.title('Distance to Nearest Centroid')
-    plt.xlabel('Distance')
-    plt.ylabel('Frequency')
-    plt.legend()
-    plt.grid(True)
+        # Plot 2: Distance distribution
+        plt.subplot(1, 2, 2)
+        plt.hist(min_distances, bins=30, alpha=0.7)
+        plt.axvline(x=threshold, color='red', linestyle='--', 
+                   label=f'Threshold ({threshold:.2f})')
+        plt.title('Distance to Nearest Centroid')
+        plt.xlabel('Distance')
+        plt.ylabel('Frequency')
+        plt.legend()
+        plt.grid(True)
     
-    plt.tight_layout()
-    plt.savefig('figures/kmeans_clusters_and_distances.png')
-    plt.close()
+        plt.tight_layout()
+        plt.savefig(plot_path)
+        plt.close()
     
     # Return anomaly mask
-    return pd.Series(anomaly_mask, index=df.index)
+    return pd.Series(anomaly_mask, index=series_index(df))
 
 
 # Combined Approach: Majority voting
@@ -152,11 +237,56 @@ def combined_anomaly_detection(list_of_masks):
     # take the majority vote of the masks
     return anomaly_votes >= 3
 
-print("\nApplying anomaly detection methods...")
+# Persisted models for scoring new readings without refitting
+@traced('model.fit.anomaly')
+def fit_anomaly_models(df, contamination=0.05, smoothing=None):
+    """Fit the Z-score statistics and Isolation Forest on derivative features
+
+    smoothing records how df's features were built, so scoring can build
+    new features the same way.
+    """
+    features = df[['rate_of_change', 'acceleration']].values
+    model = IsolationForest(random_state=42, contamination=contamination)
+    model.fit(features)
+    return {
+        'mean': features.mean(axis=0),
+        'std': features.std(axis=0),
+        'iforest': model,
+        'smoothing': smoothing,
+    }
+
+@traced('model.predict.anomaly')
+def score_anomalies(models, features, threshold=3.0):
+    """Flag rows of a (rate_of_change, acceleration) array with the fitted models.
+
+    A row is flagged when both the Z-score test and the Isolation Forest agree.
+    """
+    zscores = np.abs((features - models['mean']) / models['std'])
+    zscore_mask = (zscores > threshold).all(axis=1)
+    iforest_mask = models['iforest'].predict(features) == -1
+    return zscore_mask & iforest_mask
+
+def save_anomaly_models(models, path):
+    """Persist fitted anomaly models to disk"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    joblib.dump(models, path)
+
+def load_anomaly_models(path):
+    """Load anomaly models written by save_anomaly_models"""
+    return joblib.load(path)
 
 # function to plot some of the anomalies
 # Subplot plotting partially assisted using Claude
 def plot_anomalies(df, anomaly_mask, title, filename, context_minutes=60):
+    # Work on plain arrays; per-anomaly lookups index them directly instead of going through df.iloc
+    if not isinstance(df, GlucoseSeries):
+        df = GlucoseSeries(None, df.index.values.astype('datetime64[ns]').view(np.int64),
+                           df['blood_glucose'].to_numpy(),
+                           df[['rate_of_change', 'acceleration']].to_numpy() if 'rate_of_change' in df.columns else None)
+    times = pd.DatetimeIndex(df.datetimes)
+    glucose = df.values
+    anomaly_mask = np.asarray(anomaly_mask, dtype=bool)
+
     # Count anomalies
     n_anomalies = anomaly_mask.sum()
     print(f"Found {n_anomalies} anomalies using {title}")
@@ -164,7 +294,7 @@ def plot_anomalies(df, anomaly_mask, title, filename, context_minutes=60):
     if n_anomalies == 0:
         # If no anomalies, just show the overall plot
         plt.figure(figsize=(14, 7))
-        plt.plot(df.index, df['blood_glucose'], label='Blood Glucose', color='blue')
+        plt.plot(times, glucose, label='Blood Glucose', color='blue')
         plt.title(f"{title} - No Anomalies Detected")
         plt.xlabel('Time')
         plt.ylabel('Blood Glucose (mg/dL)')
@@ -175,8 +305,8 @@ def plot_anomalies(df, anomaly_mask, title, filename, context_minutes=60):
 
     # First create an overview plot with all data
     plt.figure(figsize=(14, 7))
-    plt.plot(df.index, df['blood_glucose'], label='Blood Glucose', color='blue', alpha=0.5)
-    plt.scatter(df[anomaly_mask].index, df[anomaly_mask]['blood_glucose'],
+    plt.plot(times, glucose, label='Blood Glucose', color='blue', alpha=0.5)
+    plt.scatter(times[anomaly_mask], glucose[anomaly_mask],
                 color='red', label='Anomalies', s=80, zorder=5)
     plt.title(f"{title} - Overview")
     plt.xlabel('Time')
@@ -204,35 +334,31 @@ def plot_anomalies(df, anomaly_mask, title, filename, context_minutes=60):
         axes = [axes]
 
     for i, idx in enumerate(anomaly_indices):
-        anomaly_time = df.index[idx]
-
-        # Define time window around anomaly
-        start_time = anomaly_time - pd.Timedelta(minutes=context_minutes)
+        anomaly_time = times[idx]
         end_time = anomaly_time + pd.Timedelta(minutes=context_minutes)
 
-        # Get data in time window
-        mask = (df.index >= start_time) & (df.index <= end_time)
-        window_df = df[mask]
+        # Get data in time window (a view found by binary search)
+        window = df.around(idx, context_minutes)
 
         # Plot regular data in window
-        axes[i].plot(window_df.index, window_df['blood_glucose'], 'b-', label='Blood Glucose')
+        axes[i].plot(window.datetimes, window.values, 'b-', label='Blood Glucose')
 
         # Highlight the anomaly
-        axes[i].scatter([anomaly_time], [df.iloc[idx]['blood_glucose']],
+        axes[i].scatter([anomaly_time], [glucose[idx]],
                        color='red', s=100, zorder=5, label='Anomaly')
 
         # Add rate of change annotation
-        roc = df.iloc[idx]['rate_of_change'] if 'rate_of_change' in df.columns else None
+        roc = df.rate_of_change[idx] if df.features is not None else None
         if roc is not None:
             axes[i].annotate(f"RoC: {roc:.2f} mg/dL/min",
-                           (anomaly_time, df.iloc[idx]['blood_glucose']),
+                           (anomaly_time, glucose[idx]),
                            xytext=(10, -30), textcoords='offset points',
                            arrowprops=dict(arrowstyle="->", connectionstyle="arc3,rad=.2"))
 
         # Add value before and after anomaly
         if idx > 0:
-            prev_time = df.index[idx-1]
-            prev_val = df.iloc[idx-1]['blood_glucose']
+            prev_time = times[idx-1]
+            prev_val = glucose[idx-1]
             time_diff = (anomaly_time - prev_time).total_seconds() / 60  # in minutes
             axes[i].annotate(f"{prev_val:.1f} mg/dL\n{time_diff:.1f}min before",
                            (prev_time, prev_val),
@@ -240,8 +366,8 @@ def plot_anomalies(df, anomaly_mask, title, filename, context_minutes=60):
                            arrowprops=dict(arrowstyle="->", connectionstyle="arc3,rad=-.2"))
 
         if idx < len(df) - 1:
-            next_time = df.index[idx+1]
-            next_val = df.iloc[idx+1]['blood_glucose']
+            next_time = times[idx+1]
+            next_val = glucose[idx+1]
             time_diff = (next_time - anomaly_time).total_seconds() / 60  # in minutes
             if next_time <= end_time:  # Only show if within our window
                 axes[i].annotate(f"{next_val:.1f} mg/dL\n{time_diff:.1f}min after",
@@ -256,7 +382,7 @@ def plot_anomalies(df, anomaly_mask, title, filename, context_minutes=60):
         axes[i].grid(True)
 
         # Create a reasonable y-axis range (±30% from anomaly value)
-        anomaly_val = df.iloc[idx]['blood_glucose']
+        anomaly_val = glucose[idx]
         y_range = max(30, anomaly_val * 0.3)  # at least 30 mg/dL range
         axes[i].set_ylim([max(40, anomaly_val - y_range), anomaly_val + y_range])
 
@@ -274,58 +400,92 @@ def plot_anomalies(df, anomaly_mask, title, filename, context_minutes=60):
 
     return n_anomalies
 
-# Z-Score method
-anomalies_zscore = z_score_anomalies(series_df)
-n_zscore = plot_anomalies(
-    series_df,
-    anomalies_zscore,
-    "Anomalies Detected by Z-Score Method",
-    "figures/zscore_anomalies.png"
-)
-
-# Isolation Forest
-anomalies_iforest = isolation_forest_anomalies(series_df)
-n_iforest = plot_anomalies(
-    series_df,
-    anomalies_iforest,
-    "Anomalies Detected by Isolation Forest",
-    "figures/iforest_anomalies.png"
-)
-
-# DBSCAN
-anomalies_dbscan = dbscan_anomalies(series_df, eps=1.0, min_samples=5)
-n_dbscan = plot_anomalies(
-    series_df,
-    anomalies_dbscan,
-    "Anomalies Detected by DBSCAN",
-    "figures/dbscan_anomalies.png"
-)
-
-anomalies_kmeans = kmeans_anomalies(series_df)
-n_kmeans = plot_anomalies(
-    series_df,
-    anomalies_kmeans,
-    "Anomalies Detected by k-means",
-    "figures/kmeans_anomalies.png"
-)
-
-# Combined approach
-anomalies_combined = combined_anomaly_detection([anomalies_dbscan, anomalies_iforest, anomalies_kmeans, anomalies_zscore])
-n_combined = plot_anomalies(
-    series_df,
-    anomalies_combined,
-    "Anomalies Detected by Combined Methods",
-    "figures/combined_anomalies.png"
-)
-
-# Create a summary table
-methods = ['Z-Score', 'Isolation Forest', 'DBSCAN', 'k-means', 'Combined (Majority Vote)']
-anomaly_counts = [n_zscore, n_iforest, n_dbscan, n_kmeans, n_combined]
-summary_df = pd.DataFrame({
-    'Method': methods,
-    'Anomalies Detected': anomaly_counts,
-    'Percentage': [count / len(series_df) * 100 for count in anomaly_counts]
-})
-
-print("\nSummary of anomaly detection methods:")
-print(summary_df)
\ No newline at end of file
+def main():
+    profile_from_env()
+    # Configuration
+    db_name = 'cgm_light.db'
+    model_path = 'models/anomaly_models.joblib'
+    series_id = 2  # Focus on one series for the example
+    smoothing = None  # opt in to denoising before differencing with 'savgol' or 'kalman'
+
+    df = load_cgm_data(db_name)
+    # Segments written by changepoints.py; without them the series is normalized as a whole
+    series_df = prepare_series(df, series_id, load_segments(db_name, series_id), smoothing)
+
+    print("Data overview with rate of change:")
+    print(series_df.head())
+
+    print("\nApplying anomaly detection methods...")
+
+    # Z-Score method
+    anomalies_zscore = z_score_anomalies(series_df)
+    n_zscore = plot_anomalies(
+        series_df,
+        anomalies_zscore,
+        "Anomalies Detected by Z-Score Method",
+        "figures/zscore_anomalies.png"
+    )
+
+    # Isolation Forest
+    anomalies_iforest = isolation_forest_anomalies(series_df)
+    n_iforest = plot_anomalies(
+        series_df,
+        anomalies_iforest,
+        "Anomalies Detected by Isolation Forest",
+        "figures/iforest_anomalies.png"
+    )
+
+    # DBSCAN
+    anomalies_dbscan = dbscan_anomalies(series_df, eps=1.0, min_samples=5)
+    n_dbscan = plot_anomalies(
+        series_df,
+        anomalies_dbscan,
+        "Anomalies Detected by DBSCAN",
+        "figures/dbscan_anomalies.png"
+    )
+
+    anomalies_kmeans = kmeans_anomalies(series_df)
+    n_kmeans = plot_anomalies(
+        series_df,
+        anomalies_kmeans,
+        "Anomalies Detected by k-means",
+        "figures/kmeans_anomalies.png"
+    )
+
+    # Matrix profile discords (unusual multi-hour curve shapes)
+    anomalies_discord = matrix_profile_anomalies(series_df)
+    n_discord = plot_anomalies(
+        series_df,
+        anomalies_discord,
+        "Anomalies Detected by Matrix Profile Discords",
+        "figures/discord_anomalies.png"
+    )
+
+    # Combined approach
+    anomalies_combined = combined_anomaly_detection([anomalies_dbscan, anomalies_iforest, anomalies_kmeans, anomalies_zscore])
+    n_combined = plot_anomalies(
+        series_df,
+        anomalies_combined,
+        "Anomalies Detected by Combined Methods",
+        "figures/combined_anomalies.png"
+    )
+
+    # Create a summary table
+    methods = ['Z-Score', 'Isolation Forest', 'DBSCAN', 'k-means', 'Matrix Profile', 'Combined (Majority Vote)']
+    anomaly_counts = [n_zscore, n_iforest, n_dbscan, n_kmeans, n_discord, n_combined]
+    summary_df = pd.DataFrame({
+        'Method': methods,
+        'Anomalies Detected': anomaly_counts,
+        'Percentage': [count / len(series_df) * 100 for count in anomaly_counts]
+    })
+
+    print("\nSummary of anomaly detection methods:")
+    print(summary_df)
+
+    # Persist models fitted on every series for the scoring service
+    feature_frames = [prepare_series(df, sid, smoothing=smoothing) for sid in df['series_id'].unique()]
+    save_anomaly_models(fit_anomaly_models(pd.concat(feature_frames), smoothing=smoothing), model_path)
+    print(f"\nAnomaly models saved to {model_path}")
+
+if __name__ == "__main__":
+    main()
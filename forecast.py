@@ -0,0 +1,184 @@
+import os
+import sqlite3
+from datetime import datetime
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+
+from glucose_series import GlucoseSeries
+from instrumentation import count, profile_from_env, traced
+
+# Same feature set and 30 minute horizon as the notebook forecaster
+FEATURES = ['hour', 'dayofweek', 'glucose_lag_1', 'glucose_lag_6', 'series_id']
+TARGET = 'glucose_target'
+HORIZON_STEPS = 6  # 6 x 5 minutes = 30 minutes in the future
+
+@traced('query.cgm_data')
+def load_cgm_data(db_name):
+    """Load all CGM readings, sorted and de-duplicated per series."""
+    conn = sqlite3.connect(db_name)
+    df = pd.read_sql("SELECT * FROM cgm_data", conn)
+    conn.close()
+    count('query.rows', len(df))
+
+    df['datetime'] = pd.to_datetime(df['datetime'])
+    df.sort_values(by=['series_id', 'datetime'], inplace=True)
+
+    # Remove duplicates
+    return df.groupby(['series_id', 'datetime'], as_index=False).agg({'blood_glucose': 'mean'})
+
+@traced('features.resample')
+def resample_series(df):
+    """Resample every series to 5-minute intervals and interpolate the gaps."""
+    resampled = []
+    for sid, group in df.groupby('series_id'):
+        group = group[['datetime', 'blood_glucose']].set_index('datetime').sort_index()
+
+        # Resample to 5-minute intervals
+        group_resampled = group.resample('5min').mean()
+
+        # Interpolate missing values
+        if group_resampled['blood_glucose'].notna().sum() >= 3:
+            try:
+                group_resampled['blood_glucose'] = group_resampled['blood_glucose'].interpolate(method='polynomial', order=2)
+            except Exception:
+                group_resampled['blood_glucose'] = group_resampled['blood_glucose'].interpolate(method='linear')
+        else:
+            group_resampled['blood_glucose'] = group_resampled['blood_glucose'].interpolate(method='linear')
+
+        # Fill remaining edge NaNs
+        group_resampled['blood_glucose'] = group_resampled['blood_glucose'].bfill().ffill()
+
+        # Add series_id back
+        group_resampled['series_id'] = sid
+        resampled.append(group_resampled)
+
+    return pd.concat(resampled).reset_index()
+
+@traced('features.forecast')
+def build_features(df_resampled):
+    """Add the time, lag and target columns used by the forecaster."""
+    df_resampled = df_resampled.copy()
+    df_resampled['hour'] = df_resampled['datetime'].dt.hour
+    df_resampled['dayofweek'] = df_resampled['datetime'].dt.dayofweek
+    grouped = df_resampled.groupby('series_id')['blood_glucose']
+    df_resampled['glucose_lag_1'] = grouped.shift(1)
+    df_resampled['glucose_lag_6'] = grouped.shift(6)
+    df_resampled[TARGET] = grouped.shift(-HORIZON_STEPS)
+    return df_resampled.dropna()
+
+def cached_features(db_name, cache_dir="cache"):
+    """Return build_features(resample_series(...)) for a database, cached on disk.
+
+    The cache key is the database path, size and modification time, so any
+    ingestion into the database invalidates it. Only the latest entry per
+    database is kept; older ones are deleted when a new one is written.
+    """
+    stat = os.stat(db_name)
+    prefix = f"features_{os.path.basename(db_name)}_"
+    cache_path = os.path.join(cache_dir, f"{prefix}{stat.st_size}_{int(stat.st_mtime)}.pkl")
+    if os.path.exists(cache_path):
+        return pd.read_pickle(cache_path)
+
+    df_ml = build_features(resample_series(load_cgm_data(db_name)))
+    os.makedirs(cache_dir, exist_ok=True)
+    for name in os.listdir(cache_dir):
+        if name.startswith(prefix) and name.endswith(".pkl"):
+            os.remove(os.path.join(cache_dir, name))
+    df_ml.to_pickle(cache_path)
+    return df_ml
+
+def encode_features(X, columns=None):
+    """One-hot encode series_id, optionally aligning to a trained column layout."""
+    if columns is None:
+        return pd.get_dummies(X, columns=['series_id'], drop_first=True)
+
+    # get_dummies on a small batch would drop a different first category,
+    # so rebuild the indicator columns from the trained layout instead.
+    # Unseen series get all-zero indicator columns.
+    encoded = X.drop(columns=['series_id'])
+    series_ids = X['series_id'].astype(str)
+    for col in columns:
+        if col.startswith('series_id_'):
+            encoded[col] = series_ids == col[len('series_id_'):]
+    return encoded[columns]
+
+@traced('model.fit.forecaster')
+def train_forecaster(df_ml, n_estimators=200, max_depth=20, min_samples_split=5, features=FEATURES):
+    """Fit the random forest forecaster and return it with its column layout."""
+    X = encode_features(df_ml[features])
+    y = df_ml[TARGET]
+
+    model = RandomForestRegressor(
+        n_estimators=n_estimators,
+        max_depth=max_depth,
+        min_samples_split=min_samples_split,
+        max_features='sqrt',
+        random_state=42,
+        n_jobs=-1
+    )
+    model.fit(X, y)
+    return {
+        'model': model,
+        'features': list(features),
+        'columns': list(X.columns),
+        'trained_at': datetime.now().isoformat()
+    }
+
+def save_forecaster(bundle, path):
+    """Persist a trained forecaster bundle to disk."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    joblib.dump(bundle, path)
+
+def load_forecaster(path):
+    """Load a forecaster bundle written by save_forecaster."""
+    return joblib.load(path)
+
+def latest_feature_rows(requests):
+    """Build one feature row per request from its latest raw readings.
+
+    Each request is a GlucoseSeries or a (series_id, times, values) tuple
+    where times are epoch seconds (from naive local datetimes) in ascending
+    order. The lag values are read off a linear interpolation of the
+    readings, which matches the 5-minute resampled grid the model was trained
+    on without a per-request pandas resample.
+    """
+    rows = []
+    for request in requests:
+        if isinstance(request, GlucoseSeries):
+            # Only the last 30 minutes matter; recent() is a view, so nothing is copied
+            recent = request.recent(30)
+            series_id, times, values = request.series_id, recent.times / 1e9, recent.values
+            ts = pd.Timestamp(recent.times[-1])
+        else:
+            series_id, times, values = request
+            ts = datetime.fromtimestamp(times[-1])
+        now = times[-1]
+        lags = np.interp([now - 5 * 60, now - 30 * 60], times, values)
+        rows.append((ts.hour, ts.weekday(), lags[0], lags[1], series_id))
+    return pd.DataFrame(rows, columns=FEATURES)
+
+@traced('model.predict.forecaster')
+def predict_latest(bundle, requests):
+    """Forecast glucose 30 minutes past the latest reading for a batch of series."""
+    X = encode_features(latest_feature_rows(requests), bundle['columns'])
+    return bundle['model'].predict(X)
+
+def main():
+    profile_from_env()
+    # Configuration
+    db_name = "cgm_light.db"
+    model_path = "models/forecaster.joblib"
+
+    df = load_cgm_data(db_name)
+    df_ml = build_features(resample_series(df))
+
+    print(f"Training forecaster on {len(df_ml)} rows...")
+    bundle = train_forecaster(df_ml)
+    save_forecaster(bundle, model_path)
+    print(f"Forecaster saved to {model_path}")
+
+if __name__ == "__main__":
+    main()
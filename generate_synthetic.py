@@ -0,0 +1,161 @@
+import csv
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+from scipy.signal import lfilter
+
+FORMATS = ['kaggle', 'libre', 'tandem', 'dataset_1']
+READING_MINUTES = 5
+MGDL_PER_MMOL = 18.018
+
+def synthetic_patient(seed, n_days, start=datetime(2024, 1, 1)):
+    """Deterministic glucose, meal and bolus traces for one synthetic patient.
+
+    Glucose is a baseline with a circadian swing, meal responses and bolus
+    effects (gamma-shaped kernels convolved with the events) plus AR(1)
+    sensor noise, sampled every 5 minutes with small timing jitter and
+    occasional dropouts.
+    """
+    rng = np.random.default_rng(seed)
+    n = n_days * 24 * 60 // READING_MINUTES
+    minutes = np.arange(n) * READING_MINUTES
+
+    # Three meals a day at jittered times, boluses matched to carbs
+    meal_times = (np.arange(n_days)[:, None] * 24 * 60 + np.array([8, 13, 19]) * 60
+                  + rng.normal(0, 30, (n_days, 3))).ravel().clip(0, n * READING_MINUTES - 1)
+    carbs = rng.uniform(20, 80, len(meal_times)).round()
+    carb_ratio = rng.uniform(8, 15)
+    bolus_units = (carbs / carb_ratio * rng.uniform(0.8, 1.2, len(carbs))).round(2)
+
+    impulses_carbs = np.bincount((meal_times // READING_MINUTES).astype(int), weights=carbs, minlength=n)
+    impulses_insulin = np.bincount((meal_times // READING_MINUTES).astype(int), weights=bolus_units, minlength=n)
+    t = np.arange(0, 6 * 60, READING_MINUTES)
+    carb_kernel = (t / 45) * np.exp(1 - t / 45)  # peaks 45 min after eating
+    insulin_kernel = (t / 75) * np.exp(1 - t / 75)  # peaks 75 min after the bolus
+    meal_effect = np.convolve(impulses_carbs, carb_kernel)[:n] * rng.uniform(2.5, 4)
+    insulin_effect = np.convolve(impulses_insulin, insulin_kernel)[:n] * rng.uniform(25, 40)
+
+    # AR(1): noise[i] = 0.95 * noise[i - 1] + shock[i], starting from zero
+    shocks = rng.normal(0, 3, n)
+    shocks[0] = 0
+    noise = lfilter([1], [1, -0.95], shocks)
+
+    baseline = rng.uniform(110, 160)
+    circadian = 15 * np.sin(2 * np.pi * (minutes / (24 * 60) - 0.25))
+    glucose = np.clip(baseline + circadian + meal_effect - insulin_effect + noise, 40, 400).round()
+
+    # Sensor timing jitter and ~1% dropped readings
+    seconds = minutes * 60 + rng.integers(0, 30, n)
+    keep = rng.random(n) > 0.01
+    times = [start + timedelta(seconds=int(s)) for s in seconds[keep]]
+    meal_datetimes = [start + timedelta(minutes=float(m)) for m in meal_times]
+    basal_times = [start + timedelta(hours=h) for h in range(0, n_days * 24, 6)]
+    basal_rates = rng.uniform(0.5, 1.2, len(basal_times)).round(3)
+    return {
+        'times': times,
+        'glucose': glucose[keep],
+        'meal_times': [m.replace(microsecond=0) for m in meal_datetimes],
+        'carbs': carbs,
+        'bolus_units': bolus_units,
+        'basal_times': basal_times,
+        'basal_rates': basal_rates,
+    }
+
+def write_kaggle(path, patient):
+    """DeviceDtTm/Glucose format read by ingest_kaggle_dataset.py."""
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(["DeviceDtTm", "Glucose"])
+        for dt, bg in zip(patient['times'], patient['glucose']):
+            writer.writerow([dt.strftime("%Y-%m-%d %H:%M:%S.%f"), int(bg)])
+
+def write_libre(path, patient):
+    """Date/Time/Glucose mmol/L format read by ingest_libre.py."""
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(["Date", "Time", "Glucose mmol/L"])
+        seen = set()
+        for dt, bg in zip(patient['times'], patient['glucose']):
+            # Libre exports have minute resolution
+            key = dt.strftime("%d/%m/%Y %H:%M")
+            if key in seen:
+                continue
+            seen.add(key)
+            writer.writerow([dt.strftime("%d/%m/%Y"), dt.strftime("%H:%M"), round(bg / MGDL_PER_MMOL, 1)])
+
+def write_tandem(path, patient):
+    """Multi-section Tandem t:slim export read by ingest_tandem.py."""
+    width = 20
+    pad = lambda row: row + [''] * (width - len(row))
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(pad(["Tandem Diabetes Care Inc."]))
+        writer.writerow(pad(["Source Daily Timeline Data Export"]))
+        writer.writerow(pad(["Patient Name", "SYNTHETIC"]))
+        writer.writerow(pad([]))
+        writer.writerow(pad(["DeviceType", "SerialNumber", "Description", "EventDateTime", "Readings (mg/dL)"]))
+        for dt, bg in zip(patient['times'], patient['glucose']):
+            writer.writerow(pad(["t:slim X2", "9999999", "EGV", dt.isoformat(), int(bg)]))
+        writer.writerow(pad([]))
+        writer.writerow(["Type", "BolusType", "BolusDeliveryMethod", "BG (mg/dL)", "SerialNumber",
+                         "CompletionDateTime", "InsulinDelivered", "FoodDelivered", "CorrectionDelivered",
+                         "CompletionStatusDesc", "BolexStartDateTime", "BolexCompletionDateTime",
+                         "BolexInsulinDelivered", "BolexCompletionStatusDesc", "StandardPercent",
+                         "Duration (mins)", "CarbSize", "TargetBG (mg/dL)", "CorrectionFactor", "CarbRatio"])
+        for dt, carbs, units in zip(patient['meal_times'], patient['carbs'], patient['bolus_units']):
+            writer.writerow(["Bolus", "Food", "Standard", "", "9999999", dt.isoformat(), units, units, 0,
+                             "Completed", "", "", "", "", 100, 0, int(carbs), 110, 50, 10])
+
+def write_dataset_1(directory, patient):
+    """Split glucose/basals/boluses/meals CSVs read by ingest_dataset_1.py."""
+    def write(name, header, rows):
+        with open(os.path.join(directory, name), 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(["date", "time", header])
+            for dt, value in rows:
+                writer.writerow([dt.strftime("%Y/%m/%d"), dt.strftime("%H:%M:%S"), value])
+
+    write("glucose.csv", "glucose_level", zip(patient['times'], patient['glucose'].astype(int)))
+    write("basals.csv", "basal_rate", zip(patient['basal_times'], patient['basal_rates']))
+    write("boluses.csv", "bolus_volume_delivered", zip(patient['meal_times'], patient['bolus_units']))
+    # dataset_1 records meals in kcal; the loader converts back at 8 kcal per gram
+    write("meals.csv", "meal_kcal", zip(patient['meal_times'], (patient['carbs'] * 8).astype(int)))
+
+def generate_cohort(output_dir, n_patients, n_days, seed=42, formats=FORMATS):
+    """Write n_patients x n_days of synthetic data in every requested input format.
+
+    Each patient gets its own directory per format (the directory-per-series
+    layout the loaders expect); kaggle files are additionally grouped g1-g5
+    like the real dataset. Returns {format: [patient directories]}.
+    """
+    layout = {fmt: [] for fmt in formats}
+    for i in range(n_patients):
+        # One trace per patient index, written in every format
+        patient = synthetic_patient(seed + i, n_days)
+        for fmt in formats:
+            patient_dir = os.path.join(output_dir, fmt, f"patient_{i:04d}")
+            os.makedirs(patient_dir, exist_ok=True)
+            if fmt == 'kaggle':
+                write_kaggle(os.path.join(patient_dir, f"g{i % 5 + 1}_Patient_{i}_{i % 10 + 1}.csv"), patient)
+            elif fmt == 'libre':
+                write_libre(os.path.join(patient_dir, "libre_cgm_dataset.csv"), patient)
+            elif fmt == 'tandem':
+                write_tandem(os.path.join(patient_dir, "CSV_synthetic.csv"), patient)
+            elif fmt == 'dataset_1':
+                write_dataset_1(patient_dir, patient)
+            layout[fmt].append(patient_dir)
+    return layout
+
+def main():
+    # Configuration
+    output_dir = "./synthetic_data"
+    n_patients = 10
+    n_days = 14
+
+    layout = generate_cohort(output_dir, n_patients, n_days)
+    for fmt, dirs in layout.items():
+        print(f"{fmt}: {len(dirs)} patients x {n_days} days in {output_dir}/{fmt}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+from changepoints import segment_labels
+from smoothing import smoothed_derivatives
+
+NS_PER_MINUTE = 60 * 10**9
+
+class GlucoseSeries:
+    """One series' readings as contiguous arrays instead of a DataFrame.
+
+    times holds int64 nanoseconds of naive local datetimes (the datetime64[ns]
+    values pandas uses), values holds float32 mg/dL. After with_derivatives(),
+    features is an (n, 2) float32 array of rate of change and acceleration
+    aligned with times. After with_segments(), segments holds each reading's
+    change-point segment number. Slicing by time returns views, never copies.
+    """
+    __slots__ = ('series_id', 'times', 'values', 'features', 'segments')
+
+    def __init__(self, series_id, times, values, features=None, segments=None):
+        self.series_id = series_id
+        self.times = times
+        self.values = values
+        self.features = features
+        self.segments = segments
+
+    @classmethod
+    def from_arrays(cls, series_id, times, values):
+        """Build from datetimes (any numpy/pandas form) and glucose values, sorted and without NaNs."""
+        times = np.asarray(pd.to_datetime(times), dtype='datetime64[ns]').view(np.int64)
+        values = np.asarray(values, dtype=np.float32)
+        keep = ~np.isnan(values)
+        order = np.argsort(times[keep], kind='stable')
+        return cls(series_id, np.ascontiguousarray(times[keep][order]), np.ascontiguousarray(values[keep][order]))
+
+    @classmethod
+    def from_frame(cls, df, series_id=None):
+        """Build from a frame with a 'datetime' column (or datetime index) and 'blood_glucose'."""
+        times = df['datetime'] if 'datetime' in df.columns else df.index
+        if series_id is None and 'series_id' in df.columns and len(df):
+            series_id = int(df['series_id'].iloc[0])
+        return cls.from_arrays(series_id, times, df['blood_glucose'].values)
+
+    @classmethod
+    def from_db(cls, conn, series_id):
+        """Load one series from cgm_data."""
+        rows = conn.execute("SELECT datetime, blood_glucose FROM cgm_data WHERE series_id = ? "
+                            "AND blood_glucose IS NOT NULL ORDER BY datetime", (series_id,)).fetchall()
+        times = pd.to_datetime([r[0] for r in rows], format='ISO8601')
+        return cls.from_arrays(series_id, times, [r[1] for r in rows])
+
+    def __len__(self):
+        return len(self.times)
+
+    def __repr__(self):
+        span = f"{self.datetimes[0]} to {self.datetimes[-1]}" if len(self) else "empty"
+        return f"GlucoseSeries(series_id={self.series_id}, {len(self)} readings, {span})"
+
+    @property
+    def datetimes(self):
+        """times as a datetime64[ns] view."""
+        return self.times.view('datetime64[ns]')
+
+    @property
+    def rate_of_change(self):
+        return self.features[:, 0]
+
+    @property
+    def acceleration(self):
+        return self.features[:, 1]
+
+    @property
+    def nbytes(self):
+        return self.times.nbytes + self.values.nbytes + (self.features.nbytes if self.features is not None else 0)
+
+    def with_derivatives(self, smoothing=None):
+        """Rate of change (mg/dL per minute) and acceleration, as find_anomalies.add_derivative_features.
+
+        The first two readings have no acceleration and are dropped, like the
+        DataFrame version's dropna(). With smoothing ('savgol' or 'kalman'),
+        readings without a defined derivative are dropped and values stay raw.
+        """
+        if smoothing is not None:
+            _, roc, acc = smoothed_derivatives(self.times, self.values, smoothing)
+            keep = np.isfinite(roc) & np.isfinite(acc)
+            features = np.column_stack([roc[keep], acc[keep]]).astype(np.float32)
+            segments = self.segments[keep] if self.segments is not None else None
+            return GlucoseSeries(self.series_id, self.times[keep], self.values[keep], features, segments)
+        minutes = np.diff(self.times) / NS_PER_MINUTE
+        roc = np.diff(self.values.astype(np.float64)) / minutes
+        acc = np.diff(roc) / minutes[1:]
+        features = np.empty((len(acc), 2), dtype=np.float32)
+        features[:, 0] = roc[1:]
+        features[:, 1] = acc
+        segments = self.segments[2:] if self.segments is not None else None
+        return GlucoseSeries(self.series_id, self.times[2:], self.values[2:], features, segments)
+
+    def with_segments(self, segments):
+        """Label each reading with its stored change-point segment (changepoints.load_segments).
+
+        Detectors then normalize features within each segment; without
+        stored segments the series is returned unchanged.
+        """
+        if len(segments) == 0:
+            return self
+        return GlucoseSeries(self.series_id, self.times, self.values, self.features,
+                             segment_labels(self.datetimes, segments))
+
+    def _slice(self, lo, hi):
+        features = self.features[lo:hi] if self.features is not None else None
+        segments = self.segments[lo:hi] if self.segments is not None else None
+        return GlucoseSeries(self.series_id, self.times[lo:hi], self.values[lo:hi], features, segments)
+
+    def between(self, start, end):
+        """Readings with start <= time <= end, as views into this series."""
+        lo = np.searchsorted(self.times, pd.Timestamp(start).value, side='left')
+        hi = np.searchsorted(self.times, pd.Timestamp(end).value, side='right')
+        return self._slice(lo, hi)
+
+    def around(self, i, minutes):
+        """Readings within `minutes` of reading i, as views."""
+        lo = np.searchsorted(self.times, self.times[i] - minutes * NS_PER_MINUTE, side='left')
+        hi = np.searchsorted(self.times, self.times[i] + minutes * NS_PER_MINUTE, side='right')
+        return self._slice(lo, hi)
+
+    def recent(self, minutes):
+        """The last `minutes` of readings plus the one before, so interpolating at the cutoff stays exact."""
+        cutoff = self.times[-1] - minutes * NS_PER_MINUTE
+        return self._slice(max(0, np.searchsorted(self.times, cutoff, side='right') - 1), len(self))
+
+    def to_frame(self):
+        """DataFrame indexed by datetime, with the feature columns when present."""
+        df = pd.DataFrame({'blood_glucose': self.values}, index=pd.DatetimeIndex(self.datetimes, name='datetime'))
+        if self.features is not None:
+            df['rate_of_change'] = self.rate_of_change
+            df['acceleration'] = self.acceleration
+        return df
+
+def load_all_series(db_name):
+    """{series_id: GlucoseSeries} for every series in a database."""
+    conn = sqlite3.connect(db_name)
+    df = pd.read_sql("SELECT series_id, datetime, blood_glucose FROM cgm_data", conn)
+    conn.close()
+    df['datetime'] = pd.to_datetime(df['datetime'], format='ISO8601')
+    return {int(sid): GlucoseSeries.from_frame(group, sid) for sid, group in df.groupby('series_id')}
+
+def main():
+    # Configuration
+    db_name = "cgm_light.db"
+    series_id = 2
+
+    from find_anomalies import load_cgm_data, prepare_series
+
+    df = load_cgm_data(db_name)
+    frame = prepare_series(df, series_id)
+    series = GlucoseSeries.from_frame(df[df['series_id'] == series_id], series_id).with_derivatives()
+    print(series)
+    print(f"DataFrame: {frame.memory_usage(index=True, deep=True).sum() / 1024:.0f} KiB, "
+          f"GlucoseSeries: {series.nbytes / 1024:.0f} KiB")
+
+    # Per-anomaly context windows, as plot_anomalies takes them
+    positions = np.linspace(0, len(series) - 1, 1000).astype(int)
+    start = time.perf_counter()
+    for i in positions:
+        t = frame.index[i]
+        frame[(frame.index >= t - pd.Timedelta(minutes=60)) & (frame.index <= t + pd.Timedelta(minutes=60))]
+    pandas_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in positions:
+        series.around(i, 60)
+    print(f"1000 context windows: pandas {pandas_seconds * 1000:.1f} ms, "
+          f"GlucoseSeries {(time.perf_counter() - start) * 1000:.1f} ms")
+
+if __name__ == "__main__":
+    main()
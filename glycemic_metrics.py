@@ -0,0 +1,241 @@
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import count, profile_from_env, traced
+
+# Glucose bands (mg/dL) from the international consensus on CGM metrics
+BANDS = {
+    'pct_below_54': (-np.inf, 54),
+    'pct_54_69': (54, 70),
+    'pct_70_180': (70, 180.5),
+    'pct_181_250': (180.5, 250.5),
+    'pct_above_250': (250.5, np.inf),
+}
+# Episodes must last at least this long to count
+MIN_EPISODE_MINUTES = 15
+# A gap longer than this between readings ends an episode
+MAX_GAP_MINUTES = 30
+EPISODES = {
+    'hypo_episodes': lambda bg: bg < 70,
+    'severe_hypo_episodes': lambda bg: bg < 54,
+    'hyper_episodes': lambda bg: bg > 250,
+}
+WINDOWS = {'all': None, 'day': 'D', 'week': 'W-SUN'}  # weeks start on Monday
+
+METRIC_COLUMNS = ['n_readings', 'mean_glucose', 'sd', 'cv', 'gmi'] + list(BANDS) + ['mage'] + list(EPISODES)
+
+def create_metrics_table(conn):
+    """Create the glycemic_metrics table if it does not exist."""
+    columns = ",\n        ".join(f"{col} REAL" for col in METRIC_COLUMNS)
+    conn.execute(f'''
+    CREATE TABLE IF NOT EXISTS glycemic_metrics (
+        series_id INTEGER,
+        window TEXT,
+        window_start TEXT,
+        {columns},
+        FOREIGN KEY (series_id) REFERENCES series (series_id),
+        PRIMARY KEY (series_id, window, window_start)
+    )
+    ''')
+    conn.commit()
+
+@traced('query.readings')
+def load_readings(conn):
+    """All readings with a glucose value, sorted by series and time."""
+    df = pd.read_sql("SELECT series_id, datetime, blood_glucose FROM cgm_data WHERE blood_glucose IS NOT NULL", conn)
+    count('query.rows', len(df))
+    df['datetime'] = pd.to_datetime(df['datetime'], format='ISO8601')
+    return df.sort_values(['series_id', 'datetime'], kind='stable').reset_index(drop=True)
+
+def _window_start(df, freq):
+    if freq is None:
+        return pd.Series(pd.Timestamp(0), index=df.index)
+    if freq == 'D':
+        return df['datetime'].dt.floor('D')
+    return df['datetime'].dt.to_period(freq).dt.start_time
+
+def _run_starts(series_ids, flag):
+    """Boolean mask of rows that start a new run of equal flag values within a series."""
+    new_series = np.r_[True, series_ids[1:] != series_ids[:-1]]
+    changed = np.r_[True, flag[1:] != flag[:-1]]
+    return new_series | changed
+
+def episode_run_ids(series_ids, times, flag):
+    """Run id per reading, the episode definition shared with episodes.py.
+
+    A new run starts at a new series, where the condition flag changes, or
+    after a gap of more than MAX_GAP_MINUTES between readings.
+    """
+    gap = np.r_[False, np.diff(times) > np.timedelta64(MAX_GAP_MINUTES, 'm')]
+    return np.cumsum(_run_starts(series_ids, flag) | gap)
+
+def episode_counts(df, keys):
+    """Count qualifying episodes per window with vectorized run-length detection.
+
+    An episode is a run of consecutive readings meeting the condition, with
+    no gap over MAX_GAP_MINUTES and lasting at least MIN_EPISODE_MINUTES; it
+    is counted in the window where it starts.
+    """
+    series_ids = df['series_id'].values
+    times = df['datetime'].values
+    counts = {}
+    for name, condition in EPISODES.items():
+        flag = condition(df['blood_glucose'].values)
+        run_id = episode_run_ids(series_ids, times, flag)
+        runs = pd.DataFrame({'run': run_id[flag], 'time': times[flag], 'row': np.flatnonzero(flag)})
+        runs = runs.groupby('run').agg(first=('time', 'first'), last=('time', 'last'), row=('row', 'first'))
+        long_enough = (runs['last'] - runs['first']) >= pd.Timedelta(minutes=MIN_EPISODE_MINUTES)
+        starts = keys.iloc[runs.loc[long_enough, 'row'].values]
+        counts[name] = starts.groupby(list(starts.columns)).size()
+    return pd.DataFrame(counts)
+
+def excursion_amplitudes(bg, threshold):
+    """Amplitudes of the excursions between confirmed peaks and nadirs.
+
+    A peak (or nadir) is confirmed only once glucose has reversed from it by
+    more than threshold, so noise smaller than that never splits an
+    excursion. The last excursion counts once it has exceeded threshold.
+    """
+    amplitudes = []
+    direction = 0
+    low = high = pivot = extreme = bg[0]
+    for x in bg[1:]:
+        if direction == 0:
+            low, high = min(low, x), max(high, x)
+            if high - low > threshold:
+                direction = 1 if x == high else -1
+                pivot, extreme = (low, high) if direction == 1 else (high, low)
+        elif direction * (x - extreme) > 0:
+            extreme = x
+        elif direction * (extreme - x) > threshold:
+            amplitudes.append(abs(extreme - pivot))
+            pivot, extreme, direction = extreme, x, -direction
+    if direction:
+        amplitudes.append(abs(extreme - pivot))
+    return amplitudes
+
+def mage(df, keys, sd):
+    """Mean amplitude of glycemic excursions per window.
+
+    Excursions are peak-to-nadir and nadir-to-peak swings whose reversal
+    exceeds the window's standard deviation (excursion_amplitudes); MAGE is
+    their mean in both directions. Only local turning points and the
+    window's first and last readings can be peaks or nadirs, so the
+    per-window scan runs over those alone.
+    """
+    bg = df['blood_glucose'].values
+    series_ids = df['series_id'].values
+    window_starts = keys['window_start'].values
+    new_group = np.r_[True, (series_ids[1:] != series_ids[:-1]) | (window_starts[1:] != window_starts[:-1])]
+    starts = np.flatnonzero(new_group)
+    ends = np.r_[starts[1:], len(bg)]
+
+    slope = np.sign(np.diff(bg))
+    # Carry the last non-zero slope over flat stretches so plateaus do not split excursions
+    nonzero = slope != 0
+    slope = slope[np.maximum.accumulate(np.where(nonzero, np.arange(len(slope)), 0))]
+    keep = np.zeros(len(bg), dtype=bool)
+    keep[1:-1] = slope[1:] != slope[:-1]
+    keep[starts] = True
+    keep[ends - 1] = True
+    kept_before = np.r_[0, np.cumsum(keep)]
+
+    index = pd.MultiIndex.from_arrays([series_ids[starts], window_starts[starts]], names=list(keys.columns))
+    thresholds = sd.reindex(index).values
+    points = bg[keep]
+    result = np.full(len(starts), np.nan)
+    for i, (lo, hi) in enumerate(zip(kept_before[starts], kept_before[ends])):
+        window = points[lo:hi]
+        window = window[~np.isnan(window)]
+        amplitudes = excursion_amplitudes(window, thresholds[i]) if len(window) > 1 else []
+        if amplitudes:
+            result[i] = np.mean(amplitudes)
+    return pd.Series(result, index=index)
+
+@traced('metrics.compute')
+def compute_metrics(df, window='day'):
+    """Metrics for every (series, window) in one grouped pass over the readings."""
+    keys = pd.DataFrame({'series_id': df['series_id'].values,
+                         'window_start': _window_start(df, WINDOWS[window]).values})
+    group_cols = ['series_id', 'window_start']
+    bg = df['blood_glucose'].values
+
+    values = keys.assign(bg=bg)
+    for name, (low, high) in BANDS.items():
+        values[name] = ((bg >= low) & (bg < high)) * 100.0
+    grouped = values.groupby(group_cols)
+    metrics = grouped[list(BANDS)].mean()
+    metrics.insert(0, 'n_readings', grouped['bg'].size())
+    metrics.insert(1, 'mean_glucose', grouped['bg'].mean())
+    metrics.insert(2, 'sd', grouped['bg'].std(ddof=0))
+    metrics.insert(3, 'cv', metrics['sd'] / metrics['mean_glucose'] * 100)
+    metrics.insert(4, 'gmi', 3.31 + 0.02392 * metrics['mean_glucose'])
+
+    metrics['mage'] = mage(df, keys, metrics['sd'])
+    metrics = metrics.join(episode_counts(df, keys))
+    metrics[list(EPISODES)] = metrics[list(EPISODES)].fillna(0)
+
+    metrics = metrics.reset_index()
+    metrics.insert(1, 'window', window)
+    return metrics
+
+def write_metrics(conn, metrics):
+    """Upsert computed metrics into the glycemic_metrics table."""
+    metrics = metrics.assign(window_start=metrics['window_start'].dt.strftime('%Y-%m-%dT%H:%M:%S'))
+    columns = ['series_id', 'window', 'window_start'] + METRIC_COLUMNS
+    rows = metrics[columns].astype(object).where(metrics[columns].notna(), None).values.tolist()
+    conn.executemany(
+        f"INSERT OR REPLACE INTO glycemic_metrics ({', '.join(columns)}) "
+        f"VALUES ({', '.join('?' * len(columns))})",
+        rows
+    )
+    conn.commit()
+
+def replicate_cohort(df, factor):
+    """Tile the readings into factor copies with distinct series ids for benchmarking."""
+    offset = int(df['series_id'].max())
+    copies = [df.assign(series_id=df['series_id'] + i * offset) for i in range(factor)]
+    return pd.concat(copies, ignore_index=True)
+
+def benchmark(df, scales=(1, 10, 100)):
+    """Time compute_metrics for each window type at several cohort sizes."""
+    results = []
+    for factor in scales:
+        cohort = replicate_cohort(df, factor)
+        for window in WINDOWS:
+            start = time.perf_counter()
+            metrics = compute_metrics(cohort, window)
+            elapsed = time.perf_counter() - start
+            results.append({'scale': factor, 'readings': len(cohort), 'window': window,
+                             'groups': len(metrics), 'seconds': elapsed,
+                             'readings_per_s': len(cohort) / elapsed})
+    return pd.DataFrame(results)
+
+def main():
+    profile_from_env()
+    # Configuration
+    db_name = "cgm_light.db"
+    run_benchmark = False  # time compute_metrics at 1x, 10x and 100x the cohort
+
+    conn = sqlite3.connect(db_name)
+    create_metrics_table(conn)
+    df = load_readings(conn)
+
+    for window in WINDOWS:
+        metrics = compute_metrics(df, window)
+        write_metrics(conn, metrics)
+        print(f"Wrote {len(metrics)} {window} metric rows")
+    conn.close()
+
+    print("\nOverall metrics per series:")
+    print(compute_metrics(df, 'all').drop(columns=['window', 'window_start']).round(2).to_string(index=False))
+
+    if run_benchmark:
+        print("\nBenchmark:")
+        print(benchmark(df).round(3).to_string(index=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import json
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import SGDRegressor
+from sklearn.preprocessing import StandardScaler
+
+from forecast import HORIZON_STEPS, TARGET, build_features, resample_series
+from instrumentation import profile_from_env, traced
+
+# Readings needed before the first new row to rebuild its lag features
+CONTEXT = timedelta(minutes=5 * 6 + 5)
+
+def new_state():
+    """Empty model state: one scaler/regressor pair and a watermark per series."""
+    return {'version': 0, 'models': {}, 'trained_through': {}}
+
+def incremental_feature_matrix(df_ml):
+    """Feature matrix for the linear per-series models.
+
+    Hour and weekday are encoded on the unit circle so a linear model can use
+    them; the lag columns match the notebook forecaster.
+    """
+    hour_angle = 2 * np.pi * df_ml['hour'].values / 24
+    day_angle = 2 * np.pi * df_ml['dayofweek'].values / 7
+    return np.column_stack([
+        np.sin(hour_angle), np.cos(hour_angle),
+        np.sin(day_angle), np.cos(day_angle),
+        df_ml['glucose_lag_1'].values,
+        df_ml['glucose_lag_6'].values,
+    ])
+
+def load_new_rows(conn, series_id, trained_through):
+    """Read only the readings a series has gained since it was last trained."""
+    query = "SELECT datetime, series_id, blood_glucose FROM cgm_data WHERE series_id = ?"
+    params = [series_id]
+    if trained_through is not None:
+        # idx_cgm_data_series_datetime (see update_from_db) serves this range scan
+        query += " AND datetime > ?"
+        params.append((trained_through - CONTEXT).isoformat())
+    df = pd.read_sql(query, conn, params=params)
+    df['datetime'] = pd.to_datetime(df['datetime'], format='ISO8601')
+    return df.groupby(['series_id', 'datetime'], as_index=False).agg({'blood_glucose': 'mean'})
+
+@traced('model.fit.incremental')
+def update_series(state, series_id, df):
+    """partial_fit one series' model on feature rows newer than its watermark."""
+    if df['blood_glucose'].count() < HORIZON_STEPS + 2:
+        return 0
+    df_ml = build_features(resample_series(df))
+    trained_through = state['trained_through'].get(series_id)
+    if trained_through is not None:
+        df_ml = df_ml[df_ml['datetime'] > trained_through]
+    if df_ml.empty:
+        return 0
+
+    X = incremental_feature_matrix(df_ml)
+    y = df_ml[TARGET].values
+    scaler, model = state['models'].setdefault(
+        series_id, (StandardScaler(), SGDRegressor(learning_rate='adaptive', eta0=0.01, random_state=42))
+    )
+    # The scaler is frozen after the first fit: rescaling later would silently
+    # change the meaning of the coefficients the model has already learned
+    if not hasattr(scaler, 'mean_'):
+        scaler.fit(X)
+    model.partial_fit(scaler.transform(X), y)
+
+    state['trained_through'][series_id] = df_ml['datetime'].max()
+    return len(df_ml)
+
+def update_from_db(state, db_name):
+    """Bring every series' model up to date with the readings added since the last update."""
+    conn = sqlite3.connect(db_name)
+    # The UNIQUE(datetime, series_id) index leads with datetime, so per-series catch-up needs its own
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_cgm_data_series_datetime ON cgm_data(series_id, datetime)")
+    conn.commit()
+    series_ids = [row[0] for row in conn.execute("SELECT series_id FROM series")]
+    rows_added = {}
+    for series_id in series_ids:
+        df = load_new_rows(conn, series_id, state['trained_through'].get(series_id))
+        if df.empty:
+            continue
+        n = update_series(state, series_id, df)
+        if n:
+            rows_added[series_id] = n
+    conn.close()
+    return rows_added
+
+@traced('model.predict.incremental')
+def predict(state, df_ml):
+    """Forecast TARGET for feature rows of any series that has a trained model."""
+    preds = np.full(len(df_ml), np.nan)
+    for series_id, idx in df_ml.groupby('series_id').indices.items():
+        if series_id not in state['models']:
+            continue
+        scaler, model = state['models'][series_id]
+        X = incremental_feature_matrix(df_ml.iloc[idx])
+        preds[idx] = model.predict(scaler.transform(X))
+    return preds
+
+def load_state(model_dir, version=None):
+    """Load the current (or a specific) model version, or a fresh state if none exist."""
+    manifest_path = os.path.join(model_dir, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return new_state()
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    version = manifest['current'] if version is None else version
+    return joblib.load(os.path.join(model_dir, f"v{version:04d}.joblib"))
+
+def save_state(state, model_dir, rows_added):
+    """Write the state as a new immutable version and point the manifest at it."""
+    os.makedirs(model_dir, exist_ok=True)
+    manifest_path = os.path.join(model_dir, "manifest.json")
+    manifest = {'current': 0, 'versions': []}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+
+    parent = state['version']
+    state['version'] = max([v['version'] for v in manifest['versions']] + [0]) + 1
+    joblib.dump(state, os.path.join(model_dir, f"v{state['version']:04d}.joblib"))
+
+    manifest['versions'].append({
+        'version': state['version'],
+        'parent': parent,
+        'created_at': datetime.now().isoformat(),
+        'rows_added': {str(k): v for k, v in rows_added.items()},
+    })
+    manifest['current'] = state['version']
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return state['version']
+
+def main():
+    profile_from_env()
+    # Configuration
+    db_name = "cgm_light.db"
+    model_dir = "models/incremental"
+
+    state = load_state(model_dir)
+    rows_added = update_from_db(state, db_name)
+
+    if not rows_added:
+        print(f"No new readings since version {state['version']}")
+        return
+
+    for series_id, n in rows_added.items():
+        print(f"Series {series_id}: trained on {n} new rows")
+    version = save_state(state, model_dir, rows_added)
+    print(f"Saved model version {version} to {model_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+import asyncio
+import importlib
+import json
+import os
+import sqlite3
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from glob import glob
+
+from episodes import refresh_episodes
+from ingest_tandem import create_database
+from instrumentation import count, count_insert_attempt, insert_table, profile_from_env, span
+from rollups import max_reading_id, refresh_rollups
+
+# (directory, loader module, file pattern, series per 'file' or per 'directory'), as in each loader's main
+SOURCES = [
+    ("./input_data/kaggle_data", "ingest_kaggle_dataset", "*.csv", "file"),
+    ("./input_data/dataset_1", "ingest_dataset_1", "*.csv", "directory"),
+    ("./input_data/labelled_cgm_dataset", "ingest_labelled_cgm", "*.csv", "directory"),
+    ("./input_data/libre_cgm_dataset", "ingest_libre", "*.csv", "directory"),
+    ("./input_data/lin_dataset", "ingest_lin_dataset", "*.csv", "directory"),
+    ("./input_data/personal_data", "ingest_tandem", "CSV_*.csv", "directory"),
+]
+
+class RowCollector:
+    """Stand-in connection that records a loader's INSERTs instead of executing them.
+
+    The loaders only call conn.cursor(), cursor.execute() and conn.commit()
+    inside process_csv_file, so passing a RowCollector reuses their parsing
+    unchanged and leaves the writes to be batched later.
+    """
+    def __init__(self):
+        self.statements = defaultdict(list)
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, parameters=()):
+        self.statements[sql].append(tuple(parameters))
+        table = insert_table(sql)
+        if table is not None:
+            count_insert_attempt(table)
+        return self
+
+    def commit(self):
+        pass
+
+    def n_rows(self):
+        return sum(len(rows) for rows in self.statements.values())
+
+def parse_file(loader_name, path, series_id):
+    """Run a loader's process_csv_file against a RowCollector (in a worker process)."""
+    collector = RowCollector()
+    importlib.import_module(loader_name).process_csv_file(path, series_id, collector)
+    return dict(collector.statements)
+
+def create_state_table(conn):
+    """Create the ingest_state table if it does not exist."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS ingest_state (
+        path TEXT PRIMARY KEY,
+        series_id INTEGER,
+        size INTEGER,
+        mtime REAL,
+        rows INTEGER,
+        ingested_at TEXT
+    )
+    ''')
+    conn.commit()
+
+def load_state(conn):
+    """{path: (series_id, size, mtime)} for every file and directory the daemon has ingested."""
+    return {path: (series_id, size, mtime)
+            for path, series_id, size, mtime in conn.execute("SELECT path, series_id, size, mtime FROM ingest_state")}
+
+def assign_series(conn, key, file_name):
+    """Series for a new file or directory: reuse the one a one-shot loader gave this file, else a new one."""
+    row = conn.execute("SELECT series_id FROM file WHERE file_name = ? ORDER BY id LIMIT 1", (file_name,)).fetchone()
+    if row is not None:
+        series_id = row[0]
+    else:
+        series_id = conn.execute("INSERT INTO series DEFAULT VALUES").lastrowid
+    conn.execute("INSERT OR IGNORE INTO ingest_state (path, series_id, size, mtime, rows, ingested_at) "
+                 "VALUES (?, ?, -1, 0, 0, NULL)", (key, series_id))
+    conn.commit()
+    return series_id
+
+def write_batch(conn, batch):
+    """Apply parsed files in one transaction and update their state, rollups and episodes."""
+    last_id = max_reading_id(conn)
+    with span('daemon.write_batch'):
+        for item in batch:
+            for sql, rows in item['statements'].items():
+                if sql.lstrip().upper().startswith("INSERT INTO FILE"):
+                    # Grown or previously loaded files already have their file row
+                    rows = [r for r in rows if conn.execute(
+                        "SELECT 1 FROM file WHERE file_name = ? AND series_id = ?", r).fetchone() is None]
+                conn.executemany(sql, rows)
+            conn.execute(
+                "INSERT OR REPLACE INTO ingest_state (path, series_id, size, mtime, rows, ingested_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (item['path'], item['series_id'], item['size'], item['mtime'], item['rows'], datetime.now().isoformat())
+            )
+        conn.commit()
+        inserted = conn.execute("SELECT COUNT(*) FROM cgm_data WHERE id > ?", (last_id,)).fetchone()[0]
+        refresh_rollups(conn, last_id)
+        refresh_episodes(conn, last_id)
+    count('daemon.readings_written', inserted)
+    return inserted
+
+class IngestDaemon:
+    """Polls the source directories and ingests new or grown files.
+
+    Settled files (same size and mtime on two consecutive polls) are parsed
+    in a process pool and queued; one writer drains the queue in batches on a
+    dedicated database thread. When the queue is full, parsing pauses
+    (backpressure) or, with shed_when_full, the file is dropped before it is
+    parsed and picked up again on a later poll. A file that fails to parse or
+    write is listed in the status file and retried once it changes.
+    """
+    def __init__(self, db_name, sources=SOURCES, poll_seconds=5.0, queue_size=8, batch_rows=100_000,
+                 parse_workers=None, shed_when_full=False, status_path=None):
+        self.db_name = db_name
+        self.sources = sources
+        self.poll_seconds = poll_seconds
+        self.batch_rows = batch_rows
+        self.shed_when_full = shed_when_full
+        self.status_path = status_path
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.parse_pool = ProcessPoolExecutor(max_workers=parse_workers)
+        self.parse_slots = asyncio.Semaphore(parse_workers or os.cpu_count() or 1)
+        self.db_thread = ThreadPoolExecutor(max_workers=1)  # the single writer
+        self.assign_lock = asyncio.Lock()
+        self.conn = None
+        self.state = {}
+        self.seen = {}        # path -> (size, mtime) at the previous poll
+        self.in_flight = set()
+        self.failed = {}      # path -> (size, mtime) that failed to ingest; retried once the file changes
+        self.errors = {}      # path -> last error, reported in the status file
+        self.queued_rows = 0
+        self.stats = {'files_ingested': 0, 'readings_written': 0, 'files_shed': 0, 'files_failed': 0, 'batches': 0,
+                      'last_batch_seconds': 0.0, 'max_file_lag_seconds': 0.0, 'last_file_lag_seconds': 0.0}
+
+    async def db(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.db_thread, fn, *args)
+
+    def _open(self):
+        self.conn = create_database(self.db_name)
+        create_state_table(self.conn)
+        self.state = load_state(self.conn)
+
+    def scan(self):
+        """Settled files whose size or mtime differs from what was last ingested."""
+        ready = []
+        present = set()
+        for directory, loader, pattern, mode in self.sources:
+            for path in sorted(glob(os.path.join(directory, pattern))):
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    # Deleted or renamed since the glob; forget it until it shows up again
+                    self.seen.pop(path, None)
+                    continue
+                present.add(path)
+                current = (stat.st_size, stat.st_mtime)
+                previous, self.seen[path] = self.seen.get(path), current
+                ingested = self.state.get(path)
+                if (path in self.in_flight or (ingested and ingested[1:] == current) or previous != current
+                        or self.failed.get(path) == current):
+                    continue
+                ready.append((path, directory, loader, mode, current))
+        # Files gone since the last poll must not hold up run(once=True)
+        for path in set(self.seen) - present:
+            del self.seen[path]
+        return ready
+
+    def _fail(self, path, current, error):
+        """Record a file that could not be ingested; it is retried once its size or mtime changes."""
+        print(f"Failed to ingest {path}: {error}")
+        self.failed[path] = current
+        self.errors[path] = f"{type(error).__name__}: {error}"
+        self.stats['files_failed'] += 1
+        count('daemon.files_failed')
+        self.in_flight.discard(path)
+
+    async def ingest(self, path, directory, loader, mode, current):
+        """Parse one file off the event loop and queue its rows for the writer."""
+        detected = time.time()
+        key = path if mode == "file" else directory
+        try:
+            # Files of one directory arriving together must share a single new series
+            async with self.assign_lock:
+                if key in self.state:
+                    series_id = self.state[key][0]
+                else:
+                    series_id = await self.db(assign_series, self.conn, key, os.path.basename(path))
+                    self.state[key] = (series_id, -1, 0)
+
+            # A parse slot is held until the rows are queued, so a slow writer pauses parsing
+            async with self.parse_slots:
+                # Shed before parsing so an overloaded daemon does not spend a worker on a file it drops
+                if self.shed_when_full and self.queue.full():
+                    self.stats['files_shed'] += 1
+                    count('daemon.files_shed')
+                    self.in_flight.discard(path)
+                    return
+                loop = asyncio.get_running_loop()
+                statements = await loop.run_in_executor(self.parse_pool, parse_file, loader, path, series_id)
+                item = {'path': path, 'series_id': series_id, 'size': current[0], 'mtime': current[1],
+                        'statements': statements, 'rows': sum(len(r) for r in statements.values()),
+                        'detected': detected}
+                await self.queue.put(item)
+                self.queued_rows += item['rows']
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Any loader or database error fails this file only; otherwise it would stay in flight forever
+            self._fail(path, current, e)
+
+    async def writer(self):
+        """Drain the queue in batches of up to batch_rows rows, one transaction per batch."""
+        while True:
+            batch = [await self.queue.get()]
+            rows = batch[0]['rows']
+            while rows < self.batch_rows and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                rows += batch[-1]['rows']
+            self.queued_rows -= rows
+
+            start = time.perf_counter()
+            try:
+                inserted = await self.db(write_batch, self.conn, batch)
+            except Exception as e:
+                # Leave the files un-ingested so a later change retries them
+                try:
+                    await self.db(self.conn.rollback)
+                except sqlite3.Error:
+                    pass
+                for item in batch:
+                    self._fail(item['path'], (item['size'], item['mtime']), e)
+                continue
+            else:
+                now = time.time()
+                self.stats['batches'] += 1
+                self.stats['readings_written'] += inserted
+                self.stats['last_batch_seconds'] = time.perf_counter() - start
+                for item in batch:
+                    lag = now - item['detected']
+                    self.stats['files_ingested'] += 1
+                    self.stats['last_file_lag_seconds'] = lag
+                    self.stats['max_file_lag_seconds'] = max(self.stats['max_file_lag_seconds'], lag)
+                    self.state[item['path']] = (item['series_id'], item['size'], item['mtime'])
+                    self.errors.pop(item['path'], None)
+                    self.in_flight.discard(item['path'])
+                    print(f"Ingested {item['path']} ({item['rows']} rows parsed) into series {item['series_id']}")
+            finally:
+                # queue.join() in run() waits on every item, failed or not
+                for _ in batch:
+                    self.queue.task_done()
+
+    def status(self):
+        """Current lag and throughput metrics."""
+        return dict(self.stats, queue_depth=self.queue.qsize(), queue_rows=self.queued_rows,
+                    files_in_flight=len(self.in_flight), failed_files=dict(self.errors),
+                    updated_at=datetime.now().isoformat())
+
+    def _write_status(self):
+        if self.status_path:
+            with open(self.status_path, 'w', encoding='utf-8') as f:
+                json.dump(self.status(), f, indent=2)
+
+    async def run(self, once=False):
+        """Poll forever (or, with once=True, until everything currently present is ingested)."""
+        await self.db(self._open)
+        writer = asyncio.create_task(self.writer())
+        tasks = set()
+        try:
+            while True:
+                for args in self.scan():
+                    self.in_flight.add(args[0])
+                    task = asyncio.create_task(self.ingest(*args))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                self._write_status()
+                if once and not self.in_flight and self.seen and all(
+                        self.state.get(p, (None, None, None))[1:] == s or self.failed.get(p) == s
+                        for p, s in self.seen.items()):
+                    break
+                await asyncio.sleep(self.poll_seconds)
+            await self.queue.join()
+        finally:
+            writer.cancel()
+            for task in tasks:
+                task.cancel()
+            self._write_status()
+            self.parse_pool.shutdown()
+            await self.db(self.conn.close)
+            self.db_thread.shutdown()
+
+def main():
+    profile_from_env()
+    # Configuration
+    db_name = "cgm.db"
+    poll_seconds = 5.0
+    status_path = "ingest_status.json"
+    once = False  # True: ingest whatever is present, then exit
+
+    daemon = IngestDaemon(db_name, poll_seconds=poll_seconds, status_path=status_path)
+    print(f"Watching {len(SOURCES)} directories (status in {status_path})")
+    try:
+        asyncio.run(daemon.run(once=once))
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(daemon.stats, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,10 @@ import os
 from datetime import datetime
 from pathlib import Path
 
+from instrumentation import TracedConnection, profile_from_env, source_row, span
+from episodes import refresh_episodes
+from rollups import max_reading_id, refresh_rollups
+
 def format_time(input_date, input_time):
     input_datetime = input_date + " " + input_time
     dt = datetime.strptime(input_datetime, "%Y/%m/%d %H:%M:%S")
@@ -46,14 +50,15 @@ def process_csv_file(file_path, series_id, conn):
                     current_format = "meal"
                 continue
             
-            if current_format == "basal":
-                process_basal_row(row, header, series_id, conn)
-            elif current_format == "bolus":
-                process_bolus_row(row, header, series_id, conn)
-            elif current_format == "cgm":
-                process_cgm_row(row, header, series_id, conn)
-            elif current_format == "meal":
-                process_meal_row(row, header, series_id, conn)
+            with source_row():
+                if current_format == "basal":
+                    process_basal_row(row, header, series_id, conn)
+                elif current_format == "bolus":
+                    process_bolus_row(row, header, series_id, conn)
+                elif current_format == "cgm":
+                    process_cgm_row(row, header, series_id, conn)
+                elif current_format == "meal":
+                    process_meal_row(row, header, series_id, conn)
 
 def process_basal_row(row, header, series_id, conn):
     """Process a row from basals.csv."""
@@ -198,12 +203,14 @@ def process_meal_row(row, header, series_id, conn):
         pass
 
 def main():
+    profile_from_env()
     # Configuration
     db_name = "cgm.db"
     csv_directory = "./input_data/dataset_1"
     
     # Create or connect to database
-    conn = sqlite3.connect(db_name)
+    conn = sqlite3.connect(db_name, factory=TracedConnection)
+    last_id = max_reading_id(conn)
 
     # Insert into series table and get the series_id
     cursor = conn.cursor()
@@ -220,8 +227,13 @@ def main():
         
     for csv_file in csv_files:
         print(f"Processing {csv_file}...")
-        process_csv_file(str(csv_file), series_id, conn)
+        with span('ingest.file', file=str(csv_file)):
+            process_csv_file(str(csv_file), series_id, conn)
         
+    # Update the hourly/daily rollups and the episode table for the readings just added
+    refresh_rollups(conn, last_id)
+    refresh_episodes(conn, last_id)
+
     print(f"Data from {csv_directory} has been imported into {db_name}")
     conn.close()
 
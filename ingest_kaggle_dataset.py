@@ -6,6 +6,10 @@ import os
 from datetime import datetime
 from pathlib import Path
 
+from instrumentation import TracedConnection, profile_from_env, source_row, span
+from episodes import refresh_episodes
+from rollups import max_reading_id, refresh_rollups
+
 def process_csv_file(file_path, series_id, conn):
     """Process CSV file and insert glucose data into SQLite database."""
     file_name = os.path.basename(file_path)
@@ -29,7 +33,8 @@ def process_csv_file(file_path, series_id, conn):
                 continue
                 
             if header:
-                process_glucose_row(row, header, series_id, conn)
+                with source_row():
+                    process_glucose_row(row, header, series_id, conn)
 
 def process_glucose_row(row, header, series_id, conn):
     """Process a row to extract glucose data."""
@@ -69,12 +74,14 @@ def process_glucose_row(row, header, series_id, conn):
         pass
 
 def main():
+    profile_from_env()
     # Configuration
     db_name = "cgm.db"
     csv_directory = "./input_data/kaggle_data"
     
     # Connect to database
-    conn = sqlite3.connect(db_name)
+    conn = sqlite3.connect(db_name, factory=TracedConnection)
+    last_id = max_reading_id(conn)
 
     # Insert into series table and get the series_id
     cursor = conn.cursor()
@@ -92,8 +99,13 @@ def main():
         series_id = cursor.lastrowid
         conn.commit()
         print(f"Processing {csv_file}...")
-        process_csv_file(str(csv_file), series_id, conn)
+        with span('ingest.file', file=str(csv_file)):
+            process_csv_file(str(csv_file), series_id, conn)
         
+    # Update the hourly/daily rollups and the episode table for the readings just added
+    refresh_rollups(conn, last_id)
+    refresh_episodes(conn, last_id)
+
     print(f"Glucose data has been imported into {db_name}")
     conn.close()
 
@@ -4,12 +4,16 @@ import csv
 import sqlite3
 import os
 from pathlib import Path
+
+from instrumentation import TracedConnection, profile_from_env, source_row, span
+from episodes import refresh_episodes
+from rollups import max_reading_id, refresh_rollups
 from datetime import datetime
 from itertools import islice
 
 def create_connection(db_name):
     """Create a connection to the SQLite database."""
-    return sqlite3.connect(db_name)
+    return sqlite3.connect(db_name, factory=TracedConnection)
 
 def process_csv_file(file_path, series_id, conn):
     
@@ -35,8 +39,9 @@ def process_csv_file(file_path, series_id, conn):
             if "Time" in row and header is None:
                 header = row
                 continue
-            if header: 
-                process_cgm_row(row, header, series_id, conn)
+            if header:
+                with source_row():
+                    process_cgm_row(row, header, series_id, conn)
 
 
 def process_cgm_row(row, header, series_id, conn):
@@ -71,12 +76,14 @@ def process_cgm_row(row, header, series_id, conn):
 
 
 def main():
+    profile_from_env()
     # Configuration
     db_name = "cgm.db"
     csv_file_path = "./input_data/labelled_cgm_dataset"
 
     # Connect to database
     conn = create_connection(db_name)
+    last_id = max_reading_id(conn)
 
     # Insert into series table and get the series_id
     cursor = conn.cursor()
@@ -86,8 +93,13 @@ def main():
 
     # Process CSV file in the directory
     for file in Path(csv_file_path).glob("*.csv"):
-        process_csv_file(str(file), series_id, conn)
+        with span('ingest.file', file=str(file)):
+            process_csv_file(str(file), series_id, conn)
     
+    # Update the hourly/daily rollups and the episode table for the readings just added
+    refresh_rollups(conn, last_id)
+    refresh_episodes(conn, last_id)
+
     print(f"Data has been imported into {db_name}")
     conn.close()
     
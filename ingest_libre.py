@@ -6,6 +6,10 @@ import os
 from datetime import datetime
 from pathlib import Path
 
+from instrumentation import TracedConnection, profile_from_env, source_row, span
+from episodes import refresh_episodes
+from rollups import max_reading_id, refresh_rollups
+
 def format_time(input_date, input_time):
     input_datetime = input_date + " " + input_time
     dt = datetime.strptime(input_datetime, "%d/%m/%Y %H:%M")
@@ -34,8 +38,9 @@ def process_csv_file(file_path, series_id, conn):
                 header = row
                 continue
             
-            if header: 
-                process_cgm_row(row, header, series_id, conn)
+            if header:
+                with source_row():
+                    process_cgm_row(row, header, series_id, conn)
 
 def process_cgm_row(row, header, series_id, conn):
     """Process a row from libre_cgm_dataset.csv."""
@@ -71,12 +76,14 @@ def process_cgm_row(row, header, series_id, conn):
         pass
 
 def main():
+    profile_from_env()
     # Configuration
     db_name = "cgm.db"
     csv_file_path = "./input_data/libre_cgm_dataset"
     
     # Connect to database
-    conn = sqlite3.connect(db_name)
+    conn = sqlite3.connect(db_name, factory=TracedConnection)
+    last_id = max_reading_id(conn)
 
     # Insert into series table and get the series_id
     cursor = conn.cursor()
@@ -86,8 +93,13 @@ def main():
     
     # Process all CSV files in the directory
     for file in Path(csv_file_path).glob("*.csv"):
-        process_csv_file(str(file), series_id, conn)
+        with span('ingest.file', file=str(file)):
+            process_csv_file(str(file), series_id, conn)
     
+    # Update the hourly/daily rollups and the episode table for the readings just added
+    refresh_rollups(conn, last_id)
+    refresh_episodes(conn, last_id)
+
     print(f"Data from {csv_file_path} has been imported into {db_name}")
     conn.close()
 
@@ -4,6 +4,10 @@ import csv
 import sqlite3
 import os
 from pathlib import Path
+
+from instrumentation import TracedConnection, profile_from_env, source_row, span
+from episodes import refresh_episodes
+from rollups import max_reading_id, refresh_rollups
 from datetime import datetime
 
 def process_csv_file(file_path, series_id, conn):
@@ -29,7 +33,8 @@ def process_csv_file(file_path, series_id, conn):
                 continue
                 
             if header:
-                process_glucose_row(row, header, series_id, conn)
+                with source_row():
+                    process_glucose_row(row, header, series_id, conn)
 
 def process_glucose_row(row, header, series_id, conn):
     """Process a row to extract glucose data."""
@@ -66,12 +71,14 @@ def process_glucose_row(row, header, series_id, conn):
         pass
 
 def main():
+    profile_from_env()
     # Configuration
     db_name = "cgm.db"
     csv_directory = "./input_data/lin_dataset"
     
     # Connect to database
-    conn = sqlite3.connect(db_name)
+    conn = sqlite3.connect(db_name, factory=TracedConnection)
+    last_id = max_reading_id(conn)
 
     # Insert into series table and get the series_id
     cursor = conn.cursor()
@@ -88,8 +95,13 @@ def main():
         
     for csv_file in csv_files:
         print(f"Processing {csv_file}...")
-        process_csv_file(str(csv_file), series_id, conn)
+        with span('ingest.file', file=str(csv_file)):
+            process_csv_file(str(csv_file), series_id, conn)
         
+    # Update the hourly/daily rollups and the episode table for the readings just added
+    refresh_rollups(conn, last_id)
+    refresh_episodes(conn, last_id)
+
     print(f"Glucose data has been imported into {db_name}")
     conn.close()
 
@@ -4,9 +4,13 @@ import os
 import datetime
 from pathlib import Path
 
+from instrumentation import TracedConnection, profile_from_env, source_row, span
+from episodes import refresh_episodes
+from rollups import max_reading_id, refresh_rollups
+
 def create_database(db_name):
     """Create SQLite database with the specified schema."""
-    conn = sqlite3.connect(db_name)
+    conn = sqlite3.connect(db_name, factory=TracedConnection)
     cursor = conn.cursor()
     # Create tables
     cursor.execute('''
@@ -45,6 +49,8 @@ def create_database(db_name):
         UNIQUE(datetime, series_id)
     )
     ''')
+    # Per-series time-range reads (out_of_core.py, episodes) use this instead of scanning the table
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_cgm_data_series_datetime ON cgm_data(series_id, datetime)")
     
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS bolus_data (
@@ -100,10 +106,11 @@ def process_csv_file(file_path, series_id, conn):
                     current_format = "treatment"
                 continue
             
-            if current_format == "cgm":
-                process_cgm_row(row, header, series_id, conn)
-            elif current_format == "treatment":
-                process_treatment_row(row, header, series_id, conn)
+            with source_row():
+                if current_format == "cgm":
+                    process_cgm_row(row, header, series_id, conn)
+                elif current_format == "treatment":
+                    process_treatment_row(row, header, series_id, conn)
 
 def process_cgm_row(row, header, series_id, conn):
     """Process a row from the CGM format."""
@@ -203,12 +210,14 @@ def process_treatment_row(row, header, series_id, conn):
         pass
 
 def main():
+    profile_from_env()
     # Configuration
     db_name = "cgm.db"
     csv_directory = "./input_data/personal_data"
     
     # Create or connect to database
     conn = create_database(db_name)
+    last_id = max_reading_id(conn)
 
     # Insert into series table and get the series_id
     cursor = conn.cursor()
@@ -225,8 +234,13 @@ def main():
         
     for csv_file in csv_files:
         print(f"Processing {csv_file}...")
-        process_csv_file(str(csv_file), series_id, conn)
+        with span('ingest.file', file=str(csv_file)):
+            process_csv_file(str(csv_file), series_id, conn)
         
+    # Update the hourly/daily rollups and the episode table for the readings just added
+    refresh_rollups(conn, last_id)
+    refresh_episodes(conn, last_id)
+
     print(f"Data from {csv_directory} has been imported into {db_name}")
     conn.close()
 
@@ -0,0 +1,229 @@
+# Named timing spans and counters for the pipeline, reported as JSON.
+#
+# Spans and counters are always recorded (the cost is a perf_counter call and
+# a dict update). Set CGM_METRICS to a file path (or '-' for stdout) to write
+# the report when the script exits, and CGM_PROFILE=1 to also run cProfile and
+# tracemalloc and include their top entries; scripts start the profiler from
+# main() with profile_from_env(), importing this module never does.
+import atexit
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import sqlite3
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+_spans = {}
+_counters = defaultdict(int)
+_events = []
+_started = {'at': datetime.now().isoformat(), 'perf': time.perf_counter()}
+_profiler = {}
+# Inserts that record files and series rather than readings
+BOOKKEEPING = {f'db.{kind}.{table}' for kind in ('attempted', 'inserted', 'ignored') for table in ('file', 'series')}
+# Per-table insert counters -> their names in a file event's rows_by_table
+ROW_COUNTS = {'attempted': 'rows', 'inserted': 'inserted', 'ignored': 'duplicate'}
+
+def count(name, n=1):
+    """Add n to a named counter."""
+    _counters[name] += n
+
+@contextmanager
+def span(name, **attrs):
+    """Time a block under name.
+
+    Durations are aggregated per name. When attrs are given, the span is also
+    kept as an individual event along with the counters that changed inside it.
+    """
+    before = dict(_counters) if attrs else None
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stats = _spans.get(name)
+        if stats is None:
+            stats = _spans[name] = {'count': 0, 'total_seconds': 0.0, 'min_seconds': elapsed, 'max_seconds': elapsed}
+        stats['count'] += 1
+        stats['total_seconds'] += elapsed
+        stats['min_seconds'] = min(stats['min_seconds'], elapsed)
+        stats['max_seconds'] = max(stats['max_seconds'], elapsed)
+        if attrs:
+            changed = {k: v - before.get(k, 0) for k, v in _counters.items() if v != before.get(k, 0)}
+            _events.append({'name': name, 'seconds': elapsed, **attrs, 'counters': changed})
+
+def traced(name):
+    """Decorator form of span."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@contextmanager
+def source_row():
+    """Count one parsed source row; rows that lead to no insert attempt are also counted as skipped."""
+    count('ingest.rows_read')
+    before = _counters.get('db.attempted', 0)
+    yield
+    if _counters.get('db.attempted', 0) == before:
+        count('ingest.rows_skipped')
+
+_statement_tables = {}
+
+def insert_table(sql):
+    """Target table of an INSERT statement, or None for anything else."""
+    table = _statement_tables.get(sql)
+    if table is None:
+        words = sql.split(None, 5)
+        upper = [w.upper() for w in words]
+        table = words[upper.index('INTO') + 1] if upper and upper[0] == 'INSERT' and 'INTO' in upper else ''
+        _statement_tables[sql] = table
+    return table or None
+
+def count_insert_attempt(table, n_rows=1):
+    """Count rows sent to an INSERT into table, whether or not they end up inserted."""
+    count(f'db.attempted.{table}', n_rows)
+    if f'db.attempted.{table}' not in BOOKKEEPING:
+        count('db.attempted', n_rows)
+
+class TracedCursor(sqlite3.Cursor):
+    """Cursor that times statements and counts inserted and ignored rows per table."""
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        super().execute(sql, parameters)
+        self._record(sql, time.perf_counter() - start, 1)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        seq_of_parameters = list(seq_of_parameters)
+        start = time.perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        self._record(sql, time.perf_counter() - start, len(seq_of_parameters))
+        return self
+
+    def _record(self, sql, elapsed, n_rows):
+        table = insert_table(sql)
+        if table is None:
+            count('db.query_seconds', elapsed)
+            return
+        count('db.insert_seconds', elapsed)
+        inserted = max(self.rowcount, 0)
+        count_insert_attempt(table, n_rows)
+        count(f'db.inserted.{table}', inserted)
+        # INSERT OR IGNORE leaves duplicates out of rowcount
+        if n_rows > inserted:
+            count(f'db.ignored.{table}', n_rows - inserted)
+
+class TracedConnection(sqlite3.Connection):
+    """Connection whose cursors are TracedCursors; pass as sqlite3.connect(..., factory=TracedConnection)."""
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        start = time.perf_counter()
+        super().commit()
+        count('db.commit_seconds', time.perf_counter() - start)
+
+def enable_profiling():
+    """Start cProfile and tracemalloc for the rest of the process."""
+    if _profiler:
+        return
+    tracemalloc.start()
+    _profiler['cprofile'] = cProfile.Profile()
+    _profiler['cprofile'].enable()
+
+def profile_from_env():
+    """Start profiling if CGM_PROFILE is set; called at the top of each script's main()."""
+    if os.environ.get('CGM_PROFILE'):
+        enable_profiling()
+
+def _profile_report(top=25):
+    profiler = _profiler['cprofile']
+    profiler.disable()
+    stats = pstats.Stats(profiler, stream=io.StringIO()).sort_stats('cumulative')
+    functions = []
+    for func in stats.fcn_list[:top]:
+        calls, _, self_time, cumulative, _ = stats.stats[func]
+        functions.append({'function': f"{func[0]}:{func[1]}({func[2]})", 'calls': calls,
+                          'self_seconds': self_time, 'cumulative_seconds': cumulative})
+    profiler.enable()
+
+    current, peak = tracemalloc.get_traced_memory()
+    allocations = [{'location': str(stat.traceback), 'bytes': stat.size, 'blocks': stat.count}
+                   for stat in tracemalloc.take_snapshot().statistics('lineno')[:top]]
+    return {'functions': functions,
+            'memory': {'current_bytes': current, 'peak_bytes': peak, 'top_allocations': allocations}}
+
+def report():
+    """Snapshot of all spans, counters and events as a JSON-serialisable dict."""
+    spans = {}
+    for name, stats in _spans.items():
+        spans[name] = dict(stats, mean_seconds=stats['total_seconds'] / stats['count'])
+    events = []
+    for event in _events:
+        event = dict(event)
+        if event['name'] == 'ingest.file':
+            # Whatever the file took beyond its database writes went to reading and parsing
+            db_seconds = event['counters'].get('db.insert_seconds', 0) + event['counters'].get('db.commit_seconds', 0)
+            event['parse_seconds'] = event['seconds'] - db_seconds
+            event['write_seconds'] = db_seconds
+            counters = event['counters']
+            # A source row may insert into several tables (a Tandem bolus row also records its carbs),
+            # so rows are accounted per target table rather than against rows_parsed
+            tables = {}
+            for key, n in counters.items():
+                parts = key.split('.', 2)
+                if len(parts) == 3 and parts[0] == 'db' and parts[1] in ROW_COUNTS and key not in BOOKKEEPING:
+                    tables.setdefault(parts[2], dict.fromkeys(ROW_COUNTS.values(), 0))[ROW_COUNTS[parts[1]]] += n
+            event['rows_parsed'] = counters.get('ingest.rows_read', 0)
+            event['rows_by_table'] = tables
+            event['rows_inserted'] = sum(t['inserted'] for t in tables.values())
+            event['rows_duplicate'] = sum(t['duplicate'] for t in tables.values())
+            # Rows that produced no insert at all (missing fields, unparseable values)
+            event['rows_skipped'] = counters.get('ingest.rows_skipped', 0)
+        events.append(event)
+    result = {
+        'script': os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else None,
+        'started_at': _started['at'],
+        'wall_seconds': time.perf_counter() - _started['perf'],
+        'spans': spans,
+        'counters': dict(_counters),
+        'events': events,
+    }
+    if _profiler:
+        result['profile'] = _profile_report()
+    return result
+
+def write_report(path):
+    """Write report() as JSON to path, or to stdout when path is '-'."""
+    text = json.dumps(report(), indent=2, default=str)
+    if path == '-':
+        print(text)
+        return
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+def reset():
+    """Clear all recorded spans, counters and events."""
+    _spans.clear()
+    _counters.clear()
+    _events.clear()
+
+if os.environ.get('CGM_METRICS'):
+    atexit.register(write_report, os.environ['CGM_METRICS'])
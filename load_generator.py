@@ -0,0 +1,98 @@
+import http.client
+import json
+import random
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+def load_request_windows(db_name, window_size=12, max_windows=500):
+    """Sample windows of consecutive readings from the database as request payloads."""
+    conn = sqlite3.connect(db_name)
+    cursor = conn.cursor()
+    cursor.execute("SELECT series_id, datetime, blood_glucose FROM cgm_data ORDER BY series_id, datetime")
+    rows = cursor.fetchall()
+    conn.close()
+
+    by_series = {}
+    for series_id, dt, bg in rows:
+        by_series.setdefault(series_id, []).append([dt, bg])
+
+    rng = random.Random(42)
+    payloads = []
+    series_ids = list(by_series)
+    for _ in range(max_windows):
+        series_id = rng.choice(series_ids)
+        readings = by_series[series_id]
+        if len(readings) <= window_size:
+            continue
+        start = rng.randrange(len(readings) - window_size)
+        payloads.append(json.dumps({'series_id': series_id, 'readings': readings[start:start + window_size]}))
+    return payloads
+
+def run_client(host, port, payloads, stop_at, latencies, errors):
+    """Send requests over one keep-alive connection until the deadline."""
+    conn = http.client.HTTPConnection(host, port)
+    headers = {'Content-Type': 'application/json'}
+    i = 0
+    while time.perf_counter() < stop_at:
+        body = payloads[i % len(payloads)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            conn.request('POST', '/predict', body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+                continue
+        except (ConnectionError, http.client.HTTPException) as e:
+            errors.append(str(e))
+            conn.close()
+            conn = http.client.HTTPConnection(host, port)
+            continue
+        latencies.append((time.perf_counter() - start) * 1000)
+    conn.close()
+
+def fetch_server_stats(host, port):
+    """Read the latency summary reported by the service."""
+    conn = http.client.HTTPConnection(host, port)
+    conn.request('GET', '/stats')
+    stats = json.loads(conn.getresponse().read())
+    conn.close()
+    return stats
+
+def main():
+    # Configuration
+    db_name = "cgm_light.db"
+    host = "127.0.0.1"
+    port = 8050
+    concurrency = 32
+    duration_seconds = 10
+
+    payloads = load_request_windows(db_name)
+    print(f"Loaded {len(payloads)} request payloads, running {concurrency} clients for {duration_seconds}s...")
+
+    latencies = []  # list.append is atomic, so clients can share it
+    errors = []
+    stop_at = time.perf_counter() + duration_seconds
+    threads = [
+        threading.Thread(target=run_client, args=(host, port, payloads, stop_at, latencies, errors))
+        for _ in range(concurrency)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    print(f"Completed {len(latencies)} requests ({len(errors)} errors) in {elapsed:.1f}s")
+    print(f"Throughput: {len(latencies) / elapsed:.1f} requests/s")
+    if latencies:
+        print(f"Client latency p50: {np.percentile(latencies, 50):.2f} ms, p99: {np.percentile(latencies, 99):.2f} ms")
+    print(f"Server stats: {fetch_server_stats(host, port)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from glucose_series import GlucoseSeries
+from instrumentation import profile_from_env, traced
+
+READING_MINUTES = 5
+# Below this many subsequences the process pool costs more than it saves
+MIN_PARALLEL_ROWS = 4000
+
+# Series shared with pool workers through the initializer instead of per task
+_worker_series = {}
+
+def _init_worker(values, m):
+    _worker_series['T'] = values
+    _worker_series['m'] = m
+    _worker_series['stats'] = sliding_stats(values, m)
+
+def sliding_stats(T, m):
+    """Mean and standard deviation of every length-m window.
+
+    Computed on each window's own centred values: the cumulative-sum form
+    E[x^2] - E[x]^2 cancels at glucose magnitudes and leaves flat windows
+    with a spurious sigma around 1e-4, so they escape the flat-window check.
+    """
+    windows = np.lib.stride_tricks.sliding_window_view(np.asarray(T, dtype=np.float64), m)
+    return windows.mean(axis=1), windows.std(axis=1)
+
+def sliding_dot_product(Q, T):
+    """Dot product of Q with every length-len(Q) window of T, using the FFT."""
+    n, m = len(T), len(Q)
+    size = 1 << (n + m - 1).bit_length()
+    product = np.fft.irfft(np.fft.rfft(T, size) * np.fft.rfft(Q[::-1], size), size)
+    return product[m - 1:n]
+
+def _constant(sigma):
+    return sigma < 1e-8
+
+def _squared_distances(QT, m, mu_i, sigma_i, mu, sigma, constant):
+    """Squared z-normalized Euclidean distances from window i to every window."""
+    if _constant(sigma_i):
+        # Two flat windows are identical after normalization; flat vs non-flat sits at distance sqrt(m)
+        return np.where(constant, 0.0, float(m))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = (QT - m * mu_i * mu) / (m * sigma_i * sigma)
+    d2 = 2 * m * (1 - np.clip(corr, -1.0, 1.0))
+    d2[constant] = m
+    return d2
+
+def stomp_rows(T, m, start, stop, stats=None):
+    """Matrix profile values and indices for subsequences start..stop-1.
+
+    The first row's dot products come from the FFT; every following row is
+    updated from the previous one in O(n) (the STOMP recurrence), so a chunk
+    costs O(n * rows) rather than O(n * rows * m).
+    """
+    T = np.asarray(T, dtype=np.float64)
+    mu, sigma = stats if stats is not None else sliding_stats(T, m)
+    constant = _constant(sigma)
+    n_sub = len(T) - m + 1
+    exclusion = max(1, m // 4)
+
+    # Column of dot products of every window with the first window, for QT[0] of each row
+    first_col = sliding_dot_product(T[:m], T)
+    QT = sliding_dot_product(T[start:start + m], T)
+
+    profile = np.empty(stop - start)
+    index = np.empty(stop - start, dtype=np.int64)
+    for i in range(start, stop):
+        if i > start:
+            QT[1:] = QT[:-1] - T[i - 1] * T[:n_sub - 1] + T[i + m - 1] * T[m:m + n_sub - 1]
+            QT[0] = first_col[i]
+        d2 = _squared_distances(QT, m, mu[i], sigma[i], mu, sigma, constant)
+        # Trivial matches around i itself are excluded
+        d2[max(0, i - exclusion):i + exclusion + 1] = np.inf
+        j = int(np.argmin(d2))
+        profile[i - start] = np.sqrt(max(d2[j], 0.0))
+        index[i - start] = j
+    return profile, index
+
+def _stomp_chunk(bounds):
+    start, stop = bounds
+    return start, stomp_rows(_worker_series['T'], _worker_series['m'], start, stop, _worker_series['stats'])
+
+def matrix_profile(T, m, max_workers=None, chunks_per_worker=4):
+    """Matrix profile (nearest-neighbour distance of every subsequence) and profile index.
+
+    Rows are split into contiguous chunks computed in a process pool; each
+    chunk pays one FFT and then runs the O(n) per-row recurrence.
+    """
+    T = np.ascontiguousarray(T, dtype=np.float64)
+    n_sub = len(T) - m + 1
+    if n_sub < 2:
+        raise ValueError(f"series of {len(T)} readings is too short for window {m}")
+
+    workers = max_workers or os.cpu_count() or 1
+    if workers == 1 or n_sub < MIN_PARALLEL_ROWS:
+        return stomp_rows(T, m, 0, n_sub)
+
+    edges = np.linspace(0, n_sub, workers * chunks_per_worker + 1).astype(int)
+    bounds = [(a, b) for a, b in zip(edges[:-1], edges[1:]) if b > a]
+    profile = np.empty(n_sub)
+    index = np.empty(n_sub, dtype=np.int64)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(T, m)) as executor:
+        for start, (p, idx) in executor.map(_stomp_chunk, bounds):
+            profile[start:start + len(p)] = p
+            index[start:start + len(p)] = idx
+    return profile, index
+
+def top_discords(profile, m, k):
+    """Start positions of the k largest non-overlapping matrix profile values."""
+    profile = np.where(np.isfinite(profile), profile, -np.inf).copy()
+    discords = []
+    for _ in range(k):
+        i = int(np.argmax(profile))
+        if profile[i] == -np.inf:
+            break
+        discords.append(i)
+        profile[max(0, i - m + 1):i + m] = -np.inf
+    return discords
+
+@traced('detector.matrix_profile')
+def matrix_profile_anomalies(df, window_minutes=180, n_discords=3, max_workers=None):
+    """Flag the readings inside the most unusual glucose curve shapes (discords).
+
+    A discord is the window_minutes subsequence whose nearest neighbour
+    elsewhere in the series is furthest away after z-normalization, so it
+    catches odd multi-hour shapes rather than single steep points. Windows are
+    taken over consecutive readings, assuming the usual 5-minute cadence.
+    Returns a boolean mask aligned with df (a DataFrame or GlucoseSeries),
+    like z_score_anomalies.
+    """
+    if isinstance(df, GlucoseSeries):
+        values, index = df.values.astype(np.float64), pd.DatetimeIndex(df.datetimes, name='datetime')
+    else:
+        values, index = df['blood_glucose'].values.astype(np.float64), df.index
+    m = max(4, window_minutes // READING_MINUTES)
+    mask = np.zeros(len(values), dtype=bool)
+    if len(values) < 2 * m:
+        return pd.Series(mask, index=index)
+
+    profile, _ = matrix_profile(values, m, max_workers=max_workers)
+    for start in top_discords(profile, m, n_discords):
+        mask[start:start + m] = True
+    return pd.Series(mask, index=index)
+
+def naive_matrix_profile(T, m):
+    """Reference O(n^2 m) implementation, used to check stomp_rows."""
+    T = np.asarray(T, dtype=np.float64)
+    n_sub = len(T) - m + 1
+    exclusion = max(1, m // 4)
+    windows = np.lib.stride_tricks.sliding_window_view(T, m)
+    sigma = windows.std(axis=1)
+    normed = (windows - windows.mean(axis=1, keepdims=True)) / np.where(_constant(sigma), 1.0, sigma)[:, None]
+    profile = np.empty(n_sub)
+    for i in range(n_sub):
+        d = np.sqrt(((normed - normed[i]) ** 2).sum(axis=1))
+        d[max(0, i - exclusion):i + exclusion + 1] = np.inf
+        profile[i] = d.min()
+    return profile
+
+def main():
+    profile_from_env()
+    # Configuration
+    db_name = "cgm_light.db"
+    window_minutes = 180
+    n_discords = 3
+
+    conn = sqlite3.connect(db_name)
+    df = pd.read_sql("SELECT series_id, datetime, blood_glucose FROM cgm_data", conn)
+    conn.close()
+    df['datetime'] = pd.to_datetime(df['datetime'], format='ISO8601')
+    df = df.sort_values(['series_id', 'datetime'])
+
+    m = window_minutes // READING_MINUTES
+    for series_id, group in df.groupby('series_id'):
+        series_df = group.set_index('datetime')
+        if len(series_df) < 2 * m:
+            continue
+        start = time.perf_counter()
+        profile, _ = matrix_profile(series_df['blood_glucose'].values, m)
+        elapsed = time.perf_counter() - start
+        print(f"Series {series_id}: {len(series_df)} readings, matrix profile in {elapsed:.2f}s")
+        for i in top_discords(profile, m, n_discords):
+            print(f"  discord at {series_df.index[i]} (distance {profile[i]:.2f})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+import resource
+import sqlite3
+import time
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from changepoints import load_segments
+from find_anomalies import isolation_forest_anomalies, kmeans_anomalies, z_score_anomalies
+from glucose_series import GlucoseSeries
+from glycemic_metrics import MIN_EPISODE_MINUTES, WINDOWS, compute_metrics, create_metrics_table, write_metrics
+from instrumentation import count, profile_from_env, span
+
+# Peak working memory per reading for one chunk (readings, derivative features,
+# the three detectors and the metric groupbys): about 240 bytes under
+# tracemalloc on cgm_light.db, with headroom for allocator overhead
+BYTES_PER_READING = 600
+# Readings before a chunk needed for its first rate of change and acceleration
+CONTEXT_READINGS = 2
+DETECTORS = {
+    'z_score': z_score_anomalies,
+    'isolation_forest': isolation_forest_anomalies,
+    'kmeans': lambda series: kmeans_anomalies(series, plot_path=None),
+}
+
+def create_anomaly_flags_table(conn):
+    """Create the anomaly_flags table (one row per flagged reading and detector) if it does not exist."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS anomaly_flags (
+        series_id INTEGER,
+        datetime TEXT,
+        method TEXT,
+        FOREIGN KEY (series_id) REFERENCES series (series_id),
+        PRIMARY KEY (series_id, method, datetime)
+    )
+    ''')
+    conn.commit()
+
+def create_series_index(conn):
+    """Index cgm_data by (series_id, datetime) so per-series and time-range reads are range scans."""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_cgm_data_series_datetime ON cgm_data(series_id, datetime)")
+    conn.commit()
+
+def _week_start(dt):
+    return pd.Timestamp(dt).to_period('W-SUN').start_time
+
+def plan_chunks(conn, max_rows):
+    """Split the cohort into work units of at most max_rows readings.
+
+    Small series are grouped into one unit; a series larger than max_rows is
+    cut into time ranges ending on week boundaries, so day and week metric
+    windows are never split. A single week over the budget still becomes one
+    unit.
+    """
+    sizes = conn.execute("SELECT series_id, COUNT(*) FROM cgm_data GROUP BY series_id ORDER BY series_id").fetchall()
+    batch, batch_rows = [], 0
+    for series_id, n_rows in sizes:
+        if n_rows <= max_rows:
+            if batch_rows + n_rows > max_rows:
+                yield {'series_ids': batch, 'rows': batch_rows}
+                batch, batch_rows = [], 0
+            batch.append(series_id)
+            batch_rows += n_rows
+            continue
+
+        start = conn.execute("SELECT MIN(datetime) FROM cgm_data WHERE series_id = ?", (series_id,)).fetchone()[0]
+        while start is not None:
+            row = conn.execute("SELECT datetime FROM cgm_data WHERE series_id = ? AND datetime >= ? "
+                               "ORDER BY datetime LIMIT 1 OFFSET ?", (series_id, start, max_rows)).fetchone()
+            if row is None:
+                end = None
+            else:
+                end = _week_start(row[0])
+                if end <= pd.Timestamp(start):
+                    end = _week_start(start) + timedelta(weeks=1)
+                end = end.isoformat()
+            yield {'series_ids': [series_id], 'start': start, 'end': end}
+            start = None if end is None else conn.execute(
+                "SELECT MIN(datetime) FROM cgm_data WHERE series_id = ? AND datetime >= ?", (series_id, end)
+            ).fetchone()[0]
+    if batch:
+        yield {'series_ids': batch, 'rows': batch_rows}
+
+def _read(conn, sql, params):
+    df = pd.read_sql(sql, conn, params=params)
+    df['datetime'] = pd.to_datetime(df['datetime'], format='ISO8601')
+    # An empty result comes back as object columns, which would leak into the concatenated chunk
+    return df.astype({'series_id': np.int64, 'blood_glucose': np.float64})
+
+def load_chunk(conn, chunk):
+    """Readings of one work unit, plus the context rows a time-range chunk needs on either side.
+
+    Returns the frame and a boolean mask of the rows the chunk owns.
+    """
+    columns = "SELECT series_id, datetime, blood_glucose FROM cgm_data"
+    if 'start' not in chunk:
+        placeholders = ', '.join('?' * len(chunk['series_ids']))
+        df = _read(conn, f"{columns} WHERE series_id IN ({placeholders}) AND blood_glucose IS NOT NULL "
+                         "ORDER BY series_id, datetime", chunk['series_ids'])
+        return df, np.ones(len(df), dtype=bool)
+
+    series_id = chunk['series_ids'][0]
+    before = _read(conn, f"{columns} WHERE series_id = ? AND datetime < ? AND blood_glucose IS NOT NULL "
+                         "ORDER BY datetime DESC LIMIT ?", (series_id, chunk['start'], CONTEXT_READINGS))
+    if chunk['end'] is None:
+        body = _read(conn, f"{columns} WHERE series_id = ? AND datetime >= ? AND blood_glucose IS NOT NULL "
+                           "ORDER BY datetime", (series_id, chunk['start']))
+    else:
+        # Readings just past the end let an episode that starts inside the chunk reach its minimum length
+        lookahead = (pd.Timestamp(chunk['end']) + timedelta(minutes=MIN_EPISODE_MINUTES)).isoformat()
+        body = _read(conn, f"{columns} WHERE series_id = ? AND datetime >= ? AND datetime <= ? "
+                           "AND blood_glucose IS NOT NULL ORDER BY datetime", (series_id, chunk['start'], lookahead))
+    df = pd.concat([frame for frame in (before.iloc[::-1], body) if len(frame)] or [body], ignore_index=True)
+    owned = df['datetime'] >= pd.Timestamp(chunk['start'])
+    if chunk['end'] is not None:
+        owned &= df['datetime'] < pd.Timestamp(chunk['end'])
+    return df, owned.values
+
+def detect_chunk(df, owned, detectors=DETECTORS, segments=None):
+    """(series_id, datetime, method) rows flagged by each detector, per series in the chunk.
+
+    Detectors see one series at a time as a GlucoseSeries; with time-range
+    chunks their statistics are fitted per chunk. segments maps series ids
+    to their stored change-point segments, which detectors normalize within.
+    """
+    flags = []
+    owned_times = df['datetime'].values[owned]
+    for series_id, group in df.groupby('series_id', sort=False):
+        series = GlucoseSeries.from_frame(group, int(series_id))
+        if segments is not None and series_id in segments:
+            series = series.with_segments(segments[series_id])
+        series = series.with_derivatives()
+        if len(series) < 10:
+            continue
+        keep = np.isin(series.datetimes, owned_times)
+        for method, detector in detectors.items():
+            mask = np.asarray(detector(series), dtype=bool) & keep
+            iso = pd.DatetimeIndex(series.datetimes[mask]).strftime('%Y-%m-%dT%H:%M:%S')
+            flags.extend((int(series_id), t, method) for t in iso)
+    return flags
+
+def metrics_chunk(df, chunk):
+    """Day and week metrics for the windows the chunk owns (plus 'all' for whole series).
+
+    The context rows before a time-range chunk stay in so an episode already
+    running at its start is seen as one run. That run is counted in the
+    window where it started, which belongs to the previous chunk and is
+    dropped here along with the other windows before the chunk's first week.
+    """
+    # Lookahead rows feed episode lengths only; windows starting at or after the end belong to the next chunk
+    frames = []
+    for window in WINDOWS:
+        if window == 'all' and 'start' in chunk:
+            continue
+        metrics = compute_metrics(df, window)
+        if 'start' in chunk:
+            # Chunks start on week boundaries, so every context row falls in an earlier window
+            metrics = metrics[metrics['window_start'] >= _week_start(chunk['start'])]
+        if chunk.get('end') is not None:
+            metrics = metrics[metrics['window_start'] < pd.Timestamp(chunk['end'])]
+        frames.append(metrics)
+    return frames
+
+def process_cohort(db_name, memory_budget_mb=256, detectors=DETECTORS):
+    """Stream the cohort through detection and metrics, writing results after every chunk.
+
+    Chunks are sized so one chunk's working set stays under memory_budget_mb;
+    only one chunk is in memory at a time. Series split into time ranges get
+    day and week metrics but no 'all' row.
+    """
+    max_rows = max(1000, int(memory_budget_mb * 2**20 / BYTES_PER_READING))
+    conn = sqlite3.connect(db_name)
+    create_series_index(conn)
+    create_anomaly_flags_table(conn)
+    create_metrics_table(conn)
+
+    totals = {'chunks': 0, 'readings': 0, 'flags': 0, 'metric_rows': 0, 'max_chunk_readings': 0}
+    for chunk in list(plan_chunks(conn, max_rows)):
+        with span('out_of_core.chunk'):
+            df, owned = load_chunk(conn, chunk)
+            if not owned.any():
+                continue
+            segments = {series_id: load_segments(db_name, series_id) for series_id in chunk['series_ids']}
+            flags = detect_chunk(df, owned, detectors, segments)
+            metric_frames = metrics_chunk(df, chunk)
+
+            # Replace this chunk's previous results so reruns stay idempotent
+            for series_id in chunk['series_ids']:
+                where, params = "series_id = ?", [series_id]
+                if 'start' in chunk:
+                    where += " AND datetime >= ?"
+                    params.append(chunk['start'])
+                    if chunk['end'] is not None:
+                        where += " AND datetime < ?"
+                        params.append(chunk['end'])
+                conn.execute(f"DELETE FROM anomaly_flags WHERE {where}", params)
+            conn.executemany("INSERT OR REPLACE INTO anomaly_flags (series_id, datetime, method) VALUES (?, ?, ?)",
+                             flags)
+            for metrics in metric_frames:
+                write_metrics(conn, metrics)  # commits
+            del df
+
+        n_readings = int(owned.sum())
+        totals['chunks'] += 1
+        totals['readings'] += n_readings
+        totals['flags'] += len(flags)
+        totals['metric_rows'] += sum(len(m) for m in metric_frames)
+        totals['max_chunk_readings'] = max(totals['max_chunk_readings'], len(owned))
+        count('out_of_core.readings', n_readings)
+    conn.close()
+    # ru_maxrss is in KiB on Linux
+    totals['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return totals
+
+def main():
+    profile_from_env()
+    # Configuration
+    db_name = "cgm_light.db"
+    memory_budget_mb = 256
+
+    start = time.perf_counter()
+    totals = process_cohort(db_name, memory_budget_mb)
+    print(f"Processed {totals['readings']} readings in {totals['chunks']} chunks "
+          f"in {time.perf_counter() - start:.1f}s")
+    print(f"Wrote {totals['flags']} anomaly flags and {totals['metric_rows']} metric rows; "
+          f"largest chunk {totals['max_chunk_readings']} readings, peak RSS {totals['peak_rss_mb']:.0f} MB")
+
+if __name__ == "__main__":
+    main()
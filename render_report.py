@@ -0,0 +1,235 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from backtest import series_out_of_sample_predictions
+from forecast import FEATURES, HORIZON_STEPS, TARGET, cached_features, load_forecaster
+
+# A prediction made at time t is for the reading HORIZON_STEPS x 5 minutes later
+HORIZON = pd.Timedelta(minutes=5 * HORIZON_STEPS)
+
+# Figure objects are created once per worker process and reused for every task
+_worker_figures = {}
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    _worker_figures['series'] = plt.subplots(2, 1, figsize=(14, 9), sharex=True,
+                                             gridspec_kw={'height_ratios': [2, 1]})
+    _worker_figures['day'] = plt.subplots(figsize=(16, 8))
+
+def data_hash(*arrays):
+    """Hash of the arrays a figure is drawn from, used to skip unchanged figures."""
+    digest = hashlib.sha1()
+    for arr in arrays:
+        digest.update(np.ascontiguousarray(arr).tobytes())
+    return digest.hexdigest()
+
+def _predict_series(task):
+    series_id, df_series, model_params, n_folds, features = task
+    return series_id, series_out_of_sample_predictions(df_series, model_params, n_folds, features)
+
+def cached_predictions(df_ml, model_params, features, n_folds, cache_path, max_workers=None):
+    """Out-of-sample predictions aligned with df_ml, refitting only the series whose inputs changed.
+
+    Each series gets its own walk-forward models (series_out_of_sample_predictions),
+    so its predictions are cached under a hash of its rows and the model
+    configuration; new readings in one series leave every other series'
+    predictions, and therefore their figures, untouched.
+    Returns the predictions and the ids of the series that were refitted.
+    """
+    cache = pd.read_pickle(cache_path) if os.path.exists(cache_path) else {}
+    config = json.dumps({'params': model_params, 'features': list(features), 'n_folds': n_folds},
+                        sort_keys=True, default=str)
+    columns = sorted(set(features) | {'datetime', TARGET})
+    groups = df_ml.groupby('series_id').indices
+    digests = {series_id: data_hash(np.frombuffer(config.encode('utf-8'), dtype=np.uint8),
+                                    *(df_ml[col].values[idx] for col in columns))
+               for series_id, idx in groups.items()}
+
+    stale = [series_id for series_id, digest in digests.items() if cache.get(series_id, (None,))[0] != digest]
+    if stale:
+        tasks = [(series_id, df_ml.iloc[groups[series_id]], model_params, n_folds, list(features))
+                 for series_id in stale]
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for series_id, preds in executor.map(_predict_series, tasks):
+                cache[series_id] = (digests[series_id], preds)
+
+    # Series no longer in the data drop out of the cache
+    cache = {series_id: cache[series_id] for series_id in digests}
+    pd.to_pickle(cache, cache_path)
+    predicted = np.full(len(df_ml), np.nan)
+    for series_id, idx in groups.items():
+        predicted[idx] = cache[series_id][1]
+    return predicted, stale
+
+def render_series(task):
+    """Actual vs predicted glucose and prediction error for one whole series.
+
+    actual is drawn at its own times; predicted (and its error against the
+    reading it forecasts) at target_times, HORIZON after the inputs.
+    """
+    path, series_id, times, actual, target_times, target, predicted = task
+    fig, (ax_top, ax_err) = _worker_figures['series']
+    ax_top.cla()
+    ax_err.cla()
+
+    ax_top.plot(times, actual, 'b-', linewidth=1.5, label='Actual Glucose')
+    if predicted is not None:
+        ax_top.plot(target_times, predicted, 'r--', linewidth=1.5, label='Predicted Glucose (out-of-sample)')
+        error = predicted - target
+        ax_err.plot(target_times, error, 'g-', linewidth=1)
+        ax_err.fill_between(target_times, error, 0, where=(error > 0), color='red', alpha=0.3,
+                            label='Overestimation')
+        ax_err.fill_between(target_times, error, 0, where=(error < 0), color='blue', alpha=0.3,
+                            label='Underestimation')
+        ax_err.axhline(y=0, color='r', linestyle='-', alpha=0.3)
+        ax_err.legend()
+    ax_top.axhspan(70, 180, alpha=0.15, color='green', label='Target Range')
+    ax_top.set_title(f'Actual vs Predicted Glucose Levels for Series ID: {series_id}')
+    ax_top.set_ylabel('Blood Glucose Level (mg/dL)')
+    ax_top.legend()
+    ax_top.grid(True)
+    ax_err.set_xlabel('Time')
+    ax_err.set_ylabel('Prediction Error (mg/dL)')
+    ax_err.grid(True)
+
+    fig.tight_layout()
+    fig.savefig(path)
+    return path
+
+def render_day(task):
+    """24-hour glucose plot for one series-day."""
+    import matplotlib.dates as mdates
+
+    path, series_id, day, times, actual, target_times, target, predicted = task
+    fig, ax = _worker_figures['day']
+    ax.cla()
+
+    ax.plot(times, actual, 'b-', linewidth=2.5, label='Actual Glucose')
+    if predicted is not None:
+        ax.plot(target_times, predicted, 'r--', linewidth=2.5, label='Predicted Glucose (out-of-sample)')
+        ax.fill_between(target_times, target, predicted, color='lightgray', alpha=0.5)
+    ax.axhline(y=70, color='g', linestyle='-', alpha=0.5, label='Low Threshold (70 mg/dL)')
+    ax.axhline(y=180, color='orange', linestyle='-', alpha=0.5, label='High Threshold (180 mg/dL)')
+    ax.axhspan(70, 180, alpha=0.2, color='green', label='Target Range')
+    ax.set_title(f'24-Hour Glucose - Series ID: {series_id} - {day}', fontsize=16)
+    ax.set_xlabel('Time', fontsize=14)
+    ax.set_ylabel('Blood Glucose Level (mg/dL)', fontsize=14)
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
+    ax.legend(fontsize=12)
+    ax.grid(True)
+
+    fig.tight_layout()
+    fig.savefig(path)
+    return path
+
+def render(task):
+    kind, payload = task
+    return render_series(payload) if kind == 'series' else render_day(payload)
+
+def build_tasks(df_ml, output_dir, manifest):
+    """Figure tasks whose input data changed since the last run, plus the new manifest.
+
+    Actual glucose is the blood_glucose reading at its own time. Predictions
+    (out-of-sample, in 'predicted_glucose') are placed at their target time
+    and compared with the TARGET reading there; day figures group readings
+    by their own day and predictions by their target's day.
+    """
+    tasks = []
+    new_manifest = {}
+    has_predictions = 'predicted_glucose' in df_ml.columns
+
+    def add(kind, path, arrays, payload):
+        digest = data_hash(*arrays)
+        new_manifest[path] = digest
+        if manifest.get(path) != digest or not os.path.exists(path):
+            tasks.append((kind, payload))
+
+    times = df_ml['datetime'].values
+    actual = df_ml['blood_glucose'].values
+    target_times = (df_ml['datetime'] + HORIZON).values
+    target = df_ml[TARGET].values
+    predicted = df_ml['predicted_glucose'].values if has_predictions else None
+
+    def payload(idx, pred_idx):
+        pred = predicted[pred_idx] if has_predictions else None
+        arrays = [times[idx], actual[idx]] + ([target_times[pred_idx], pred] if has_predictions else [])
+        return arrays, (times[idx], actual[idx], target_times[pred_idx], target[pred_idx], pred)
+
+    for series_id, idx in df_ml.groupby('series_id').indices.items():
+        path = os.path.join(output_dir, f'series_{series_id}.png')
+        arrays, data = payload(idx, idx)
+        add('series', path, arrays, (path, series_id, *data))
+
+    days = df_ml.groupby([df_ml['series_id'], df_ml['datetime'].dt.date]).indices
+    target_days = df_ml.groupby([df_ml['series_id'], (df_ml['datetime'] + HORIZON).dt.date]).indices
+    empty = np.array([], dtype=np.int64)
+    for (series_id, day), idx in days.items():
+        path = os.path.join(output_dir, 'days', f'series_{series_id}_{day}.png')
+        arrays, data = payload(idx, target_days.get((series_id, day), empty))
+        add('day', path, arrays, (path, series_id, day, *data))
+
+    return tasks, new_manifest
+
+def remove_stale_figures(output_dir, new_manifest):
+    """Delete figures from earlier runs that this run no longer produces (e.g. series or days removed)."""
+    removed = 0
+    for directory in (output_dir, os.path.join(output_dir, 'days')):
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.endswith('.png') and path not in new_manifest:
+                os.remove(path)
+                removed += 1
+    return removed
+
+def main():
+    # Configuration
+    db_name = "cgm_light.db"
+    model_path = "models/forecaster.joblib"
+    output_dir = "report"
+    max_workers = None  # one worker per core
+    n_folds = 5
+
+    df_ml = cached_features(db_name).reset_index(drop=True)
+    os.makedirs(os.path.join(output_dir, 'days'), exist_ok=True)
+    if os.path.exists(model_path):
+        # Refit the saved forecaster's configuration walk-forward, so every plotted prediction is out-of-sample
+        bundle = load_forecaster(model_path)
+        params = {k: v for k, v in bundle['model'].get_params().items() if k not in ('random_state', 'n_jobs')}
+        start = time.perf_counter()
+        df_ml['predicted_glucose'], refitted = cached_predictions(
+            df_ml, params, bundle.get('features', FEATURES), n_folds,
+            os.path.join(output_dir, 'predictions.pkl'), max_workers)
+        print(f"Refitted {len(refitted)} of {df_ml['series_id'].nunique()} series "
+              f"in {time.perf_counter() - start:.1f}s")
+
+    manifest_path = os.path.join(output_dir, 'manifest.json')
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+
+    tasks, new_manifest = build_tasks(df_ml, output_dir, manifest)
+    print(f"{len(tasks)} of {len(new_manifest)} figures need rendering, "
+          f"{remove_stale_figures(output_dir, new_manifest)} stale figures removed")
+
+    start = time.perf_counter()
+    if tasks:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker) as executor:
+            for _ in executor.map(render, tasks, chunksize=8):
+                pass
+    print(f"Rendered {len(tasks)} figures in {time.perf_counter() - start:.1f}s")
+
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(new_manifest, f, indent=2)
+
+if __name__ == "__main__":
+    main()
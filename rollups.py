@@ -0,0 +1,170 @@
+import math
+import sqlite3
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from instrumentation import profile_from_env, traced
+
+# Rollup table -> number of leading characters of the ISO datetime that identify the bucket
+ROLLUPS = {
+    'cgm_rollup_hourly': 13,  # YYYY-MM-DDTHH
+    'cgm_rollup_daily': 10,   # YYYY-MM-DD
+}
+BUCKET_SUFFIX = {13: ':00:00', 10: 'T00:00:00'}
+
+def create_rollup_tables(conn):
+    """Create the hourly and daily rollup tables if they do not exist."""
+    cursor = conn.cursor()
+    for table in ROLLUPS:
+        cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            series_id INTEGER,
+            bucket TEXT,
+            n INTEGER,
+            min_bg REAL,
+            max_bg REAL,
+            sum_bg REAL,
+            sumsq_bg REAL,
+            FOREIGN KEY (series_id) REFERENCES series (series_id),
+            PRIMARY KEY (series_id, bucket)
+        )
+        ''')
+    conn.commit()
+
+def max_reading_id(conn):
+    """Highest cgm_data id, recorded before ingestion so new rows can be found afterwards."""
+    row = conn.execute("SELECT MAX(id) FROM cgm_data").fetchone()
+    return row[0] or 0
+
+@traced('rollups.refresh')
+def refresh_rollups(conn, since_id=0):
+    """Recompute the rollup buckets touched by cgm_data rows with id > since_id.
+
+    Buckets are recomputed from cgm_data rather than incremented, so rows that
+    INSERT OR IGNORE skipped as duplicates never get counted twice. Passing
+    since_id=0 rebuilds the rollups for the whole table.
+    """
+    create_rollup_tables(conn)
+    cursor = conn.cursor()
+    # New rows are found by rowid range, then each series' span is re-aggregated
+    # through the (datetime, series_id) index
+    spans = cursor.execute(
+        "SELECT series_id, MIN(datetime), MAX(datetime) FROM cgm_data WHERE id > ? GROUP BY series_id",
+        (since_id,)
+    ).fetchall()
+
+    for series_id, first, last in spans:
+        for table, width in ROLLUPS.items():
+            start = first[:width]
+            # Exclusive upper bound just past the last bucket ('~' sorts after any datetime character)
+            end = last[:width] + '~'
+            cursor.execute(f'''
+                INSERT OR REPLACE INTO {table} (series_id, bucket, n, min_bg, max_bg, sum_bg, sumsq_bg)
+                SELECT series_id, substr(datetime, 1, {width}) || '{BUCKET_SUFFIX[width]}' AS bucket,
+                       COUNT(*), MIN(blood_glucose), MAX(blood_glucose),
+                       SUM(blood_glucose), SUM(blood_glucose * blood_glucose)
+                FROM cgm_data
+                WHERE datetime >= ? AND datetime < ? AND series_id = ?
+                GROUP BY series_id, bucket
+            ''', (start, end, series_id))
+    conn.commit()
+    return len(spans)
+
+def _combine(parts):
+    """Merge (n, min, max, sum, sumsq) aggregates into a summary dict."""
+    parts = [p for p in parts if p[0]]
+    n = sum(p[0] for p in parts)
+    if n == 0:
+        return {'n': 0, 'min': None, 'max': None, 'mean': None, 'std': None}
+    total = sum(p[3] for p in parts)
+    total_sq = sum(p[4] for p in parts)
+    mean = total / n
+    return {
+        'n': n,
+        'min': min(p[1] for p in parts),
+        'max': max(p[2] for p in parts),
+        'mean': mean,
+        'std': math.sqrt(max(total_sq / n - mean * mean, 0.0)),
+    }
+
+@traced('query.range_summary')
+def range_summary(conn, series_id, start, end):
+    """Count/min/max/mean/std of readings in [start, end) answered from the rollups.
+
+    Whole days come from the daily rollup and whole hours at the edges from
+    the hourly rollup; only the sub-hour remainders at either end touch
+    cgm_data.
+    """
+    start = datetime.fromisoformat(start) if isinstance(start, str) else start
+    end = datetime.fromisoformat(end) if isinstance(end, str) else end
+
+    first_hour = start.replace(minute=0, second=0, microsecond=0)
+    if first_hour < start:
+        first_hour += timedelta(hours=1)
+    last_hour = end.replace(minute=0, second=0, microsecond=0)
+    first_day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    if first_day < start:
+        first_day += timedelta(days=1)
+    last_day = end.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    aggregate = "SELECT SUM(n), MIN(min_bg), MAX(max_bg), SUM(sum_bg), SUM(sumsq_bg) FROM {} " \
+                "WHERE series_id = ? AND bucket >= ? AND bucket < ?"
+    raw = "SELECT COUNT(*), MIN(blood_glucose), MAX(blood_glucose), SUM(blood_glucose), " \
+          "SUM(blood_glucose * blood_glucose) FROM cgm_data " \
+          "WHERE datetime >= ? AND datetime < ? AND series_id = ?"
+    cursor = conn.cursor()
+    parts = []
+
+    if first_hour >= last_hour:
+        # Range lies within one hour
+        parts.append(cursor.execute(raw, (start.isoformat(), end.isoformat(), series_id)).fetchone())
+        return _combine(parts)
+
+    if first_day < last_day:
+        parts.append(cursor.execute(aggregate.format('cgm_rollup_daily'),
+                                    (series_id, first_day.isoformat(), last_day.isoformat())).fetchone())
+        hour_ranges = [(first_hour, first_day), (last_day, last_hour)]
+    else:
+        hour_ranges = [(first_hour, last_hour)]
+    for lo, hi in hour_ranges:
+        if lo < hi:
+            parts.append(cursor.execute(aggregate.format('cgm_rollup_hourly'),
+                                        (series_id, lo.isoformat(), hi.isoformat())).fetchone())
+
+    parts.append(cursor.execute(raw, (start.isoformat(), first_hour.isoformat(), series_id)).fetchone())
+    parts.append(cursor.execute(raw, (last_hour.isoformat(), end.isoformat(), series_id)).fetchone())
+    return _combine(parts)
+
+def overview(conn, series_id, resolution='hourly', start=None, end=None):
+    """Per-bucket mean/min/max/std for overview charts, read from the rollups."""
+    table = 'cgm_rollup_hourly' if resolution == 'hourly' else 'cgm_rollup_daily'
+    query = f"SELECT bucket, n, min_bg, max_bg, sum_bg, sumsq_bg FROM {table} WHERE series_id = ?"
+    params = [series_id]
+    if start is not None:
+        query += " AND bucket >= ?"
+        params.append(start)
+    if end is not None:
+        query += " AND bucket < ?"
+        params.append(end)
+    df = pd.read_sql(query + " ORDER BY bucket", conn, params=params)
+    df['datetime'] = pd.to_datetime(df.pop('bucket'))
+    df['mean_bg'] = df['sum_bg'] / df['n']
+    df['std_bg'] = (df.pop('sumsq_bg') / df['n'] - df['mean_bg'] ** 2).clip(lower=0) ** 0.5
+    return df.drop(columns=['sum_bg']).set_index('datetime')
+
+def main():
+    profile_from_env()
+    # Configuration
+    db_name = "cgm.db"
+
+    # Backfill the rollups for a database loaded before they existed
+    conn = sqlite3.connect(db_name)
+    n_series = refresh_rollups(conn)
+    for table in ROLLUPS:
+        n_rows = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        print(f"{table}: {n_rows} buckets across {n_series} series")
+    conn.close()
+
+if __name__ == "__main__":
+    main()
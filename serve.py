@@ -0,0 +1,240 @@
+import json
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from find_anomalies import load_anomaly_models, score_anomalies
+from forecast import load_forecaster, predict_latest
+from smoothing import StreamingSmoother, smoothed_derivatives
+
+# Features kept per series for readings already folded into its Kalman state (a day at 5 minutes)
+KALMAN_HISTORY = 288
+
+def parse_readings(readings):
+    """Convert [[iso_datetime, glucose], ...] into sorted epoch-second and glucose arrays."""
+    times = np.array([datetime.fromisoformat(r[0]).timestamp() for r in readings], dtype=np.float64)
+    values = np.array([float(r[1]) for r in readings], dtype=np.float64)
+    order = np.argsort(times, kind='stable')
+    return times[order], values[order]
+
+def derivative_features(times, values, smoothing=None):
+    """Rate of change and acceleration for readings[2:], matching find_anomalies.py.
+
+    smoothing is the anomaly models' feature smoothing ('savgol' or None);
+    'kalman' keeps state across requests and goes through MicroBatcher.
+    """
+    if smoothing is not None:
+        _, roc, acc = smoothed_derivatives((times * 1e9).astype(np.int64), values, smoothing)
+        return np.column_stack([roc[2:], acc[2:]])
+    minutes = np.diff(times) / 60
+    roc = np.diff(values) / minutes
+    acc = np.diff(roc) / minutes[1:]
+    return np.column_stack([roc[1:], acc])
+
+class MicroBatcher:
+    """Collects concurrent requests and scores them with one predict call per batch."""
+
+    def __init__(self, forecaster, anomaly_models, max_batch=64, max_wait_ms=2.0):
+        self.forecaster = forecaster
+        self.anomaly_models = anomaly_models
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.pending = queue.Queue()
+        self.latencies = deque(maxlen=10000)
+        self.batch_sizes = deque(maxlen=10000)
+        self.lock = threading.Lock()
+        # Kalman features need each series' filter state from earlier requests; only the worker thread touches these
+        self.smoother = StreamingSmoother()
+        self.kalman_history = {}
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def submit(self, series_id, times, values):
+        """Queue one request and return a Future for its result."""
+        future = Future()
+        self.pending.put((time.perf_counter(), series_id, times, values, future))
+        return future
+
+    def _collect(self):
+        # Block for the first request, then wait briefly for others to join it
+        batch = [self.pending.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                results = self._predict(batch)
+            except Exception as e:
+                for item in batch:
+                    item[4].set_exception(e)
+                continue
+
+            done = time.perf_counter()
+            with self.lock:
+                self.batch_sizes.append(len(batch))
+                for item, result in zip(batch, results):
+                    self.latencies.append((done - item[0]) * 1000)
+            for item, result in zip(batch, results):
+                item[4].set_result(result)
+
+    def _kalman_features(self, series_id, times, values):
+        """Kalman rate of change and acceleration for readings[2:], from the series' running filter.
+
+        Readings newer than the filter's last one are folded in; readings it
+        has already seen reuse the features computed then. Older readings it
+        never saw cannot enter a causal filter and get NaN (never flagged).
+        """
+        state = self.smoother.state(series_id)
+        history = self.kalman_history.setdefault(series_id, OrderedDict())
+        features = np.full((len(times), 2), np.nan)
+        for i, (t, value) in enumerate(zip(times.tolist(), values.tolist())):
+            if t in history:
+                features[i] = history[t]
+            elif state.last_minute is None or t / 60 > state.last_minute:
+                _, roc, acc = state.update(t / 60, value)
+                features[i] = history[t] = (roc, acc)
+        while len(history) > KALMAN_HISTORY:
+            history.popitem(last=False)
+        return features[2:]
+
+    def _features(self, series_id, times, values):
+        smoothing = self.anomaly_models.get('smoothing')
+        if smoothing == 'kalman':
+            return self._kalman_features(series_id, times, values)
+        return derivative_features(times, values, smoothing)
+
+    def _predict(self, batch):
+        # One vectorized forecast for the whole batch
+        forecasts = predict_latest(self.forecaster, [(b[1], b[2], b[3]) for b in batch])
+
+        # One vectorized anomaly pass over every request's derivative rows
+        feature_blocks = [self._features(b[1], b[2], b[3]) for b in batch]
+        offsets = np.cumsum([0] + [len(f) for f in feature_blocks])
+        flags = np.zeros(offsets[-1], dtype=bool)
+        if offsets[-1] > 0:
+            features = np.vstack(feature_blocks)
+            valid = np.isfinite(features).all(axis=1)
+            if valid.any():
+                flags[valid] = score_anomalies(self.anomaly_models, features[valid])
+
+        results = []
+        for i, (_, series_id, times, values, _) in enumerate(batch):
+            # The first two readings have no acceleration and are never flagged
+            request_flags = [False] * min(2, len(times)) + flags[offsets[i]:offsets[i + 1]].tolist()
+            results.append({
+                'series_id': series_id,
+                'forecast_time': datetime.fromtimestamp(times[-1] + 30 * 60).isoformat(),
+                'forecast': float(forecasts[i]),
+                'anomalies': request_flags,
+            })
+        return results
+
+    def stats(self):
+        """Latency percentiles (ms) and batch sizes over the recent window."""
+        with self.lock:
+            latencies = np.array(self.latencies)
+            batch_sizes = np.array(self.batch_sizes)
+        if len(latencies) == 0:
+            return {'requests': 0}
+        return {
+            'requests': len(latencies),
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p99_ms': float(np.percentile(latencies, 99)),
+            'mean_batch_size': float(batch_sizes.mean()),
+        }
+
+class PredictionServer(ThreadingHTTPServer):
+    # Load generator clients connect all at once; the default backlog of 5 drops them
+    request_queue_size = 128
+    daemon_threads = True
+
+def make_handler(batcher):
+    class PredictionHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive for load generator connections
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/stats':
+                self._send_json(200, batcher.stats())
+            else:
+                self._send_json(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if self.path != '/predict':
+                self._send_json(404, {'error': 'not found'})
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                payload = json.loads(self.rfile.read(length))
+                if not isinstance(payload['series_id'], (int, str)):
+                    raise TypeError("series_id must be an integer or a string")
+                times, values = parse_readings(payload['readings'])
+                if len(times) < 2:
+                    raise ValueError("at least two readings are required")
+                future = batcher.submit(payload['series_id'], times, values)
+            except (KeyError, ValueError, TypeError, IndexError) as e:
+                self._send_json(400, {'error': str(e)})
+                return
+            try:
+                result = future.result()
+            except Exception as e:
+                # A failed batch must still answer every request in it
+                self._send_json(500, {'error': f"{type(e).__name__}: {e}"})
+                return
+            self._send_json(200, result)
+
+        def log_message(self, format, *args):
+            # Per-request access logging dominates latency at high request rates
+            pass
+
+    return PredictionHandler
+
+def main():
+    # Configuration
+    host = "127.0.0.1"
+    port = 8050
+    forecaster_path = "models/forecaster.joblib"
+    anomaly_models_path = "models/anomaly_models.joblib"
+
+    # Load the persisted models once for the lifetime of the service
+    forecaster = load_forecaster(forecaster_path)
+    # Batches are small, so thread-parallel tree evaluation only adds overhead
+    forecaster['model'].set_params(n_jobs=1)
+    anomaly_models = load_anomaly_models(anomaly_models_path)
+    batcher = MicroBatcher(forecaster, anomaly_models)
+
+    server = PredictionServer((host, port), make_handler(batcher))
+    print(f"Serving forecasts and anomaly flags on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Latency stats: {batcher.stats()}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+import ingest_tandem
+from episodes import refresh_episodes
+from instrumentation import TracedConnection, count, profile_from_env, span, traced
+from rollups import max_reading_id, refresh_rollups
+
+# SQLite's default SQLITE_MAX_ATTACHED; federated reads attach shards in groups of this size
+MAX_ATTACHED = 10
+STRATEGIES = ('cohort', 'hash')
+COHORT_PATTERN = re.compile(r'^(g\d+)_')
+
+def cohort_of(file_name):
+    """Cohort prefix of a kaggle file name ('g3_Patient_...' -> 'g3'), or None."""
+    match = COHORT_PATTERN.match(os.path.basename(file_name))
+    return match.group(1) if match else None
+
+def create_catalog(catalog_path):
+    """Create the catalog database: global series ids and the shard each one lives in."""
+    conn = sqlite3.connect(catalog_path)
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS shards (
+        shard TEXT PRIMARY KEY,
+        path TEXT
+    )
+    ''')
+    # AUTOINCREMENT so a series id is never reused, even after its shard is dropped
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS series (
+        series_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        shard TEXT,
+        cohort TEXT,
+        FOREIGN KEY (shard) REFERENCES shards (shard)
+    )
+    ''')
+    conn.commit()
+    return conn
+
+class ShardRouter:
+    """Routes series to shard databases and allocates their ids from one catalog.
+
+    With strategy 'cohort' each cohort (g1-g5, or 'default') gets its own
+    shard file; with 'hash' a series goes to shard series_id % n_shards.
+    Every shard has the normal cgm.db schema, so the loaders, rollups and
+    episodes work on a shard connection unchanged.
+    """
+    def __init__(self, catalog_path, shard_dir, strategy='cohort', n_shards=4):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"unknown sharding strategy {strategy!r}; expected one of {STRATEGIES}")
+        self.shard_dir = shard_dir
+        self.strategy = strategy
+        self.n_shards = n_shards
+        os.makedirs(shard_dir, exist_ok=True)
+        self.catalog = create_catalog(catalog_path)
+        self._series_shard = dict(self.catalog.execute("SELECT series_id, shard FROM series"))
+
+    def shard_path(self, shard):
+        return os.path.join(self.shard_dir, f"cgm_{shard}.db")
+
+    def _register_shard(self, shard):
+        path = self.shard_path(shard)
+        if self.catalog.execute("SELECT 1 FROM shards WHERE shard = ?", (shard,)).fetchone() is None:
+            ingest_tandem.create_database(path).close()
+            self.catalog.execute("INSERT INTO shards (shard, path) VALUES (?, ?)", (shard, path))
+        return path
+
+    def allocate_series(self, cohort=None):
+        """Reserve a global series id, pick its shard and create the series row there.
+
+        Returns (series_id, shard).
+        """
+        cursor = self.catalog.execute("INSERT INTO series (cohort) VALUES (?)", (cohort,))
+        series_id = cursor.lastrowid
+        if self.strategy == 'cohort':
+            shard = cohort or 'default'
+        else:
+            shard = f"h{series_id % self.n_shards}"
+        path = self._register_shard(shard)
+        self.catalog.execute("UPDATE series SET shard = ? WHERE series_id = ?", (shard, series_id))
+        self.catalog.commit()
+
+        conn = sqlite3.connect(path)
+        conn.execute("INSERT OR IGNORE INTO series (series_id) VALUES (?)", (series_id,))
+        conn.commit()
+        conn.close()
+        self._series_shard[series_id] = shard
+        count('sharding.series_allocated')
+        return series_id, shard
+
+    def shard_for(self, series_id):
+        """Shard holding a series, from the catalog."""
+        shard = self._series_shard.get(series_id)
+        if shard is None:
+            row = self.catalog.execute("SELECT shard FROM series WHERE series_id = ?", (series_id,)).fetchone()
+            if row is None:
+                raise KeyError(f"series {series_id} is not in the catalog")
+            shard = self._series_shard[series_id] = row[0]
+        return shard
+
+    def connect(self, series_id):
+        """Write connection to the shard that owns a series."""
+        return sqlite3.connect(self.shard_path(self.shard_for(series_id)), factory=TracedConnection)
+
+    def shards(self, series_ids=None):
+        """{shard: path} for every shard, or only those holding series_ids."""
+        rows = self.catalog.execute("SELECT shard, path FROM shards ORDER BY shard").fetchall()
+        if series_ids is not None:
+            wanted = {self.shard_for(series_id) for series_id in series_ids}
+            rows = [(shard, path) for shard, path in rows if shard in wanted]
+        return dict(rows)
+
+    def close(self):
+        self.catalog.close()
+
+def _ingest_shard(path, jobs):
+    """Load one shard's files in its own process; jobs are (loader module name, csv path, series_id)."""
+    loaders = {name: __import__(name) for name in {job[0] for job in jobs}}
+    conn = sqlite3.connect(path, factory=TracedConnection)
+    last_id = max_reading_id(conn)
+    for loader, csv_path, series_id in jobs:
+        with span('ingest.file', file=csv_path):
+            loaders[loader].process_csv_file(csv_path, series_id, conn)
+    refresh_rollups(conn, last_id)
+    refresh_episodes(conn, last_id)
+    n_rows = conn.execute("SELECT COUNT(*) FROM cgm_data WHERE id > ?", (last_id,)).fetchone()[0]
+    conn.close()
+    return path, n_rows
+
+@traced('sharding.ingest')
+def ingest_sharded(router, files, loader='ingest_kaggle_dataset', max_workers=None):
+    """Load CSV files (one series each) into their shards, one process per shard.
+
+    Ids come from the catalog up front, so the shard writers never contend
+    for a lock: each process is the only writer of its shard file.
+    """
+    jobs = {}
+    for csv_path in files:
+        series_id, shard = router.allocate_series(cohort_of(csv_path))
+        jobs.setdefault(router.shard_path(shard), []).append((loader, str(csv_path), series_id))
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        rows = dict(executor.map(_ingest_shard, jobs.keys(), jobs.values()))
+    count('sharding.rows_ingested', sum(rows.values()))
+    return rows
+
+def federated_sql(schemas, columns, table, where, group_by=""):
+    """UNION ALL of the same select over each attached schema, the predicate repeated in every branch.
+
+    Pushing the WHERE into each branch lets every shard use its own
+    (series_id, datetime) index instead of filtering the union afterwards.
+    """
+    clause = (f" WHERE {where}" if where else "") + (f" GROUP BY {group_by}" if group_by else "")
+    return "\nUNION ALL\n".join(f"SELECT {columns} FROM {schema}.{table}{clause}" for schema in schemas)
+
+@traced('sharding.read')
+def federated_read(router, columns="*", table='cgm_data', where="", params=(), series_ids=None, group_by=""):
+    """Run one select across the shards and return the combined rows as a DataFrame.
+
+    With series_ids, only the shards holding them are attached and a
+    series_id filter is pushed into each branch. params bind to `where` and
+    are repeated for every branch. group_by is applied per shard, which is
+    exact when it includes series_id (a series never spans shards). The id
+    column is local to each shard; series_id is global.
+    """
+    shards = router.shards(series_ids)
+    if series_ids is not None:
+        ids = ', '.join(str(int(series_id)) for series_id in series_ids)
+        where = f"series_id IN ({ids})" + (f" AND ({where})" if where else "")
+
+    frames = []
+    paths = list(shards.values())
+    for i in range(0, len(paths), MAX_ATTACHED):
+        group = paths[i:i + MAX_ATTACHED]
+        conn = sqlite3.connect(":memory:")
+        schemas = []
+        for j, path in enumerate(group):
+            conn.execute(f"ATTACH DATABASE ? AS shard{j}", (path,))
+            schemas.append(f"shard{j}")
+        sql = federated_sql(schemas, columns, table, where, group_by)
+        frames.append(pd.read_sql(sql, conn, params=tuple(params) * len(schemas)))
+        conn.close()
+    count('sharding.shards_read', len(paths))
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+def load_cgm_data(router, series_ids=None):
+    """All (or some series') CGM readings across shards, sorted like find_anomalies.load_cgm_data."""
+    df = federated_read(router, "series_id, datetime, blood_glucose", series_ids=series_ids)
+    df['datetime'] = pd.to_datetime(df['datetime'], format='ISO8601')
+    return df.sort_values(['series_id', 'datetime'])
+
+def main():
+    profile_from_env()
+    # Configuration
+    catalog_path = "catalog.db"
+    shard_dir = "./shards"
+    strategy = 'cohort'
+    csv_directory = "./input_data/kaggle_data"
+
+    router = ShardRouter(catalog_path, shard_dir, strategy)
+    files = sorted(Path(csv_directory).glob("*.csv"))
+    if not files:
+        print(f"No CSV files found in {csv_directory}")
+        return
+
+    start = time.perf_counter()
+    rows = ingest_sharded(router, files)
+    print(f"Loaded {sum(rows.values())} readings from {len(files)} files into {len(rows)} shards "
+          f"in {time.perf_counter() - start:.1f}s")
+    for path, n_rows in sorted(rows.items()):
+        print(f"  {path}: {n_rows} readings")
+
+    start = time.perf_counter()
+    df = federated_read(router, "series_id, COUNT(*) AS n, AVG(blood_glucose) AS mean_bg", group_by="series_id")
+    print(f"\nFederated per-series summary ({time.perf_counter() - start:.2f}s):")
+    print(df.head(10).to_string(index=False))
+    router.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+import os
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import count, profile_from_env, traced
+
+READING_MINUTES = 5
+WINDOW = 36           # 3 hours of 5-minute readings per indexed window
+STRIDE = 6            # a new window every 30 minutes
+SEGMENTS = 12         # PAA segments per embedding
+MAX_GAP_READINGS = 2  # gaps up to 10 minutes are interpolated, longer ones break windows
+
+# Per-window arrays, kept aligned row for row
+ARRAYS = ('embeddings', 'embedding_norms', 'windows', 'series_ids', 'starts')
+
+def new_index(window=WINDOW, stride=STRIDE, segments=SEGMENTS):
+    """Empty index: embeddings, z-normalized windows and their origin, plus a watermark per series.
+
+    Windows added by add_series wait in 'pending' until compact_index
+    appends them to the arrays in one concatenation.
+    """
+    if window % segments:
+        raise ValueError("window must be a multiple of segments")
+    return {
+        'window': window,
+        'stride': stride,
+        'segments': segments,
+        'embeddings': np.empty((0, segments), dtype=np.float32),
+        'embedding_norms': np.empty(0, dtype=np.float32),
+        'windows': np.empty((0, window), dtype=np.float32),
+        'series_ids': np.empty(0, dtype=np.int64),
+        'starts': np.empty(0, dtype='datetime64[s]'),
+        'indexed_through': {},
+        'pending': {key: [] for key in ARRAYS},
+    }
+
+def znormalize(windows):
+    """Z-normalize each row; flat rows become all zeros."""
+    windows = np.asarray(windows, dtype=np.float64)
+    mean = windows.mean(axis=-1, keepdims=True)
+    std = windows.std(axis=-1, keepdims=True)
+    return (windows - mean) / np.where(std < 1e-8, 1.0, std)
+
+def paa(normed, segments):
+    """Piecewise aggregate approximation scaled so its Euclidean distance lower-bounds the full one."""
+    m = normed.shape[-1]
+    means = normed.reshape(*normed.shape[:-1], segments, m // segments).mean(axis=-1)
+    return means * np.sqrt(m / segments)
+
+def series_windows(df, window, stride, after=None):
+    """Fixed-length windows over a series resampled to the 5-minute grid.
+
+    Windows start every stride grid points (counted from `after` when given,
+    keeping only later starts) and are dropped if they overlap a gap longer
+    than MAX_GAP_READINGS readings.
+    """
+    grid = df.set_index('datetime')['blood_glucose'].resample(f'{READING_MINUTES}min').mean()
+    grid = grid.interpolate(limit=MAX_GAP_READINGS, limit_area='inside')
+    if len(grid) < window:
+        return np.empty((0, window)), np.empty(0, dtype='datetime64[s]')
+
+    values = np.lib.stride_tricks.sliding_window_view(grid.values, window)
+    starts = grid.index.values[:len(values)]
+    if after is None:
+        keep = np.arange(len(values)) % stride == 0
+    else:
+        offset = (starts - np.datetime64(after)) // np.timedelta64(READING_MINUTES, 'm')
+        keep = (offset > 0) & (offset % stride == 0)
+    keep &= ~np.isnan(values).any(axis=1)
+    return values[keep], starts[keep].astype('datetime64[s]')
+
+@traced('similarity.add')
+def add_series(index, series_id, df, after=None):
+    """Queue the windows of one series (optionally only those starting after `after`) for compact_index."""
+    values, starts = series_windows(df, index['window'], index['stride'], after)
+    if len(values) == 0:
+        return 0
+    normed = znormalize(values)
+    embeddings = paa(normed, index['segments']).astype(np.float32)
+    pending = index['pending']
+    pending['embeddings'].append(embeddings)
+    pending['embedding_norms'].append((embeddings ** 2).sum(axis=1))
+    pending['windows'].append(normed.astype(np.float32))
+    pending['series_ids'].append(np.full(len(values), series_id, dtype=np.int64))
+    pending['starts'].append(starts)
+    index['indexed_through'][series_id] = pd.Timestamp(starts[-1]).to_pydatetime()
+    count('similarity.windows_added', len(values))
+    return len(values)
+
+def compact_index(index):
+    """Append every pending window to the index arrays, one concatenate per array."""
+    pending = index['pending']
+    if not pending['series_ids']:
+        return
+    for key in ARRAYS:
+        index[key] = np.concatenate([index[key]] + pending[key])
+        pending[key] = []
+
+def update_from_db(index, db_name):
+    """Index new series and the new tail of already indexed series."""
+    conn = sqlite3.connect(db_name)
+    series_ids = [row[0] for row in conn.execute("SELECT DISTINCT series_id FROM cgm_data")]
+    added = {}
+    for series_id in series_ids:
+        after = index['indexed_through'].get(series_id)
+        query = "SELECT datetime, blood_glucose FROM cgm_data WHERE series_id = ?"
+        params = [series_id]
+        if after is not None:
+            # Only the readings the next window can start from
+            query += " AND datetime >= ?"
+            params.append(after.isoformat())
+        df = pd.read_sql(query, conn, params=params)
+        if df.empty:
+            continue
+        df['datetime'] = pd.to_datetime(df['datetime'], format='ISO8601')
+        n = add_series(index, series_id, df, after)
+        if n:
+            added[series_id] = n
+    conn.close()
+    compact_index(index)
+    return added
+
+@traced('similarity.query')
+def query(index, values, k=5, exclude_series=None, max_candidates=None):
+    """The k indexed windows most similar in shape to `values` (one window of readings).
+
+    The windows with the smallest PAA lower-bound distances are re-ranked with
+    the exact z-normalized Euclidean distance, widening the candidate set
+    until no remaining lower bound can beat the k-th best, so the result is
+    exact. max_candidates caps the re-rank for an approximate answer.
+    """
+    compact_index(index)
+    q = znormalize(np.asarray(values, dtype=np.float64)[-index['window']:])
+    if len(q) != index['window']:
+        raise ValueError(f"query needs {index['window']} readings")
+    q_embedding = paa(q, index['segments']).astype(np.float32)
+
+    # |e - q|^2 expanded so the scan is one matrix-vector product
+    lower_bounds = index['embedding_norms'] - 2 * (index['embeddings'] @ q_embedding) + q_embedding @ q_embedding
+    if exclude_series is not None:
+        lower_bounds[index['series_ids'] == exclude_series] = np.inf
+
+    n = len(lower_bounds)
+    limit = n if max_candidates is None else min(n, max_candidates)
+    size = min(limit, max(8 * k, 256))
+    best_idx, best_d2 = np.empty(0, dtype=np.int64), np.empty(0)
+    while size > 0:
+        # The size smallest lower bounds; every other window's bound is at least their maximum
+        part = np.argpartition(lower_bounds, size - 1)[:size] if size < n else np.arange(n)
+        candidates = part[np.isfinite(lower_bounds[part])]
+        d2 = ((index['windows'][candidates] - q) ** 2).sum(axis=1)
+        top = np.argsort(d2, kind='stable')[:k]
+        best_idx, best_d2 = candidates[top], d2[top]
+        if size >= limit or (len(top) == k and best_d2[-1] <= lower_bounds[part].max()):
+            break
+        size = min(limit, size * 4)
+    count('similarity.candidates_checked', size)
+
+    return pd.DataFrame({
+        'series_id': index['series_ids'][best_idx],
+        'start': index['starts'][best_idx],
+        'distance': np.sqrt(best_d2),
+    })
+
+def window_at(index, series_id, start):
+    """The stored (z-normalized) window of a series starting at `start`."""
+    compact_index(index)
+    match = np.flatnonzero((index['series_ids'] == series_id) & (index['starts'] == np.datetime64(start, 's')))
+    if len(match) == 0:
+        raise KeyError(f"no indexed window for series {series_id} at {start}")
+    return index['windows'][match[0]]
+
+def save_index(index, path):
+    """Write the index to a single .npz file."""
+    compact_index(index)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    through = index['indexed_through']
+    np.savez(
+        path,
+        params=np.array([index['window'], index['stride'], index['segments']]),
+        embeddings=index['embeddings'],
+        windows=index['windows'],
+        series_ids=index['series_ids'],
+        starts=index['starts'],
+        through_series=np.array(list(through), dtype=np.int64),
+        through_times=np.array([np.datetime64(t, 's') for t in through.values()], dtype='datetime64[s]'),
+    )
+
+def load_index(path):
+    """Load an index written by save_index, or a fresh one if the file does not exist."""
+    if not os.path.exists(path):
+        return new_index()
+    with np.load(path) as data:
+        window, stride, segments = (int(v) for v in data['params'])
+        index = new_index(window, stride, segments)
+        for key in ['embeddings', 'windows', 'series_ids', 'starts']:
+            index[key] = data[key]
+        index['embedding_norms'] = (index['embeddings'] ** 2).sum(axis=1)
+        index['indexed_through'] = {
+            int(s): pd.Timestamp(t).to_pydatetime() for s, t in zip(data['through_series'], data['through_times'])
+        }
+    return index
+
+def main():
+    profile_from_env()
+    # Configuration
+    db_name = "cgm_light.db"
+    index_path = "models/similarity_index.npz"
+    k = 5
+
+    index = load_index(index_path)
+    start = time.perf_counter()
+    added = update_from_db(index, db_name)
+    print(f"Indexed {sum(added.values())} new windows from {len(added)} series "
+          f"in {time.perf_counter() - start:.2f}s ({len(index['series_ids'])} total)")
+    save_index(index, index_path)
+
+    if len(index['series_ids']) == 0:
+        return
+    # Example: other patients' windows shaped like a random indexed window
+    i = np.random.default_rng(0).integers(len(index['series_ids']))
+    series_id, window_start = int(index['series_ids'][i]), index['starts'][i]
+    start = time.perf_counter()
+    matches = query(index, index['windows'][i], k=k, exclude_series=series_id)
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"\nWindows most like series {series_id} at {window_start} ({elapsed:.1f} ms):")
+    print(matches.to_string(index=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+
+from matrix_profile import _constant, naive_matrix_profile, sliding_stats, stomp_rows
+
+def glucose_with_flat_stretch(seed, n=400):
+    """A 0.1 mg/dL precision random walk, like stored readings, with a sensor stuck at one value."""
+    rng = np.random.default_rng(seed)
+    values = np.round(120 + np.cumsum(rng.normal(0, 2, n)), 1)
+    values[150:230] = values[150]
+    return values
+
+@pytest.mark.parametrize('seed', range(20))
+def test_stomp_matches_naive_with_flat_stretch(seed):
+    T, m = glucose_with_flat_stretch(seed), 36
+    profile, _ = stomp_rows(T, m, 0, len(T) - m + 1)
+    expected = naive_matrix_profile(T, m)
+    np.testing.assert_allclose(profile, expected, atol=1e-6)
+
+def test_flat_windows_are_detected():
+    _, sigma = sliding_stats(glucose_with_flat_stretch(0), 36)
+    assert _constant(sigma[150:230 - 36 + 1]).all()
@@ -0,0 +1,42 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from ingest_tandem import create_database
+from out_of_core import process_cohort
+
+def make_db(path):
+    """A 4-week 5-minute series with a hypo episode spanning the 2024-01-08 week boundary."""
+    conn = create_database(str(path))
+    conn.execute("INSERT INTO series DEFAULT VALUES")
+    times = pd.date_range('2024-01-01', '2024-01-28 23:55', freq='5min')
+    rng = np.random.default_rng(0)
+    bg = 130 + 25 * np.sin(np.arange(len(times)) / 40) + rng.normal(0, 3, len(times)).round(1)
+    hypo = (times >= '2024-01-07 23:30') & (times <= '2024-01-08 00:40')
+    bg[hypo] = 60.0
+    conn.executemany("INSERT INTO cgm_data (series_id, datetime, blood_glucose) VALUES (1, ?, ?)",
+                     zip(times.strftime('%Y-%m-%dT%H:%M:%S'), bg.tolist()))
+    conn.commit()
+    conn.close()
+
+def stored_metrics(path):
+    conn = sqlite3.connect(str(path))
+    df = pd.read_sql("SELECT * FROM glycemic_metrics WHERE window != 'all' ORDER BY window, window_start", conn)
+    conn.close()
+    return df
+
+def test_chunked_metrics_match_single_chunk(tmp_path):
+    single, chunked = tmp_path / 'single.db', tmp_path / 'chunked.db'
+    make_db(single)
+    make_db(chunked)
+
+    assert process_cohort(str(single), memory_budget_mb=1000)['chunks'] == 1
+    assert process_cohort(str(chunked), memory_budget_mb=0.0001)['chunks'] > 1
+
+    expected, actual = stored_metrics(single), stored_metrics(chunked)
+    pd.testing.assert_frame_equal(actual, expected)
+    hypos = expected.set_index(['window', 'window_start'])['hypo_episodes']
+    assert hypos[('day', '2024-01-07T00:00:00')] == 1
+    assert hypos[('day', '2024-01-08T00:00:00')] == 0
+    assert hypos[('week', '2024-01-08T00:00:00')] == 0
@@ -0,0 +1,243 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from episodes import refresh_episodes
+from ingest_tandem import create_database
+from instrumentation import count, profile_from_env, span
+from rollups import max_reading_id, refresh_rollups
+
+class AsyncTokenBucket:
+    """Client-side rate limit: acquire() waits until a request may be sent."""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+def create_cursor_table(conn):
+    """Create the feed_cursors table if it does not exist."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS feed_cursors (
+        patient_id TEXT PRIMARY KEY,
+        series_id INTEGER,
+        cursor TEXT,
+        updated_at TEXT,
+        FOREIGN KEY (series_id) REFERENCES series (series_id)
+    )
+    ''')
+    conn.commit()
+
+def load_cursors(conn):
+    """{patient_id: (series_id, cursor)} for every patient polled before."""
+    return {p: (s, c) for p, s, c in conn.execute("SELECT patient_id, series_id, cursor FROM feed_cursors")}
+
+def register_patient(conn, patient_id):
+    """New series for a patient seen for the first time, recorded in series, file and feed_cursors."""
+    series_id = conn.execute("INSERT INTO series DEFAULT VALUES").lastrowid
+    conn.execute("INSERT INTO file (file_name, series_id) VALUES (?, ?)", (f"vendor:{patient_id}", series_id))
+    conn.execute("INSERT INTO feed_cursors (patient_id, series_id, cursor, updated_at) VALUES (?, ?, NULL, NULL)",
+                 (patient_id, series_id))
+    conn.commit()
+    return series_id
+
+def write_pages(conn, pages):
+    """Insert fetched readings and advance their cursors in one transaction."""
+    last_id = max_reading_id(conn)
+    rows = []
+    cursors = []
+    now = datetime.now().isoformat()
+    for series_id, patient_id, cursor, readings in pages:
+        rows.extend((datetime.fromisoformat(r['systemTime']).isoformat(), series_id, float(r['value']))
+                    for r in readings)
+        cursors.append((cursor, now, patient_id))
+    with span('feed.write'):
+        conn.executemany("INSERT OR IGNORE INTO cgm_data (datetime, series_id, blood_glucose) VALUES (?, ?, ?)", rows)
+        # A cursor only moves forward together with the rows it covers
+        conn.executemany("UPDATE feed_cursors SET cursor = ?, updated_at = ? WHERE patient_id = ?", cursors)
+        conn.commit()
+        inserted = conn.execute("SELECT COUNT(*) FROM cgm_data WHERE id > ?", (last_id,)).fetchone()[0]
+        refresh_rollups(conn, last_id)
+        refresh_episodes(conn, last_id)
+    count('feed.readings_written', inserted)
+    return inserted
+
+class FeedClient:
+    """Polls every patient of a vendor-style feed concurrently and stores new readings.
+
+    HTTP requests use a pooled requests.Session (one keep-alive connection
+    per concurrent request) driven from asyncio through a thread executor.
+    A semaphore bounds concurrency, a token bucket keeps under the vendor's
+    rate limit, and 429/5xx responses are retried with Retry-After or
+    exponential backoff. Each patient is fetched from its stored cursor, and
+    pages are written in batches by a single writer.
+    """
+    def __init__(self, base_url, db_name, concurrency=16, rate_limit=(150, 30), page_limit=1000,
+                 batch_rows=20_000, max_retries=5, timeout=10.0):
+        self.base_url = base_url.rstrip('/')
+        self.db_name = db_name
+        self.page_limit = page_limit
+        self.batch_rows = batch_rows
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.http_threads = ThreadPoolExecutor(max_workers=concurrency)
+        self.db_thread = ThreadPoolExecutor(max_workers=1)
+        self.slots = asyncio.Semaphore(concurrency)
+        self.bucket = AsyncTokenBucket(*rate_limit)
+        self.conn = None
+        self.cursors = {}
+        self.stats = {'requests': 0, 'retries': 0, 'pages': 0, 'readings_fetched': 0, 'readings_written': 0,
+                      'patients_failed': 0}
+
+    async def db(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.db_thread, fn, *args)
+
+    def _open(self):
+        self.conn = create_database(self.db_name)
+        create_cursor_table(self.conn)
+        self.cursors = load_cursors(self.conn)
+
+    async def get_json(self, path, params=None):
+        """GET with rate limiting and retries; runs the blocking request in the HTTP thread pool."""
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            async with self.slots:
+                self.stats['requests'] += 1
+                try:
+                    response = await loop.run_in_executor(
+                        self.http_threads,
+                        lambda: self.session.get(self.base_url + path, params=params, timeout=self.timeout))
+                except requests.ConnectionError:
+                    response = None
+            if response is not None and response.status_code == 200:
+                return response.json()
+            if response is not None and response.status_code not in (429, 500, 502, 503, 504):
+                response.raise_for_status()
+            self.stats['retries'] += 1
+            count('feed.retries')
+            retry_after = response.headers.get('Retry-After') if response is not None else None
+            await asyncio.sleep(float(retry_after) if retry_after else min(2 ** attempt * 0.1, 5.0))
+        raise RuntimeError(f"giving up on {path} after {self.max_retries} retries")
+
+    async def poll_patient(self, patient_id, out):
+        """Fetch every page after the patient's cursor and queue them for the writer.
+
+        A patient whose requests fail is logged and skipped for this cycle
+        with its cursor unchanged, so one bad patient never stops the others;
+        pages already queued are written and re-fetched rows are ignored.
+        """
+        try:
+            if patient_id not in self.cursors:
+                series_id = await self.db(register_patient, self.conn, patient_id)
+                self.cursors[patient_id] = (series_id, None)
+            series_id, cursor = self.cursors[patient_id]
+            while True:
+                params = {'limit': self.page_limit}
+                if cursor is not None:
+                    params['cursor'] = cursor
+                page = await self.get_json(f"/v1/patients/{patient_id}/readings", params)
+                cursor = page['next_cursor']
+                self.stats['pages'] += 1
+                self.stats['readings_fetched'] += len(page['readings'])
+                if page['readings']:
+                    await out.put((series_id, patient_id, cursor, page['readings']))
+                if not page['has_more']:
+                    break
+        except (requests.RequestException, RuntimeError, KeyError, ValueError) as e:
+            print(f"Failed to poll patient {patient_id}: {type(e).__name__}: {e}")
+            self.stats['patients_failed'] += 1
+            count('feed.patients_failed')
+            return
+        self.cursors[patient_id] = (series_id, cursor)
+
+    async def writer(self, pages):
+        """Write queued pages in batches of up to batch_rows readings."""
+        while True:
+            batch = [await pages.get()]
+            n_rows = len(batch[0][3])
+            while n_rows < self.batch_rows and not pages.empty():
+                batch.append(pages.get_nowait())
+                n_rows += len(batch[-1][3])
+            self.stats['readings_written'] += await self.db(write_pages, self.conn, batch)
+            for _ in batch:
+                pages.task_done()
+
+    async def _unless_writer_fails(self, writer, awaitable):
+        """Await while the writer runs; a failed write is raised here instead of stalling the poll."""
+        task = asyncio.ensure_future(awaitable)
+        await asyncio.wait({task, writer}, return_when=asyncio.FIRST_COMPLETED)
+        if writer.done() and not task.done():
+            task.cancel()
+            writer.result()
+        return await task
+
+    async def poll_once(self):
+        """One polling cycle over every patient the feed lists."""
+        patients = (await self.get_json("/v1/patients"))['patients']
+        pages = asyncio.Queue(maxsize=256)
+        writer = asyncio.create_task(self.writer(pages))
+        try:
+            with span('feed.poll'):
+                await self._unless_writer_fails(writer, asyncio.gather(*(self.poll_patient(p, pages) for p in patients)))
+                await self._unless_writer_fails(writer, pages.join())
+        finally:
+            writer.cancel()
+        return len(patients)
+
+    async def run(self, poll_seconds=60.0, cycles=None):
+        """Poll every poll_seconds, forever or for a number of cycles."""
+        await self.db(self._open)
+        try:
+            cycle = 0
+            while cycles is None or cycle < cycles:
+                start = time.perf_counter()
+                n_patients = await self.poll_once()
+                elapsed = time.perf_counter() - start
+                print(f"Polled {n_patients} patients in {elapsed:.2f}s: {self.stats}")
+                cycle += 1
+                if cycles is None or cycle < cycles:
+                    await asyncio.sleep(max(0.0, poll_seconds - elapsed))
+        finally:
+            await self.db(self.conn.close)
+            self.http_threads.shutdown()
+            self.db_thread.shutdown()
+            self.session.close()
+
+def main():
+    profile_from_env()
+    # Configuration
+    base_url = "http://127.0.0.1:8060"  # vendor_feed_server.py
+    db_name = "cgm.db"
+    poll_seconds = 30.0
+    concurrency = 16
+    rate_limit = (150, 30)  # stay under the server's 200 requests per second
+
+    client = FeedClient(base_url, db_name, concurrency=concurrency, rate_limit=rate_limit)
+    try:
+        asyncio.run(client.run(poll_seconds))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import bisect
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from generate_synthetic import synthetic_patient
+
+# Stand-in for a vendor cloud readings API, serving deterministic synthetic
+# patients. Readings "arrive" in real time (optionally sped up) so pollers see
+# the feed grow between requests.
+
+def build_feed(n_patients, n_days, seed=42):
+    """{patient_id: (epoch seconds list, [{systemTime, value}, ...])} of synthetic readings."""
+    feed = {}
+    for i in range(n_patients):
+        patient = synthetic_patient(seed + i, n_days)
+        readings = [{'systemTime': dt.isoformat(), 'value': int(bg)}
+                    for dt, bg in zip(patient['times'], patient['glucose'])]
+        feed[f"SYN-{i:04d}"] = ([dt.timestamp() for dt in patient['times']], readings)
+    return feed
+
+class TokenBucket:
+    """Thread-safe token bucket; take() is False when the caller should be throttled."""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+class FeedServer(ThreadingHTTPServer):
+    request_queue_size = 128
+    daemon_threads = True
+
+    def __init__(self, address, feed, initial_days=1.0, speedup=60.0, rate_limit=None, latency_ms=0.0,
+                 page_limit=1000):
+        super().__init__(address, make_handler())
+        self.feed = feed
+        self.started = time.time()
+        self.data_start = min(times[0] for times, _ in feed.values())
+        self.initial_seconds = initial_days * 86400
+        self.speedup = speedup
+        self.bucket = TokenBucket(*rate_limit) if rate_limit else None
+        self.latency = latency_ms / 1000
+        self.page_limit = page_limit
+        self.requests = 0
+
+    def available_until(self):
+        """Epoch time of the newest reading the 'vendor' has received so far."""
+        return self.data_start + self.initial_seconds + (time.time() - self.started) * self.speedup
+
+def make_handler():
+    class FeedHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _send_json(self, status, payload, headers=None):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            server = self.server
+            server.requests += 1
+            if server.bucket is not None and not server.bucket.take():
+                self._send_json(429, {'error': 'rate limit exceeded'}, {'Retry-After': '1'})
+                return
+            if server.latency:
+                time.sleep(server.latency)
+
+            url = urlparse(self.path)
+            parts = url.path.strip('/').split('/')
+            if parts == ['v1', 'patients']:
+                self._send_json(200, {'patients': sorted(server.feed)})
+            elif len(parts) == 4 and parts[:2] == ['v1', 'patients'] and parts[3] == 'readings':
+                self._readings(parts[2], parse_qs(url.query))
+            else:
+                self._send_json(404, {'error': 'not found'})
+
+        def _readings(self, patient_id, params):
+            server = self.server
+            if patient_id not in server.feed:
+                self._send_json(404, {'error': f'unknown patient {patient_id}'})
+                return
+            try:
+                # The cursor is opaque to clients; here it is simply a position in the patient's stream
+                position = int(params.get('cursor', ['0'])[0] or 0)
+                limit = min(int(params.get('limit', [server.page_limit])[0]), server.page_limit)
+            except ValueError:
+                self._send_json(400, {'error': 'bad cursor or limit'})
+                return
+            times, readings = server.feed[patient_id]
+            available = bisect.bisect_right(times, server.available_until())
+            end = min(position + limit, available)
+            self._send_json(200, {
+                'patient_id': patient_id,
+                'unit': 'mg/dL',
+                'readings': readings[position:end] if end > position else [],
+                'next_cursor': str(max(end, position)),
+                'has_more': end < available,
+            })
+
+        def log_message(self, format, *args):
+            pass
+
+    return FeedHandler
+
+def main():
+    # Configuration
+    host = "127.0.0.1"
+    port = 8060
+    n_patients = 50
+    n_days = 14
+    initial_days = 1.0   # history available when the server starts
+    speedup = 60.0       # one real second delivers a minute of new readings
+    rate_limit = (200, 50)  # requests per second, burst
+
+    feed = build_feed(n_patients, n_days)
+    server = FeedServer((host, port), feed, initial_days=initial_days, speedup=speedup, rate_limit=rate_limit)
+    print(f"Serving {n_patients} synthetic patients on http://{host}:{port}/v1/patients")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Handled {server.requests} requests")
+
+if __name__ == "__main__":
+    main()